@@ -4,9 +4,13 @@
 import os
 import re
 import time
+import traceback
 from collections import defaultdict
 from contextlib import contextmanager, suppress
 from functools import partial
+from io import BytesIO
+from queue import Empty, Full, Queue
+from threading import Event, Thread
 from typing import Any
 
 from calibre import prints
@@ -265,6 +269,193 @@ def recursive_import(db, root, single_book_per_directory=True, callback=None, ad
     return duplicates
 
 
+def read_cover_from_opf(formats):
+    "Return the cover data referred to by an OPF file in formats, if any"
+    from calibre.ebooks.metadata.meta import get_metadata
+
+    cover_data = None
+    for fmt in formats:
+        if fmt.lower().endswith('.opf'):
+            with open(fmt, 'rb') as f:
+                mi = get_metadata(f, stream_type='opf')
+            if mi.cover_data and mi.cover_data[1]:
+                cover_data = mi.cover_data[1]
+            elif mi.cover:
+                try:
+                    with open(mi.cover, 'rb') as f:
+                        cover_data = f.read()
+                except OSError:
+                    pass
+    return cover_data
+
+
+def iter_metadata_in_parallel(file_groups, tdir, max_workers=None, read_ahead=None, abort=None):
+    """
+    Read the metadata for groups of files in a pool of worker processes. Each
+    item in file_groups is a list of the paths of the files that make up one
+    book. file_groups can be lazy, such as the result of
+    :func:`cdb_recursive_find`, it is consumed in a separate thread, at most
+    read_ahead groups ahead of the worker processes. Yields ``(paths, mi,
+    error)`` in the order that reading the metadata finishes, where paths
+    are the files after import plugins have been run on them and mi is None
+    if reading the metadata failed. Files created by import plugins and
+    cover images are placed in tdir.
+    """
+    from calibre.ebooks.metadata.opf2 import OPF
+    from calibre.utils.ipc.pool import Failure, Pool
+
+    pool = Pool(max_workers=max_workers, name='ImportBooks')
+    window = 2 * pool.max_workers
+    read_ahead = read_ahead or 4 * window
+    groups, results = Queue(maxsize=read_ahead), Queue(maxsize=read_ahead)
+    stop = Event()
+    done = object()
+
+    def put(q, item):
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except Full:
+                pass
+        return False
+
+    def scan():
+        try:
+            for group_id, paths in enumerate(file_groups):
+                if not put(groups, (group_id, list(paths))):
+                    break
+        except Exception:
+            put(results, ((), None, traceback.format_exc()))
+        finally:
+            put(groups, done)
+
+    def dispatch():
+        pending, scanning = {}, True
+        try:
+            while not stop.is_set() and (scanning or pending):
+                while scanning and len(pending) < window:
+                    try:
+                        item = groups.get(True, 0 if pending else 0.1)
+                    except Empty:
+                        break
+                    if item is done:
+                        scanning = False
+                        break
+                    group_id, paths = item
+                    pending[group_id] = paths
+                    pool(group_id, 'calibre.ebooks.metadata.worker', 'read_metadata', paths, group_id, tdir)
+                if not pending:
+                    continue
+                try:
+                    wr = pool.results.get(True, 0.1)
+                except Empty:
+                    if pool.failed:
+                        raise Failure(pool.terminal_failure)
+                    continue
+                pool.results.task_done()
+                paths = pending.pop(wr.id)
+                if wr.is_terminal_failure:
+                    put(results, (paths, None, 'The worker process crashed while reading metadata'))
+                elif wr.result.err is not None:
+                    put(results, (paths, None, wr.result.traceback))
+                else:
+                    put(results, (wr.id,) + tuple(wr.result.value[:3]))
+        except Exception:
+            put(results, ((), None, traceback.format_exc()))
+        finally:
+            put(results, done)
+
+    threads = Thread(target=scan, name='ImportBooksScan', daemon=True), Thread(target=dispatch, name='ImportBooksDispatch', daemon=True)
+    for t in threads:
+        t.start()
+    try:
+        while abort is None or not abort.is_set():
+            try:
+                item = results.get(True, 0.1)
+            except Empty:
+                continue
+            if item is done:
+                break
+            if len(item) == 3:
+                yield item
+                continue
+            group_id, paths, opf, has_cover = item
+            try:
+                mi = OPF(BytesIO(opf), basedir=tdir, populate_spine=False, try_to_guess_cover=False).to_book_metadata()
+            except Exception:
+                yield paths, None, traceback.format_exc()
+                continue
+            if mi.is_null('title'):
+                mi.title = os.path.splitext(os.path.basename(paths[0]))[0] if paths else _('Unknown')
+            if mi.application_id == '__calibre_dummy__':
+                mi.application_id = None
+            cover_data = None
+            if has_cover:
+                with open(os.path.join(tdir, f'{group_id}.cdata'), 'rb') as f:
+                    cover_data = f.read()
+            else:
+                cover_data = read_cover_from_opf(paths)
+            if cover_data:
+                mi.cover_data = 'jpeg', cover_data
+            yield paths, mi, None
+    finally:
+        stop.set()
+        for t in threads:
+            t.join()
+        pool.shutdown()
+
+
+def import_books_in_parallel(cache, file_groups, add_duplicates=False, callback=None, max_workers=None, abort=None):
+    """
+    Add books to the library, overlapping the scanning of folders, the reading
+    of metadata and covers in a pool of worker processes (see
+    :func:`iter_metadata_in_parallel`) and the insertion of books into the
+    database (see :meth:`calibre.db.cache.Cache.bulk_add_books`). Each item
+    in file_groups is a list of the paths of the files that make up one
+    book. Duplicates are detected as for ``calibredb add``, by title and
+    authors. callback, if specified, is called as ``callback(mi, book_id)``
+    for every book, book_id is None if the book was not added.
+
+    Returns ``(added_ids, duplicates, failures)``, duplicates is a list of
+    ``(mi, paths)`` and failures a list of ``(paths, error)``.
+    """
+    from calibre.db.utils import fuzzy_title
+    from calibre.ptempfile import TemporaryDirectory
+
+    duplicates, failures = [], []
+    # Map of fuzzy title to authors for books queued for adding
+    queued = defaultdict(list)
+
+    def is_duplicate(mi):
+        if add_duplicates:
+            return False
+        if cache.find_identical_books(mi):
+            return True
+        title, authors = fuzzy_title(mi.title), {icu_lower(a) for a in mi.authors}
+        if any(authors.issubset(x) for x in queued[title]):
+            return True
+        queued[title].append(authors)
+        return False
+
+    def books(tdir):
+        for paths, mi, error in iter_metadata_in_parallel(file_groups, tdir, max_workers=max_workers, abort=abort):
+            if mi is None:
+                failures.append((paths, error))
+            elif is_duplicate(mi):
+                duplicates.append((mi, paths))
+            else:
+                yield mi, create_format_map(paths)
+                continue
+            if callback is not None:
+                callback(mi, None)
+
+    with TemporaryDirectory('import-books') as tdir:
+        ids, dups, bulk_failures = cache.bulk_add_books(books(tdir), add_duplicates=True, run_hooks=False, progress=callback, abort=abort)
+    failures.extend((list(format_map.values()), error) for mi, format_map, error in bulk_failures)
+    return ids, duplicates, failures
+
+
 def cdb_find_in_dir(dirpath, single_book_per_directory, compiled_rules):
     return find_books_in_directory(
         dirpath,
@@ -1940,6 +1940,9 @@ def cover_timestamp(self, path: str) -> float | None:
             return None
         return stat.st_mtime
 
+    def cover_path(self, path):
+        return os.path.abspath(os.path.join(self.library_path, path, COVER_FILE_NAME))
+
     def compress_covers(self, path_map, jpeg_quality, progress_callback):
         cpath_map = {}
         if not progress_callback:
@@ -1957,7 +1960,7 @@ def progress_callback(book_id, old_sz, new_sz):
                 cpath_map[book_id] = (path, sz)
         from calibre.db.covers import compress_covers
 
-        compress_covers(cpath_map, jpeg_quality, progress_callback)
+        return compress_covers(cpath_map, jpeg_quality, progress_callback)
 
     def set_cover(self, book_id, path, data, no_processing=False):
         path = os.path.abspath(os.path.join(self.library_path, path))
@@ -2355,8 +2358,11 @@ def add_extra_file(self, relpath, stream, book_path, replace=True, auto_rename=F
                 shutil.copyfileobj(stream, d)
         return os.path.relpath(dest, bookdir).replace(os.sep, '/')
 
-    def write_backup(self, path, raw):
+    def write_backup(self, path, raw, atomic=False):
         path = os.path.abspath(os.path.join(self.library_path, path, METADATA_FILE_NAME))
+        if atomic:
+            atomic_write(path, raw)
+            return
         try:
             with open(path, 'wb') as f:
                 f.write(raw)
@@ -2610,6 +2616,9 @@ def dirty_books(self, book_ids):
     def mark_book_as_clean(self, book_id):
         self.execute('DELETE FROM metadata_dirtied WHERE book=?', (book_id,))
 
+    def mark_books_as_clean(self, book_ids):
+        self.executemany('DELETE FROM metadata_dirtied WHERE book=?', ((x,) for x in book_ids))
+
     def get_ids_for_custom_book_data(self, name):
         return frozenset(r[0] for r in self.execute('SELECT book FROM books_plugin_data WHERE name=?', (name,)))
 
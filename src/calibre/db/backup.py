@@ -4,6 +4,8 @@
 import sys
 import traceback
 import weakref
+from itertools import count
+from queue import Empty
 from threading import Event, Thread
 
 from calibre.ebooks.metadata.opf2 import metadata_to_opf
@@ -18,14 +20,43 @@ class Abort(Exception):
     pass
 
 
+def opfs_from_metadata(items):
+    """Generate OPF data for metadata serialized by :func:`metadata_as_dict`.
+    This is run in a worker process by :class:`MetadataBackup`."""
+    from calibre.ebooks.metadata.book.serialize import metadata_from_dict
+
+    ans = []
+    for book_id, mi_dict, cover, all_annotations in items:
+        try:
+            mi = metadata_from_dict(mi_dict)
+            mi.cover = cover
+            mi.all_annotations = all_annotations
+            ans.append((book_id, metadata_to_opf(mi), None))
+        except Exception:
+            ans.append((book_id, None, traceback.format_exc()))
+    return ans
+
+
 class MetadataBackup(Thread):
     """
     Continuously backup changed metadata into OPF files
     in the book directory. This class runs in its own
     thread.
+
+    By default one book is backed up every interval seconds. If batch_size
+    is greater than zero, books are instead backed up in batches of that
+    size, see :meth:`do_batch`, and once more than pool_threshold books are
+    waiting, the OPF files are generated in a pool of max_workers worker
+    processes. Set max_workers to zero to never use worker processes. A book
+    whose OPF file cannot be written is retried after the other books, and
+    dropped from the queue after max_failures attempts.
     """
 
-    def __init__(self, db, interval=2, scheduling_interval=0.1):
+    max_failures = 5
+    # The function in this module that generates OPF data in the worker processes
+    worker_function = 'opfs_from_metadata'
+
+    def __init__(self, db, interval=2, scheduling_interval=0.1, batch_size=0, max_workers=None, pool_threshold=1000):
         super().__init__(name='MetadataBackup', daemon=True)
         self.daemon = True
         self._db = weakref.ref(getattr(db, 'new_api', db))
@@ -33,6 +64,16 @@ def __init__(self, db, interval=2, scheduling_interval=0.1):
         self.interval = interval
         self.scheduling_interval = scheduling_interval
         self.check_dirtied_annotations = 0
+        self.batch_size = batch_size
+        self.max_workers = max_workers
+        self.pool_threshold = pool_threshold
+        self.pool = None
+        self.job_counter = count()
+        # The number of books waiting to be backed up, as of the last batch
+        self.queue_depth = 0
+        self.backoff = 0
+        # Number of failed attempts to write the backup of a book
+        self.failures = {}
 
     @property
     def db(self):
@@ -49,15 +90,23 @@ def wait(self, interval):
             raise Abort()
 
     def run(self):
-        while not self.stop_running.is_set():
-            try:
-                if self.wait(self.interval):
+        try:
+            while not self.stop_running.is_set():
+                try:
+                    if self.batch_size > 0:
+                        if self.wait(self.backoff if self.queue_depth else self.interval):
+                            break
+                        self.do_batch()
+                    else:
+                        if self.wait(self.interval):
+                            break
+                        self.do_one()
+                except Abort:
                     break
-                self.do_one()
-            except Abort:
-                break
+        finally:
+            self.shutdown_pool()
 
-    def do_one(self):
+    def check_annotations(self):
         self.check_dirtied_annotations += 1
         if self.check_dirtied_annotations > 2:
             self.check_dirtied_annotations = 0
@@ -65,8 +114,13 @@ def do_one(self):
                 self.db.check_dirtied_annotations()
             except Exception:
                 if self.stop_running.is_set() or self.db.is_closed:
-                    return
+                    return False
                 traceback.print_exc()
+        return True
+
+    def do_one(self):
+        if not self.check_annotations():
+            return
 
         try:
             book_id = self.db.get_a_dirtied_book()
@@ -127,6 +181,151 @@ def do_one(self):
 
         self.db.clear_dirtied(book_id, sequence)
 
+    def throttle(self):
+        """
+        Adapt the delay between steps of a batch to contention for the
+        database lock. While foreground threads are using the database the
+        delay grows exponentially, up to interval, otherwise it shrinks back
+        to zero.
+        """
+        if self.db.write_lock.num_users:
+            self.backoff = min(self.interval, max(self.scheduling_interval, 2 * self.backoff))
+        else:
+            self.backoff /= 2
+            if self.backoff < self.scheduling_interval:
+                self.backoff = 0
+        self.wait(self.backoff)
+
+    def do_batch(self):
+        """
+        Backup the metadata of up to batch_size books, the ones waiting the
+        longest first. Metadata is read for the whole batch at once, the OPF
+        files are written with atomic renames and the books are marked as
+        clean in a single transaction.
+        """
+        if not self.check_annotations():
+            return
+        db = self.db
+        try:
+            self.queue_depth = db.dirty_queue_length()
+            if not self.queue_depth:
+                self.shutdown_pool()
+                return
+            book_ids = db.get_dirtied_books(self.batch_size)
+        except Abort:
+            raise
+        except Exception:
+            # Happens during interpreter shutdown
+            return
+
+        self.throttle()
+        try:
+            dump = db.get_metadata_for_dump_batch(book_ids)
+        except Exception:
+            prints('Failed to get backup metadata for ids:', book_ids)
+            traceback.print_exc()
+            self.backoff = self.interval
+            return
+        sequences = {book_id: sequence for book_id, (mi, sequence) in dump.items()}
+        mi_map = {book_id: mi for book_id, (mi, sequence) in dump.items() if mi is not None}
+
+        self.throttle()
+        raw_map = self.generate_opfs(mi_map)
+
+        self.throttle()
+        failed = db.write_backups(raw_map) if raw_map else set()
+        retry = set()
+        for book_id in sequences:
+            if book_id in failed:
+                self.failures[book_id] = num = self.failures.get(book_id, 0) + 1
+                if num < self.max_failures:
+                    retry.add(book_id)
+                else:
+                    prints('Failed to write backup metadata for id:', book_id, num, 'times, giving up')
+                    del self.failures[book_id]
+            else:
+                self.failures.pop(book_id, None)
+        if retry:
+            # Move these books to the back of the queue so they do not hold up
+            # the rest, and do not retry them immediately
+            db.requeue_dirtied(retry)
+            self.backoff = max(self.backoff, self.interval)
+        db.clear_dirtied_batch({book_id: sequence for book_id, sequence in sequences.items() if book_id not in retry})
+        self.queue_depth = max(0, self.queue_depth - len(sequences) + len(retry))
+
+    def generate_opfs(self, mi_map):
+        """Return a map of book_id to OPF data. Books for which the OPF could
+        not be generated are left out."""
+        if len(mi_map) > 1 and self.max_workers != 0 and self.queue_depth >= self.pool_threshold:
+            from calibre.utils.ipc.pool import Failure
+
+            try:
+                return self.generate_opfs_in_pool(mi_map)
+            except Failure as err:
+                prints('Metadata backup worker process failed:', err.failure_message)
+                if err.details:
+                    prints(err.details)
+                self.shutdown_pool()
+        return self.generate_opfs_serially(mi_map)
+
+    def generate_opfs_serially(self, mi_map):
+        ans = {}
+        for book_id, mi in mi_map.items():
+            try:
+                ans[book_id] = metadata_to_opf(mi)
+            except Exception:
+                prints('Failed to convert to opf for id:', book_id)
+                traceback.print_exc()
+            self.wait(0)
+        return ans
+
+    def generate_opfs_in_pool(self, mi_map):
+        from calibre.ebooks.metadata.book.serialize import metadata_as_dict
+        from calibre.utils.ipc.pool import Failure, Pool, TerminalFailure
+
+        if self.pool is None:
+            self.pool = Pool(max_workers=self.max_workers, name='MetadataBackupPool')
+        pool = self.pool
+        items = [(book_id, metadata_as_dict(mi), mi.cover, getattr(mi, 'all_annotations', None)) for book_id, mi in mi_map.items()]
+        chunk_size = -(-len(items) // pool.max_workers)
+        pending = {}
+        for i in range(0, len(items), chunk_size):
+            job_id = next(self.job_counter)
+            pending[job_id] = chunk = items[i : i + chunk_size]
+            pool(job_id, __name__, self.worker_function, chunk)
+        ans = {}
+        while pending:
+            try:
+                wr = pool.results.get(True, 0.1)
+            except Empty:
+                if pool.failed:
+                    raise Failure(pool.terminal_failure)
+                self.wait(0)
+                continue
+            pool.results.task_done()
+            chunk = pending.pop(wr.id, None)
+            if chunk is None:
+                continue
+            if wr.is_terminal_failure:
+                raise Failure(pool.terminal_failure or TerminalFailure('Worker process crashed', None, wr.id))
+            if wr.result.err is not None:
+                prints('Failed to generate OPFs in worker process:', wr.result.err)
+                prints(wr.result.traceback)
+                ans.update(self.generate_opfs_serially({book_id: mi_map[book_id] for book_id, *rest in chunk}))
+                continue
+            for book_id, raw, tb in wr.result.value:
+                if raw is None:
+                    prints('Failed to convert to opf for id:', book_id)
+                    prints(tb)
+                else:
+                    ans[book_id] = raw
+        return ans
+
+    def shutdown_pool(self):
+        if self.pool is not None:
+            pool, self.pool = self.pool, None
+            pool.shutdown()
+
     def break_cycles(self):
         # Legacy compatibility
         pass
@@ -2,6 +2,7 @@
 # License: GPLv3 Copyright: 2011, Kovid Goyal <kovid@kovidgoyal.net>
 
 import hashlib
+import heapq
 import operator
 import os
 import random
@@ -21,7 +22,7 @@
 from time import mktime, monotonic, time
 from typing import Any, NamedTuple
 
-from calibre import as_unicode, detect_ncpus
+from calibre import detect_ncpus
 from calibre.constants import iswindows, preferred_encoding
 from calibre.customize.ui import run_plugins_on_import, run_plugins_on_postadd, run_plugins_on_postdelete, run_plugins_on_postimport
 from calibre.db import SPOOL_SIZE, _get_next_series_num_for_list
@@ -45,7 +46,7 @@
 from calibre.ebooks.metadata.opf2 import metadata_to_opf
 from calibre.ptempfile import PersistentTemporaryFile, SpooledTemporaryFile, base_dir
 from calibre.utils.config import prefs, tweaks
-from calibre.utils.date import UNDEFINED_DATE, is_date_undefined, timestampfromdt, utcnow
+from calibre.utils.date import UNDEFINED_DATE, is_date_undefined, utcnow
 from calibre.utils.date import now as nowf
 from calibre.utils.filenames import make_long_path_useable
 from calibre.utils.icu import lower as icu_lower
@@ -107,6 +108,41 @@ def run_import_plugins(path_or_stream, fmt):
     return run_plugins_on_import(path, fmt)
 
 
+def copy_file_for_add(stream_or_path, dest, copy_function=None):
+    if hasattr(stream_or_path, 'read'):
+        with open(make_long_path_useable(dest), 'wb') as f:
+            shutil.copyfileobj(stream_or_path, f)
+            return f.tell()
+    (copy_function or shutil.copyfile)(make_long_path_useable(stream_or_path), make_long_path_useable(dest))
+    return os.path.getsize(make_long_path_useable(dest))
+
+
+class BulkAddJob(NamedTuple):
+    book_id: int
+    mi: Metadata
+    format_map: dict
+    path: str
+    # List of (fmt, stream_or_path, fname, dest)
+    files: list
+    cover: bytes | str | None
+
+
+def write_files_for_bulk_add(backend, job, copy_function=None):
+    # Run in a thread pool, without the write lock held, see Cache.bulk_add_books()
+    os.makedirs(make_long_path_useable(os.path.join(backend.library_path, job.path)), exist_ok=True)
+    sizes = {fmt: copy_file_for_add(src, dest, copy_function) for fmt, src, fname, dest in job.files}
+    cover = job.cover
+    if isinstance(cover, str):
+        try:
+            with open(make_long_path_useable(cover), 'rb') as f:
+                cover = f.read()
+        except OSError:
+            cover = None
+    if cover:
+        backend.set_cover(job.book_id, job.path, cover)
+    return sizes, bool(cover)
+
+
 def _add_newbook_tag(mi):
     tags = prefs['new_book_tags']
     if tags:
@@ -179,6 +215,10 @@ def __init__(self, backend, library_database_instance=None):
         self.vls_for_books_cache = None
         self.vls_for_books_lib_in_process = None
         self.vls_cache_lock = Lock()
+        self.duplicate_index = None
+        self.duplicate_index_lock = Lock()
+        self.device_match_index = None
+        self.device_match_index_lock = Lock()
         self.dirtied_sequence = 0
         self.cover_caches = set()
         self.clear_search_cache_count = 0
@@ -362,6 +402,8 @@ def reload_from_db(self, clear_caches=True):
             for field in self.fields.values():
                 if hasattr(field, 'table'):
                     field.table.read(self.backend)  # Reread data from metadata.db
+        self.duplicate_index = None
+        self.device_match_index = None
 
     _reload_from_db = reload_from_db
 
@@ -1471,6 +1513,9 @@ def compress_covers(self, book_ids, jpeg_quality=100, progress_callback=None):
         The progress callback will be called with the book_id and the old and new sizes
         for each book that has been processed. If an error occurs, the new size will
         be a string with the error details.
+
+        The covers are compressed in a pool of worker processes. Returns the
+        set of book ids whose covers were changed.
         """
         jpeg_quality = max(10, min(jpeg_quality, 100))
         path_map = {}
@@ -1479,10 +1524,45 @@ def compress_covers(self, book_ids, jpeg_quality=100, progress_callback=None):
                 path_map[book_id] = self._get_book_path(book_id)
             except AttributeError, KeyError:
                 continue
-        self.backend.compress_covers(path_map, jpeg_quality, progress_callback)
+        changed = self.backend.compress_covers(path_map, jpeg_quality, progress_callback)
+        if changed:
+            for cc in self.cover_caches:
+                cc.invalidate(changed)
+            self._update_last_modified(changed)
+        return changed
 
     _compress_covers = compress_covers
 
+    @api
+    def scale_covers(self, book_ids, dest_dir, width=60, height=80, compression_quality=70, as_png=False, progress_callback=None, abort=None):
+        """
+        Create scaled copies of the covers of the specified books in dest_dir,
+        for example, to use as thumbnails on a device. The copies are named
+        ``<book_id>.jpg`` (or ``.png`` if as_png is True) and fit in width x
+        height, preserving the aspect ratio. The images are scaled in a pool
+        of worker processes, without holding the database lock.
+
+        The progress callback will be called with the book_id and either the
+        size of the scaled image or a string with error details.
+        Returns a mapping of book_id to the path of the scaled cover, for
+        all books that have a cover and were scaled successfully.
+        """
+        from calibre.db.covers import process_covers
+
+        ext = '.png' if as_png else '.jpg'
+        operation = 'scale', width, height, compression_quality, as_png
+        tasks = []
+        with self.safe_read_lock:
+            for book_id in book_ids:
+                try:
+                    path = self._get_book_path(book_id)
+                except AttributeError, KeyError:
+                    continue
+                if self._field_for('cover', book_id):
+                    tasks.append((book_id, self.backend.cover_path(path), os.path.join(dest_dir, f'{book_id}{ext}'), operation))
+        results = process_covers(tasks, progress_callback=progress_callback, abort=abort)
+        return {book_id: dest for book_id, src, dest, op in tasks if isinstance(results.get(book_id), int)}
+
     @read_api
     def copy_format_to(self, book_id, fmt, dest, use_hardlink=False, report_file_size=None):
         """
@@ -1913,7 +1993,7 @@ def check_dirtied_annotations(self):
     _check_dirtied_annotations = check_dirtied_annotations
 
     @write_api
-    def set_field(self, name, book_id_to_val_map, allow_case_change=True, do_path_update=True):
+    def set_field(self, name, book_id_to_val_map, allow_case_change=True, do_path_update=True, mark_as_dirtied=True):
         """
         Set the values of the field specified by ``name``. Returns the set of all book ids that were affected by the change.
 
@@ -1923,6 +2003,7 @@ def set_field(self, name, book_id_to_val_map, allow_case_change=True, do_path_up
             then the both books will have the tag ``Tag1`` if allow_case_change is True, otherwise they will
             both have the tag ``tag1``.
         :param do_path_update: Used internally, you should never change it.
+        :param mark_as_dirtied: Used internally, you should never change it.
         """
         f = self.fields[name]
         is_series = f.metadata['datatype'] == 'series'
@@ -1956,7 +2037,12 @@ def set_field(self, name, book_id_to_val_map, allow_case_change=True, do_path_up
         if dirtied:
             if update_path and do_path_update:
                 self._update_path(dirtied, mark_as_dirtied=False)
-            self._mark_as_dirty(dirtied)
+            if name in ('title', 'identifiers'):
+                self._update_duplicate_index(dirtied)
+            if name in ('title', 'authors', 'author_sort', 'uuid'):
+                self._update_device_match_index(dirtied)
+            if mark_as_dirtied:
+                self._mark_as_dirty(dirtied)
             self._clear_link_map_cache(dirtied)
             self.event_dispatcher(EventType.metadata_changed, name, dirtied)
         return dirtied
@@ -2081,9 +2167,9 @@ def update_path(self, book_ids, mark_as_dirtied=True):
                 author = _('Unknown')
             self.backend.update_path(book_id, title, author, self.fields['path'], self.fields['formats'])
             self.format_metadata_cache.pop(book_id, None)
-            if mark_as_dirtied:
-                self._mark_as_dirty(book_ids)
-            self._clear_link_map_cache(book_ids)
+        if mark_as_dirtied:
+            self._mark_as_dirty(book_ids)
+        self._clear_link_map_cache(book_ids)
 
     _update_path = update_path
 
@@ -2125,6 +2211,30 @@ def get_metadata_for_dump(self, book_id):
 
     _get_metadata_for_dump = get_metadata_for_dump
 
+    @read_api
+    def get_dirtied_books(self, limit=None):
+        """Return up to limit dirtied book ids, the books that have been waiting
+        the longest for their metadata to be backed up come first."""
+        if limit is None:
+            return sorted(self.dirtied_cache, key=self.dirtied_cache.__getitem__)
+        return heapq.nsmallest(limit, self.dirtied_cache, key=self.dirtied_cache.__getitem__)
+
+    @write_api
+    def requeue_dirtied(self, book_ids):
+        """Move the specified dirtied books to the back of the backup queue.
+        Unlike :meth:`mark_as_dirty` this does not change their last modified
+        date."""
+        for book_id in book_ids:
+            if book_id in self.dirtied_cache:
+                self.dirtied_cache[book_id] = self.dirtied_sequence
+                self.dirtied_sequence += 1
+
+    @read_api
+    def get_metadata_for_dump_batch(self, book_ids):
+        """Same as :meth:`get_metadata_for_dump` for many books at once, returns
+        a map of book_id to (mi, sequence)."""
+        return {book_id: self._get_metadata_for_dump(book_id) for book_id in book_ids}
+
     @write_api
     def clear_dirtied(self, book_id, sequence):
         # Clear the dirtied indicator for the books. This is used when fetching
@@ -2137,6 +2247,20 @@ def clear_dirtied(self, book_id, sequence):
 
     _clear_dirtied = clear_dirtied
 
+    @write_api
+    def clear_dirtied_batch(self, book_id_sequence_map):
+        """Same as :meth:`clear_dirtied` for many books at once, the books are
+        marked as clean in a single transaction."""
+        clean = set()
+        for book_id, sequence in book_id_sequence_map.items():
+            dc_sequence = self.dirtied_cache.get(book_id, None)
+            if dc_sequence is None or sequence is None or dc_sequence == sequence:
+                clean.add(book_id)
+        if clean:
+            self.backend.mark_books_as_clean(clean)
+            for book_id in clean:
+                self.dirtied_cache.pop(book_id, None)
+
     @write_api
     def write_backup(self, book_id, raw):
         try:
@@ -2148,6 +2272,24 @@ def write_backup(self, book_id, raw):
 
     _write_backup = write_backup
 
+    @write_api
+    def write_backups(self, book_id_raw_map):
+        """Write the OPF backups for many books. Each file is replaced
+        atomically. Returns the set of book ids whose backup could not be
+        written."""
+        failed = set()
+        for book_id, raw in book_id_raw_map.items():
+            try:
+                path = self._get_book_path(book_id)
+            except Exception:
+                continue
+            try:
+                self.backend.write_backup(path, raw, atomic=True)
+            except Exception:
+                traceback.print_exc()
+                failed.add(book_id)
+        return failed
+
     @read_api
     def dirty_queue_length(self):
         return len(self.dirtied_cache)
@@ -2262,116 +2404,177 @@ def set_metadata(
         provided, but are never deleted. Also note that force_changes has no
         effect on setting title or authors.
         """
+        return self._set_metadata_for_books(
+            {book_id: mi},
+            ignore_errors=ignore_errors,
+            force_changes=force_changes,
+            set_title=set_title,
+            set_authors=set_authors,
+            allow_case_change=allow_case_change,
+        )
+
+    _set_metadata = set_metadata
+
+    @write_api
+    def set_metadata_for_books(
+        self,
+        book_id_map,
+        ignore_errors=False,
+        force_changes=False,
+        set_title=True,
+        set_authors=True,
+        allow_case_change=False,
+    ):
+        """
+        Same as :meth:`set_metadata` for many books at once. book_id_map is a
+        mapping of book id to :class:`Metadata` object. The changes are grouped
+        by field, so that every field is set with a single call to
+        :meth:`set_field` for all the books, and the books are marked as dirtied
+        and their paths updated only once. Returns the set of changed book ids.
+        """
         dirtied = set()
+        mi_map = {}
+        for book_id, mi in book_id_map.items():
+            try:
+                # Handle code passing in an OPF object instead of a Metadata object
+                mi = mi.to_book_metadata()
+            except AttributeError, TypeError:
+                pass
+            mi_map[book_id] = mi
 
-        try:
-            # Handle code passing in an OPF object instead of a Metadata object
-            mi = mi.to_book_metadata()
-        except AttributeError, TypeError:
-            pass
-
-        def set_field(name, val):
-            dirtied.update(self._set_field(name, {book_id: val}, do_path_update=False, allow_case_change=allow_case_change))
-
-        path_changed = False
-        if set_title and mi.title:
-            path_changed = True
-            set_field('title', mi.title)
-        authors_changed = False
+        def set_field(name, val_map):
+            dirtied.update(self._set_field(name, val_map, do_path_update=False, allow_case_change=allow_case_change, mark_as_dirtied=False))
+
+        def protected_set_field(name, val_map):
+            try:
+                set_field(name, val_map)
+            except Exception:
+                if not ignore_errors:
+                    raise
+                if len(val_map) == 1:
+                    traceback.print_exc()
+                    return
+                # Set the values one at a time to skip only the bad ones
+                for book_id, val in val_map.items():
+                    try:
+                        set_field(name, {book_id: val})
+                    except Exception:
+                        traceback.print_exc()
+
+        path_changed = set()
+        if set_title:
+            title_map = {book_id: mi.title for book_id, mi in mi_map.items() if mi.title}
+            if title_map:
+                path_changed.update(title_map)
+                set_field('title', title_map)
         if set_authors:
-            path_changed = True
-            if not mi.authors:
-                mi.authors = [_('Unknown')]
-            authors = []
-            for a in mi.authors:
-                authors += string_to_authors(a)
-            set_field('authors', authors)
-            authors_changed = True
+            path_changed.update(mi_map)
+            authors_map = {}
+            for book_id, mi in mi_map.items():
+                if not mi.authors:
+                    mi.authors = [_('Unknown')]
+                authors = []
+                for a in mi.authors:
+                    authors += string_to_authors(a)
+                authors_map[book_id] = authors
+            if authors_map:
+                set_field('authors', authors_map)
 
         if path_changed:
-            self._update_path({book_id})
+            self._update_path(path_changed)
 
-        def protected_set_field(name, val):
+        # force_changes has no effect on cover manipulation
+        cover_map = {}
+        for book_id, mi in mi_map.items():
             try:
-                set_field(name, val)
+                cdata = mi.cover_data[1]
+                if cdata is None and isinstance(mi.cover, (str, bytes)) and mi.cover and os.access(mi.cover, os.R_OK):
+                    with open(mi.cover, 'rb') as f:
+                        cdata = f.read() or None
+                if cdata is not None:
+                    cover_map[book_id] = cdata
+            except Exception:
+                if ignore_errors:
+                    traceback.print_exc()
+                else:
+                    raise
+        if cover_map:
+            try:
+                self._set_cover(cover_map)
             except Exception:
                 if ignore_errors:
                     traceback.print_exc()
                 else:
                     raise
 
-        # force_changes has no effect on cover manipulation
-        try:
-            cdata = mi.cover_data[1]
-            if cdata is None and isinstance(mi.cover, (str, bytes)) and mi.cover and os.access(mi.cover, os.R_OK):
-                with open(mi.cover, 'rb') as f:
-                    cdata = f.read() or None
-            if cdata is not None:
-                self._set_cover({book_id: cdata})
-        except Exception:
-            if ignore_errors:
-                traceback.print_exc()
-            else:
-                raise
+        # Group the changes by field, in the order in which set_metadata() has
+        # always applied them
+        changes = defaultdict(dict)
+        fm = self.field_metadata
+        for book_id, mi in mi_map.items():
+            for field in ('rating', 'series_index', 'timestamp'):
+                val = getattr(mi, field)
+                if val is not None:
+                    changes[field][book_id] = val
+
+            val = mi.get('author_sort', None)
+            if set_authors and (not val or mi.is_null('author_sort')):
+                val = self._author_sort_from_authors(mi.authors)
+            if set_authors or (force_changes and val is not None) or not mi.is_null('author_sort'):
+                changes['author_sort'][book_id] = val
+
+            for field in ('publisher', 'series', 'tags', 'comments', 'languages', 'pubdate'):
+                val = mi.get(field, None)
+                if (force_changes and val is not None) or not mi.is_null(field):
+                    changes[field][book_id] = val
+
+            val = mi.get('title_sort', None)
+            if (force_changes and val is not None) or not mi.is_null('title_sort'):
+                changes['sort'][book_id] = val
+
+            # identifiers will always be replaced if force_changes is True
+            mi_idents = mi.get_identifiers()
+            if force_changes:
+                changes['identifiers'][book_id] = mi_idents
+            elif mi_idents:
+                identifiers = self._field_for('identifiers', book_id, default_value={})
+                for key, val in mi_idents.items():
+                    if val and val.strip():  # Don't delete an existing identifier
+                        identifiers[icu_lower(key)] = val
+                changes['identifiers'][book_id] = identifiers
+
+            user_mi = mi.get_all_user_metadata(make_copy=False)
+            for key in user_mi:
+                if (
+                    key in fm
+                    and user_mi[key]['datatype'] == fm[key]['datatype']
+                    and (user_mi[key]['datatype'] != 'text' or (user_mi[key]['is_multiple'] == fm[key]['is_multiple']))
+                ):
+                    val = mi.get(key, None)
+                    if force_changes or val is not None:
+                        changes[key][book_id] = val
+                        idx = key + '_index'
+                        if idx in self.fields:
+                            extra = mi.get_extra(key)
+                            if extra is not None or force_changes:
+                                changes[idx][book_id] = extra
 
         try:
             with self.backend.conn:  # Speed up set_metadata by not operating in autocommit mode
-                for field in ('rating', 'series_index', 'timestamp'):
-                    val = getattr(mi, field)
-                    if val is not None:
-                        protected_set_field(field, val)
-
-                val = mi.get('author_sort', None)
-                if authors_changed and (not val or mi.is_null('author_sort')):
-                    val = self._author_sort_from_authors(mi.authors)
-                if authors_changed or (force_changes and val is not None) or not mi.is_null('author_sort'):
-                    protected_set_field('author_sort', val)
-
-                for field in ('publisher', 'series', 'tags', 'comments', 'languages', 'pubdate'):
-                    val = mi.get(field, None)
-                    if (force_changes and val is not None) or not mi.is_null(field):
-                        protected_set_field(field, val)
-
-                val = mi.get('title_sort', None)
-                if (force_changes and val is not None) or not mi.is_null('title_sort'):
-                    protected_set_field('sort', val)
-
-                # identifiers will always be replaced if force_changes is True
-                mi_idents = mi.get_identifiers()
-                if force_changes:
-                    protected_set_field('identifiers', mi_idents)
-                elif mi_idents:
-                    identifiers = self._field_for('identifiers', book_id, default_value={})
-                    for key, val in mi_idents.items():
-                        if val and val.strip():  # Don't delete an existing identifier
-                            identifiers[icu_lower(key)] = val
-                    protected_set_field('identifiers', identifiers)
-
-                user_mi = mi.get_all_user_metadata(make_copy=False)
-                fm = self.field_metadata
-                for key in user_mi:
-                    if (
-                        key in fm
-                        and user_mi[key]['datatype'] == fm[key]['datatype']
-                        and (user_mi[key]['datatype'] != 'text' or (user_mi[key]['is_multiple'] == fm[key]['is_multiple']))
-                    ):
-                        val = mi.get(key, None)
-                        if force_changes or val is not None:
-                            protected_set_field(key, val)
-                            idx = key + '_index'
-                            if idx in self.fields:
-                                extra = mi.get_extra(key)
-                                if extra is not None or force_changes:
-                                    protected_set_field(idx, extra)
+                for field, val_map in changes.items():
+                    protected_set_field(field, val_map)
         except Exception:
             # sqlite will rollback the entire transaction, thanks to the with
             # statement, so we have to re-read everything form the db to ensure
             # the db and Cache are in sync
             self._reload_from_db()
             raise
+        finally:
+            if dirtied:
+                self._mark_as_dirty(dirtied)
         return dirtied
 
-    _set_metadata = set_metadata
+    _set_metadata_for_books = set_metadata_for_books
 
     def _do_add_format(self, book_id, fmt, stream, name=None, mtime=None):
         path = self._get_book_path(book_id, unsafe=True)
@@ -2550,16 +2753,82 @@ def author_sort_from_authors(self, authors, key_func=icu_lower):
 
     _author_sort_from_authors = author_sort_from_authors
 
+    def _get_duplicate_index(self):
+        # Must be called with the read or write lock held. The index is built
+        # on first use and then kept up to date by _update_duplicate_index()
+        with self.duplicate_index_lock:
+            if self.duplicate_index is None:
+                from calibre.db.utils import DuplicateIndex
+
+                self.duplicate_index = DuplicateIndex(self.fields['title'].table.book_col_map, self.fields['identifiers'].table.book_col_map)
+            return self.duplicate_index
+
+    def _update_duplicate_index(self, book_ids):
+        # Must be called with the write lock held
+        idx = self.duplicate_index
+        if idx is not None:
+            title_map, identifier_map = self.fields['title'].table.book_col_map, self.fields['identifiers'].table.book_col_map
+            for book_id in book_ids:
+                title = title_map.get(book_id)
+                if title is None:
+                    idx.discard(book_id)
+                else:
+                    idx.add(book_id, title, identifier_map.get(book_id))
+
+    def _device_match_data(self, book_ids):
+        title_map = self.fields['title'].table.book_col_map
+        author_table = self.fields['authors'].table
+        aus_map, uuid_map = self.fields['author_sort'].table.book_col_map, self.fields['uuid'].table.book_col_map
+        for book_id in book_ids:
+            title = title_map.get(book_id)
+            if title is not None:
+                authors = tuple(author_table.id_map[aid] for aid in author_table.book_col_map.get(book_id, ()))
+                yield book_id, title, authors, aus_map.get(book_id), uuid_map.get(book_id)
+
+    def _get_device_match_index(self):
+        # Must be called with the read or write lock held. The index is built
+        # on first use and then kept up to date by _update_device_match_index()
+        with self.device_match_index_lock:
+            if self.device_match_index is None:
+                from calibre.db.utils import DeviceMatchIndex
+
+                self.device_match_index = DeviceMatchIndex(self._device_match_data(self.fields['title'].table.book_col_map))
+            return self.device_match_index
+
+    def _update_device_match_index(self, book_ids):
+        # Must be called with the write lock held
+        idx = self.device_match_index
+        if idx is not None:
+            for book_id in book_ids:
+                idx.discard(book_id)
+            for book in self._device_match_data(book_ids):
+                idx.add(*book)
+
+    @read_api
+    def match_device_books(self, books):
+        """
+        Match the books on a device with the books in the library. books is an
+        iterable of device books, objects with title and authors and optionally
+        uuid, application_id and db_id attributes. Returns a list of ``(how,
+        book_id)`` pairs, one for every book, see
+        :meth:`calibre.db.utils.DeviceMatchIndex.match`. The index used for
+        matching is built once and then kept up to date as the library changes,
+        so matching does not need to look at every book in the library.
+        """
+        idx = self._get_device_match_index()
+        return [
+            idx.match(book.title, book.authors, getattr(book, 'uuid', None), getattr(book, 'application_id', None), getattr(book, 'db_id', None))
+            for book in books
+        ]
+
+    _match_device_books = match_device_books
+
     @read_api
     def data_for_has_book(self):
         """Return data suitable for use in :meth:`has_book`. This can be used for an
         implementation of :meth:`has_book` in a worker process without access to the
         db."""
-        try:
-            return {icu_lower(title) for title in self.fields['title'].table.book_col_map.values()}
-        except TypeError:
-            # Some non-unicode titles in the db
-            return {icu_lower(as_unicode(title)) for title in self.fields['title'].table.book_col_map.values()}
+        return set(self._get_duplicate_index().lower_title_map)
 
     _data_for_has_book = data_for_has_book
 
@@ -2572,14 +2841,20 @@ def has_book(self, mi):
         if title:
             if isinstance(title, bytes):
                 title = title.decode(preferred_encoding, 'replace')
-            q = icu_lower(title).strip()
-            for title in self.fields['title'].table.book_col_map.values():
-                if q == icu_lower(title):
-                    return True
+            return bool(self._get_duplicate_index().books_with_title(title))
         return False
 
     _has_book = has_book
 
+    @read_api
+    def books_with_identifiers(self, identifiers):
+        """Return the set of ids of books that have at least one of the specified
+        identifiers, which must be a dictionary mapping identifier type to value,
+        such as the one returned by :meth:`Metadata.get_identifiers`."""
+        return set(self._get_duplicate_index().books_with_identifiers(identifiers))
+
+    _books_with_identifiers = books_with_identifiers
+
     @read_api
     def has_id(self, book_id):
         "Return True iff the specified book_id exists in the db"
@@ -2645,6 +2920,8 @@ def create_book_entry(self, mi, cover=None, add_duplicates=True, force_id=None,
             elif field == 'uuid':
                 self.fields[field].table.uuid_to_id_map[val] = book_id
             self.fields[field].table.book_col_map[book_id] = val
+        self._update_duplicate_index((book_id,))
+        self._update_device_match_index((book_id,))
 
         return book_id
 
@@ -2678,6 +2955,162 @@ def add_books(self, books, add_duplicates=True, apply_import_tags=True, preserve
 
     _add_books = add_books
 
+    @api
+    def bulk_add_books(
+        self,
+        books,
+        add_duplicates=True,
+        apply_import_tags=True,
+        preserve_uuid=False,
+        run_hooks=True,
+        dbapi=None,
+        batch_size=200,
+        max_workers=None,
+        progress=None,
+        abort=None,
+        copy_function=None,
+    ):
+        """
+        Add a large number of books to the library. Works like :meth:`add_books`,
+        except that books can be a lazy iterable and is consumed in batches of
+        batch_size books. The records for each batch are created in a single
+        transaction, the format files and covers are then written into the
+        library by a pool of max_workers threads without holding the write
+        lock, and finally the formats are recorded in a single transaction.
+
+        :param progress: If not None, called as ``progress(mi, book_id)`` for every book
+            processed. book_id is None if the book was a duplicate or could not be added.
+        :param abort: If not None, an :class:`threading.Event`. Adding stops after the
+            current batch once it is set.
+        :param copy_function: If not None, used instead of :func:`shutil.copyfile` to copy
+            formats that are specified as paths into the library, for example,
+            :func:`calibre.utils.filenames.copyfile_fast`.
+
+        Returns a tuple of lists: :code:`ids, duplicates, failures`. ``ids`` and
+        ``duplicates`` are as for :meth:`add_books`. ``failures`` contains
+        :code:`(mi, format_map, error)` for all books whose files could not be
+        written, these books are removed from the library again.
+        """
+        from concurrent.futures import ThreadPoolExecutor
+        from itertools import batched
+
+        ids, duplicates, failures = [], [], []
+        with ThreadPoolExecutor(max_workers=max_workers or min(8, detect_ncpus()), thread_name_prefix='BulkAddBooks') as executor:
+            for batch in batched(books, batch_size):
+                if abort is not None and abort.is_set():
+                    break
+                # Run import plugins without holding the write lock, as for add_format()
+                batch = [(mi, format_map, self._prepare_formats_for_add(format_map, run_hooks)) for mi, format_map in batch]
+                num_duplicates, num_failures = len(duplicates), len(failures)
+                with self.write_lock:
+                    jobs = self._create_book_entries_for_bulk_add(batch, add_duplicates, apply_import_tags, preserve_uuid, duplicates)
+                futures = [executor.submit(write_files_for_bulk_add, self.backend, job, copy_function) for job in jobs]
+                with self.write_lock:
+                    added = self._record_files_for_bulk_add(jobs, futures, failures)
+
+                for job in added:
+                    ids.append(job.book_id)
+                    fmt_map = {}
+                    for fmt, src, fname, dest in job.files:
+                        if run_hooks:
+                            run_plugins_on_postimport(dbapi or self, job.book_id, fmt)
+                        stream_or_path = job.format_map.get(fmt, src)
+                        fmt_map[fmt.lower()] = getattr(stream_or_path, 'name', stream_or_path) or '<stream>'
+                    run_plugins_on_postadd(dbapi or self, job.book_id, fmt_map)
+                if progress is not None:
+                    for job in added:
+                        progress(job.mi, job.book_id)
+                    for x in duplicates[num_duplicates:] + failures[num_failures:]:
+                        progress(x[0], None)
+        self.queue_next_fts_job()
+        return ids, duplicates, failures
+
+    def _prepare_formats_for_add(self, format_map, run_hooks):
+        ans = {}
+        for fmt, stream_or_path in format_map.items():
+            if run_hooks:
+                npath = run_import_plugins(stream_or_path, fmt)
+                fmt = os.path.splitext(npath)[-1].lower().replace('.', '').upper()
+                with open(make_long_path_useable(npath), 'rb') as f:
+                    fmt = check_ebook_format(f, fmt)
+                stream_or_path = npath
+            ans[(fmt or '').upper()] = stream_or_path
+        return ans
+
+    def _create_book_entries_for_bulk_add(self, batch, add_duplicates, apply_import_tags, preserve_uuid, duplicates):
+        jobs = []
+        try:
+            with self.backend.conn:
+                for mi, format_map, prepared_format_map in batch:
+                    # The cover is written later, outside the write lock
+                    cover = mi.cover_data[1] if mi.cover_data else None
+                    if cover is None and isinstance(mi.cover, str) and mi.cover:
+                        cover = mi.cover
+                    orig_cover = mi.cover, mi.cover_data
+                    mi.cover, mi.cover_data = None, (None, None)
+                    try:
+                        book_id = self._create_book_entry(mi, add_duplicates=add_duplicates, apply_import_tags=apply_import_tags, preserve_uuid=preserve_uuid)
+                    finally:
+                        # Duplicates are returned to the caller, who may add them later
+                        mi.cover, mi.cover_data = orig_cover
+                    if book_id is None:
+                        duplicates.append((mi, format_map))
+                        continue
+                    path = self._get_book_path(book_id)
+                    title = self._field_for('title', book_id, default_value=_('Unknown'))
+                    try:
+                        author = self._field_for('authors', book_id, default_value=(_('Unknown'),))[0]
+                    except IndexError:
+                        author = _('Unknown')
+                    files = []
+                    for fmt, src in prepared_format_map.items():
+                        fname = self.backend.construct_file_name(book_id, title, author, len(fmt) + 1)
+                        files.append((fmt, src, fname, os.path.join(self.backend.library_path, path, fname + '.' + fmt.lower())))
+                    jobs.append(BulkAddJob(book_id, mi, format_map, path, files, cover))
+        except Exception:
+            # The transaction was rolled back, re-sync the in-memory caches with the database
+            self._reload_from_db()
+            raise
+        return jobs
+
+    def _record_files_for_bulk_add(self, jobs, futures, failures):
+        rows, cover_map, added, failed = [], {}, [], set()
+        for job, future in zip(jobs, futures):
+            try:
+                sizes, has_cover = future.result()
+            except Exception as err:
+                traceback.print_exc()
+                failures.append((job.mi, job.format_map, str(err)))
+                failed.add(job.book_id)
+                continue
+            renamed = self._get_book_path(job.book_id) != job.path
+            for fmt, src, fname, dest in job.files:
+                if renamed:
+                    # The book was renamed while its files were being written,
+                    # move them to the new location
+                    size, fname = self._do_add_format(job.book_id, fmt, dest)
+                else:
+                    size = sizes[fmt]
+                rows.append((job.book_id, fmt, fname, size))
+            if has_cover:
+                cover_map[job.book_id] = 1
+            added.append(job)
+        with self.backend.conn:
+            if failed:
+                self._remove_books(failed, permanent=True)
+            if rows:
+                self.fields['size'].table.update_sizes(self.fields['formats'].table.update_fmts(rows, self.backend))
+            if cover_map:
+                for cc in self.cover_caches:
+                    cc.invalidate(cover_map)
+                self._set_field('cover', cover_map)
+            self._update_last_modified({job.book_id for job in added})
+            for book_id in {r[0] for r in rows}:
+                self._queue_pages_scan(book_id)
+        for book_id, fmt, fname, size in rows:
+            self.event_dispatcher(EventType.format_added, book_id, fmt)
+        return added
+
     @write_api
     def remove_books(self, book_ids, permanent=False):
         """Remove the books specified by the book_ids from the database and delete
@@ -2707,6 +3140,8 @@ def remove_books(self, book_ids, permanent=False):
             else:
                 table.remove_books(book_ids, self.backend)
         self._search_api.discard_books(book_ids)
+        self._update_duplicate_index(book_ids)
+        self._update_device_match_index(book_ids)
         self._clear_caches(book_ids=book_ids, template_cache=False, search_cache=False)
         for cc in self.cover_caches:
             cc.invalidate(book_ids)
@@ -2821,6 +3256,7 @@ def rename_items(self, field, item_id_to_new_name_map, change_index=True, restri
                     {k: ' & '.join(v) for k, v in self._author_sort_strings_for_books(affected_books).items()},
                 )
                 self._update_path(affected_books, mark_as_dirtied=False)
+                self._update_device_match_index(affected_books)
             elif change_index and hasattr(f, 'index_field') and tweaks['series_index_auto_increment'] != 'no_change':
                 for book_id in moved_books:
                     self._set_field(
@@ -2849,6 +3285,8 @@ def remove_items(self, field, item_ids, restrict_to_book_ids=None):
                 self._set_field(field.index_field.name, {bid: 1.0 for bid in affected_books})
             else:
                 self._mark_as_dirty(affected_books)
+            if field.name == 'authors':
+                self._update_device_match_index(affected_books)
             self._clear_link_map_cache(affected_books)
         self.event_dispatcher(EventType.items_removed, field, affected_books, item_ids)
         return affected_books
@@ -3226,14 +3664,19 @@ def data_for_find_identical_books(self):
             at.col_book_map.copy(),
             self.fields['title'].table.book_col_map.copy(),
             self.fields['languages'].book_value_map.copy(),
+            {k: set(v) for k, v in self._get_duplicate_index().fuzzy_title_map.items()},
         )
 
     _data_for_find_identical_books = data_for_find_identical_books
 
     @read_api
     def update_data_for_find_identical_books(self, book_id, data):
-        author_map, author_book_map, title_map, lang_map = data
+        author_map, author_book_map, title_map, lang_map = data[:4]
         title_map[book_id] = self._field_for('title', book_id)
+        if len(data) > 4:
+            from calibre.db.utils import fuzzy_title
+
+            data[4].setdefault(fuzzy_title(title_map[book_id]), set()).add(book_id)
         lang_map[book_id] = self._field_for('languages', book_id)
         at = self.fields['authors'].table
         for aid in at.book_col_map.get(book_id, ()):
@@ -3253,7 +3696,19 @@ def find_identical_books(self, mi, search_restriction='', book_ids=None):
 
         identical_book_ids = set()
         langq = tuple(x for x in map(canonicalize_lang, mi.languages or ()) if x and x != 'und')
-        if mi.authors:
+        if mi.authors and not search_restriction:
+            # Use the title index to find candidates, then check their authors
+            candidates = self._get_duplicate_index().books_with_fuzzy_title(mi.title)
+            if book_ids is not None:
+                candidates = candidates.intersection(book_ids)
+            qauthors = {icu_lower(x) for x in mi.authors}
+            for book_id in candidates:
+                aut = {icu_lower(x) for x in self._field_for('authors', book_id) or ()}
+                if aut.issuperset(qauthors):
+                    bl = self._field_for('languages', book_id)
+                    if not langq or not bl or bl == langq:
+                        identical_book_ids.add(book_id)
+        elif mi.authors:
             try:
                 quathors = mi.authors[:20]  # Too many authors causes parsing of the search expression to fail
                 query = ' and '.join('authors:"={}"'.format(a.replace('"', '')) for a in quathors)
@@ -3782,35 +4237,35 @@ def tempfile_for_export(which: str) -> Iterator[str]:
         }
         if has_fts:
             metadata['full-text-search.db'] = ftsdbkey
-        for i, book_id in enumerate(book_ids):
-            if abort is not None and abort.is_set():
-                return
-            if progress is not None:
-                report_progress(self._field_for('title', book_id))
-            format_metadata[book_id] = fm = {}
-            for fmt in self._formats(book_id):
-                mdata = self.format_metadata(book_id, fmt)
-                key = f'{key_prefix}:{book_id}:{fmt}'
-                fm[fmt] = key
-                mtime = mdata.get('mtime')
-                if mtime is not None:
-                    mtime = timestampfromdt(mtime)
-                with exporter.start_file(key, mtime=mtime) as dest:
-                    self._copy_format_to(book_id, fmt, dest)
-            cover_key = '{}:{}:{}'.format(key_prefix, book_id, '.cover')
-            with exporter.start_file(cover_key) as dest:
-                if not self.copy_cover_to(book_id, dest):
-                    dest.discard()
-                else:
-                    fm['.cover'] = cover_key
-            bp = self._get_book_path(book_id, sep='/', unsafe=True)
-            extra_files[book_id] = ef = {}
-            if bp:
-                for relpath, fobj, stat_result in self.backend.iter_extra_files(book_id, bp, self.fields['formats']):
-                    key = f'{key_prefix}:{book_id}:.|{relpath}'
-                    with exporter.start_file(key, mtime=stat_result.st_mtime) as dest:
-                        shutil.copyfileobj(fobj, dest)
-                    ef[relpath] = key
+
+        def files_to_export():
+            # The files are read and hashed in parallel by the exporter, as
+            # they are generated
+            for book_id in book_ids:
+                if abort is not None and abort.is_set():
+                    return
+                if progress is not None:
+                    report_progress(self._field_for('title', book_id))
+                format_metadata[book_id] = fm = {}
+                for fmt in self._formats(book_id):
+                    path = self._format_abspath(book_id, fmt)
+                    if path:
+                        fm[fmt] = key = f'{key_prefix}:{book_id}:{fmt}'
+                        yield key, path, True
+                bp = self._get_book_path(book_id, sep='/', unsafe=True)
+                extra_files[book_id] = ef = {}
+                if bp:
+                    path = self.backend.cover_abspath(book_id, bp)
+                    if path:
+                        fm['.cover'] = key = '{}:{}:{}'.format(key_prefix, book_id, '.cover')
+                        yield key, path, False
+                    for relpath, path, stat_result in self.backend.iter_extra_files(book_id, bp, self.fields['formats'], yield_paths=True):
+                        ef[relpath] = key = f'{key_prefix}:{book_id}:.|{relpath}'
+                        yield key, path, True
+
+        exporter.add_files(files_to_export())
+        if abort is not None and abort.is_set():
+            return
         exporter.set_metadata(library_key, metadata)
         if progress is not None:
             progress(_('Completed'), total, total)
@@ -4224,7 +4679,34 @@ def clone_for_readonly_access(self, dest_dir: str) -> str:
     _clone_for_readonly_access = clone_for_readonly_access
 
 
-def import_library(library_key, importer, library_path, progress=None, abort=None):
+def import_book_files(cache, importer, book_id, fmt_key_map, extra_files):
+    # Run in a thread pool, with the write lock held by the thread that
+    # called import_library(), so only the book files must be touched here
+    title = cache._field_for('title', book_id)
+    path = cache._get_book_path(book_id)
+    rows = []
+    for fmt, fmtkey in fmt_key_map.items():
+        if fmt == '.cover':
+            with importer.start_file(fmtkey, _('Cover for %s') % title) as stream:
+                cache.backend.set_cover(book_id, path, stream, no_processing=True)
+        else:
+            with importer.start_file(fmtkey, _('{0} format for {1}').format(fmt.upper(), title)) as stream:
+                size, fname = cache._do_add_format(book_id, fmt, stream, mtime=stream.mtime)
+                rows.append((book_id, fmt, fname, size))
+    for relpath, efkey in extra_files.items():
+        with importer.start_file(efkey, _('Extra file {0} for book {1}').format(relpath, title)) as stream:
+            cache.backend.add_extra_file(relpath, stream, path)
+    return rows
+
+
+def import_library(library_key, importer, library_path, progress=None, abort=None, max_workers=None):
+    """
+    Create the library at library_path from the export in importer. The book
+    files are restored by a pool of max_workers threads.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from itertools import batched
+
     from calibre.db.backend import DB
 
     metadata = importer.metadata[library_key]
@@ -4272,30 +4754,24 @@ def report_progress(fname):
         raise ValueError('Corrupted files:\n' + '\n'.join(importer.corrupted_files))
     cache = Cache(DB(library_path, load_user_formatter_functions=False))
     cache.init()
-    with cache.write_lock:
-        format_data = {int(book_id): data for book_id, data in metadata['format_data'].items()}
-        extra_files = {int(book_id): data for book_id, data in metadata.get('extra_files', {}).items()}
-        for i, (book_id, fmt_key_map) in enumerate(format_data.items()):
+    format_data = {int(book_id): data for book_id, data in metadata['format_data'].items()}
+    extra_files = {int(book_id): data for book_id, data in metadata.get('extra_files', {}).items()}
+    with cache.write_lock, ThreadPoolExecutor(max_workers=max_workers or min(8, detect_ncpus()), thread_name_prefix='ImportLibrary') as executor:
+        i = 0
+        for batch in batched(format_data, 64):
             if abort is not None and abort.is_set():
                 return
-            title = cache._field_for('title', book_id)
-            if progress is not None:
-                progress(title, i + poff, total)
-            cache._update_path((book_id,), mark_as_dirtied=False)
-            for fmt, fmtkey in fmt_key_map.items():
-                if fmt == '.cover':
-                    with importer.start_file(fmtkey, _('Cover for %s') % title) as stream:
-                        path = cache._get_book_path(book_id)
-                        cache.backend.set_cover(book_id, path, stream, no_processing=True)
-                else:
-                    with importer.start_file(fmtkey, _('{0} format for {1}').format(fmt.upper(), title)) as stream:
-                        size, fname = cache._do_add_format(book_id, fmt, stream, mtime=stream.mtime)
-                        cache.fields['formats'].table.update_fmt(book_id, fmt, fname, size, cache.backend)
-            for relpath, efkey in extra_files.get(book_id, {}).items():
-                with importer.start_file(efkey, _('Extra file {0} for book {1}').format(relpath, title)) as stream:
-                    path = cache._get_book_path(book_id)
-                    cache.backend.add_extra_file(relpath, stream, path)
-            cache.dump_metadata({book_id})
+            cache._update_path(batch, mark_as_dirtied=False)
+            futures = [executor.submit(import_book_files, cache, importer, book_id, format_data[book_id], extra_files.get(book_id, {})) for book_id in batch]
+            rows = []
+            for book_id, future in zip(batch, futures):
+                if progress is not None:
+                    progress(cache._field_for('title', book_id), i + poff, total)
+                i += 1
+                rows.extend(future.result())
+            if rows:
+                cache.fields['formats'].table.update_fmts(rows, cache.backend)
+            cache.dump_metadata(batch)
     if importer.corrupted_files:
         raise ValueError('Corrupted files:\n' + '\n'.join(importer.corrupted_files))
     if progress is not None:
@@ -8,7 +8,16 @@
 from typing import Any
 
 from calibre import prints
-from calibre.db.adding import cdb_find_in_dir, cdb_recursive_find, compile_rule, create_format_map, run_import_plugins, run_import_plugins_before_metadata
+from calibre.db.adding import (
+    cdb_find_in_dir,
+    cdb_recursive_find,
+    compile_rule,
+    create_format_map,
+    import_books_in_parallel,
+    read_cover_from_opf,
+    run_import_plugins,
+    run_import_plugins_before_metadata,
+)
 from calibre.db.utils import find_identical_books
 from calibre.ebooks.metadata import MetaInformation, string_to_authors
 from calibre.ebooks.metadata.book.serialize import read_cover, serialize_cover
@@ -188,6 +197,18 @@ def format_group(db, notify_changes, is_remote, args):
         return mi.title, set(added_ids), set(updated_ids), bool(duplicates)
 
 
+def format_groups(db, notify_changes, is_remote, args):
+    dirs, recurse, one_book_per_directory, compiled_rules, add_duplicates = args
+    if is_remote:
+        raise ValueError('Cannot add books from folders on the server')
+    scanner = cdb_recursive_find if recurse else cdb_find_in_dir
+    groups = (formats for dpath in dirs for formats in scanner(dpath, one_book_per_directory, compiled_rules))
+    with add_ctx():
+        added_ids, duplicates, failures = import_books_in_parallel(db, groups, add_duplicates=add_duplicates)
+    db.dump_metadata(book_ids=added_ids)
+    return added_ids, [(mi.title, paths) for mi, paths in duplicates], failures
+
+
 def implementation(db, notify_changes, action, *args):
     is_remote = notify_changes is not None
     func = globals()[action]
@@ -285,23 +306,20 @@ def do_add(
                 file_duplicates.append((book_title, book))
 
         dir_dups = []
+        if dirs and not dbctx.is_remote and oautomerge == 'disabled':
+            # Read metadata in parallel in worker processes and add the books in bulk
+            ids, dir_dups, failures = dbctx.run('add', 'format_groups', dirs, recurse, one_book_per_directory, compiled_rules, add_duplicates)
+            added_ids |= set(ids)
+            for paths, error in failures:
+                prints(_('Failed to add:'), file=sys.stderr)
+                for path in paths:
+                    prints('   ', path, file=sys.stderr)
+                prints(error, file=sys.stderr)
+            dirs = ()
         scanner = cdb_recursive_find if recurse else cdb_find_in_dir
         for dpath in dirs:
             for formats in scanner(dpath, one_book_per_directory, compiled_rules):
-                cover_data = None
-                for fmt in formats:
-                    if fmt.lower().endswith('.opf'):
-                        with open(fmt, 'rb') as f:
-                            mi = get_metadata(f, stream_type='opf')
-                            if mi.cover_data and mi.cover_data[1]:
-                                cover_data = mi.cover_data[1]
-                            elif mi.cover:
-                                try:
-                                    with open(mi.cover, 'rb') as f:
-                                        cover_data = f.read()
-                                except OSError:
-                                    pass
-
+                cover_data = read_cover_from_opf(formats)
                 book_title, ids, mids, dups = dbctx.run(
                     'add',
                     'format_group',
@@ -55,6 +55,15 @@ def option_parser(get_parser, args):
         action='store_true',
         help=_('Vacuum the full text search database. This can be very slow and memory intensive, depending on the size of the database.'),
     )
+    parser.add_option(
+        '--incremental',
+        default=False,
+        action='store_true',
+        help=_(
+            'Remember the contents of the library folders and only re-read the folders that have changed since the last'
+            ' incremental check. Makes repeated checks of large libraries much faster.'
+        ),
+    )
 
     return parser
 
@@ -111,7 +120,7 @@ def main(opts, args, dbctx):
     prints(_('Vacuuming database...'))
     db.new_api.vacuum(opts.vacuum_fts_db)
     checker = CheckLibrary(dbctx.library_path, db)
-    checker.scan_library(names, exts)
+    checker.scan_library(names, exts, incremental=opts.incremental)
     for check in checks:
         _print_check_library_results(checker, check, as_csv=opts.csv)
 
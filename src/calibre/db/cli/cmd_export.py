@@ -2,11 +2,13 @@
 # License: GPLv3 Copyright: 2017, Kovid Goyal <kovid at kovidgoyal.net>
 
 import os
+import sys
 
+from calibre import prints
 from calibre.db.cli import integers_from_string
 from calibre.db.constants import DATA_FILE_PATTERN
 from calibre.db.errors import NoSuchFormat
-from calibre.library.save_to_disk import config, do_save_book_to_disk, get_formats, sanitize_args
+from calibre.library.save_to_disk import config, do_save_book_to_disk, get_formats, sanitize_args, save_to_disk_in_parallel
 from calibre.utils.formatter_functions import load_user_template_functions
 from calibre.utils.localization import _
 
@@ -44,6 +46,11 @@ def implementation(db, notify_changes, action, *args):
             db.copy_extra_file_to(book_id, relpath, output)
             return output.getvalue()
         db.copy_extra_file_to(book_id, relpath, dest)
+    if action == 'save_books':
+        if is_remote:
+            raise ValueError('Cannot save books in parallel on the server')
+        book_ids, dest, opts, callback = args
+        return save_to_disk_in_parallel(db, book_ids, dest, opts, callback=callback)
 
 
 def option_parser(get_parser, args):
@@ -135,11 +142,26 @@ def main(opts, args, dbctx):
     dbproxy = DBProxy(dbctx)
     dest, opts, length = sanitize_args(dest, opts)
     total = len(book_ids)
-    for i, book_id in enumerate(book_ids):
-        export(opts, dbctx, book_id, dest, dbproxy, length, i == 0)
+    num = 0
+
+    def report_progress(*args):
+        nonlocal num
+        num += 1
         if opts.progress:
-            num = i + 1
             print(f'\r  {num / total:.1%} [{num}/{total}]', end=' ' * 20)
+        return True
+
+    failures = ()
+    if dbctx.is_remote:
+        for i, book_id in enumerate(book_ids):
+            export(opts, dbctx, book_id, dest, dbproxy, length, i == 0)
+            report_progress()
+    else:
+        # Copy the files and update their metadata in parallel
+        failures = dbctx.run('export', 'save_books', book_ids, dest, opts, report_progress)
     if opts.progress:
         print()
+    for book_id, title, tb in failures:
+        prints(_('Failed to save: {0} with error:').format(title), file=sys.stderr)
+        prints(tb, file=sys.stderr)
     return 0
@@ -1,9 +1,14 @@
 #!/usr/bin/env python
 # License: GPL v3 Copyright: 2019, Kovid Goyal <kovid at kovidgoyal.net>
 
-from calibre.db.utils import find_identical_books
+from collections import defaultdict
+from functools import partial
+from itertools import batched
+
+from calibre.db.utils import find_identical_books, fuzzy_title
 from calibre.utils.config import tweaks
 from calibre.utils.date import now
+from calibre.utils.icu import lower as icu_lower
 
 source_removal_actions = frozenset({'add', 'automerge'})
 
@@ -142,3 +147,144 @@ def copy_one_book(
         postprocess_copy(book_id, new_book_id, new_authors, db, newdb, identical_books_data, duplicate_action)
         return_data['new_book_id'] = new_book_id
         return return_data
+
+
+def copy_books(
+    book_ids,
+    src_db,
+    dest_db,
+    duplicate_action='add',
+    automerge_action='overwrite',
+    preserve_date=True,
+    identical_books_data=None,
+    preserve_uuid=False,
+    allow_hardlinks=False,
+    batch_size=200,
+    progress=None,
+    abort=None,
+):
+    """
+    Copy many books between libraries, equivalent to calling
+    :func:`copy_one_book` for every book, but much faster. Metadata is read
+    from the source library a batch at a time and the books are added with
+    :meth:`calibre.db.cache.Cache.bulk_add_books`. Files are cloned with
+    reflinks where the filesystem supports it. Set allow_hardlinks only when
+    the source books are going to be deleted, as hardlinked files share their
+    contents. Books that have duplicates in the destination library are
+    handled by :func:`copy_one_book` after all other books have been copied.
+
+    :param progress: If not None, called as ``progress(book_id, return_data)``
+        for every book copied, return_data is None if copying failed.
+
+    Returns two dictionaries, the first maps book ids to the same return data
+    as :func:`copy_one_book` and the second maps the ids of books that could
+    not be copied to an error message.
+    """
+    from calibre.utils.filenames import copyfile_fast
+
+    db = src_db.new_api
+    newdb = dest_db.new_api
+    results, failures = {}, {}
+    if duplicate_action != 'add' and identical_books_data is None:
+        identical_books_data = newdb.data_for_find_identical_books()
+    pending, deferred = {}, []
+    # Map of fuzzy title to authors for books queued for adding
+    queued = defaultdict(list)
+
+    def report(book_id, return_data):
+        if progress is not None:
+            progress(book_id, return_data)
+
+    def read_book(book_id):
+        mi = db.get_metadata(book_id)
+        if not preserve_date:
+            mi.timestamp = now()
+        mi.cover = db.format_abspath(book_id, '__COVER_INTERNAL__') if db.field_for('cover', book_id) else None
+        format_map = {}
+        for fmt in db.formats(book_id, verify_formats=False):
+            path = db.format_abspath(book_id, fmt)
+            if path:
+                format_map[fmt.upper()] = path
+        return mi, format_map
+
+    def books():
+        for batch in batched(book_ids, batch_size):
+            with db.safe_read_lock:
+                items = [(book_id, *read_book(book_id)) for book_id in batch]
+            existing_authors = newdb.get_item_ids('authors', {a for book_id, mi, fm in items for a in mi.authors})
+            for book_id, mi, format_map in items:
+                if duplicate_action != 'add':
+                    # Books that are duplicates of each other must be merged
+                    # with the copy that was added first, so they are all
+                    # handled after the other books have been added
+                    title, authors = fuzzy_title(mi.title or ''), {icu_lower(a) for a in mi.authors}
+                    if any(authors.issubset(x) for x in queued[title]) or find_identical_books(mi, identical_books_data):
+                        deferred.append(book_id)
+                        continue
+                    queued[title].append(authors)
+                return_data = {
+                    'book_id': book_id,
+                    'title': mi.title,
+                    'authors': mi.authors,
+                    'author': mi.format_field('authors')[1],
+                    'action': 'add',
+                    'new_book_id': None,
+                }
+                new_authors = {a for a in mi.authors if existing_authors.get(a) is None}
+                pending[id(mi)] = book_id, return_data, new_authors
+                yield mi, format_map
+
+    def on_added(mi, new_book_id):
+        if new_book_id is None:
+            return
+        book_id, return_data, new_authors = pending.pop(id(mi))
+        with db.safe_read_lock, newdb.write_lock:
+            bp = db.get_book_path(book_id, sep='/', unsafe=True)
+            nbp = newdb.field_for('path', new_book_id)
+            if bp and nbp:
+                for relpath, src_path, stat_result in db.backend.iter_extra_files(book_id, bp, db.fields['formats'], yield_paths=True):
+                    newdb.backend.add_extra_file(relpath, src_path, nbp)
+            postprocess_copy(book_id, new_book_id, new_authors, db, newdb, identical_books_data, duplicate_action)
+        return_data['new_book_id'] = new_book_id
+        results[book_id] = return_data
+        report(book_id, return_data)
+
+    ids, duplicates, bulk_failures = newdb.bulk_add_books(
+        books(),
+        add_duplicates=True,
+        apply_import_tags=tweaks['add_new_book_tags_when_importing_books'],
+        preserve_uuid=preserve_uuid,
+        run_hooks=False,
+        batch_size=batch_size,
+        progress=on_added,
+        abort=abort,
+        copy_function=partial(copyfile_fast, allow_hardlink=allow_hardlinks),
+    )
+    for mi, format_map, err in bulk_failures:
+        book_id = pending[id(mi)][0]
+        failures[book_id] = err
+        report(book_id, None)
+
+    for book_id in deferred:
+        if abort is not None and abort.is_set():
+            break
+        try:
+            return_data = copy_one_book(
+                book_id,
+                src_db,
+                dest_db,
+                duplicate_action=duplicate_action,
+                automerge_action=automerge_action,
+                preserve_date=preserve_date,
+                identical_books_data=identical_books_data,
+                preserve_uuid=preserve_uuid,
+            )
+        except Exception:
+            import traceback
+
+            failures[book_id] = traceback.format_exc()
+            report(book_id, None)
+        else:
+            results[book_id] = return_data
+            report(book_id, return_data)
+    return results, failures
@@ -2,54 +2,168 @@
 # License: GPL v3 Copyright: 2021, Kovid Goyal <kovid at kovidgoyal.net>
 
 import os
-from queue import Queue
-from threading import Thread
+from queue import Empty
 
-from calibre import detect_ncpus
-from calibre.utils.img import encode_jpeg, optimize_jpeg
+from calibre.utils.filenames import atomic_rename
 
+# Functions run in the worker processes {{{
 
-def compress_worker(input_queue, output_queue, jpeg_quality):
-    while True:
-        task = input_queue.get()
-        if task is None:
-            break
-        book_id, path = task
+
+def process_cover(src, dest, operation):
+    """
+    Perform operation on the cover image at src, writing the result to dest.
+    Returns the size of dest or a string with error details. operation is one of:
+
+    ``('compress', jpeg_quality)``
+        Re-encode the image in place, dest must be the same as src. A quality
+        of 100 performs lossless compression.
+
+    ``('scale', width, height, compression_quality, as_png)``
+        Scale the image to fit in width x height, preserving its aspect ratio
+
+    ``('render', options)``
+        Call :func:`calibre.utils.img.save_cover_data_to` with the keyword
+        arguments in the options dict. If options has an optimize_png key the
+        output is passed through optipng with that optimization level. The
+        output is flushed to disk, for devices that may be disconnected.
+    """
+    from calibre.utils.img import encode_jpeg, optimize_jpeg, optimize_png, save_cover_data_to, scale_image
+
+    op, *args = operation
+    if op == 'compress':
+        (jpeg_quality,) = args
+        stderr = optimize_jpeg(src) if jpeg_quality >= 100 else encode_jpeg(src, jpeg_quality)
+        if stderr:
+            return stderr
+    elif op == 'scale':
+        width, height, compression_quality, as_png = args
+        with open(src, 'rb') as f:
+            data = f.read()
+        data = scale_image(data, width, height, compression_quality, as_png)[-1]
+        tdest = dest + '.tmp-cover'
+        with open(tdest, 'wb') as f:
+            f.write(data)
+        atomic_rename(tdest, dest)
+    elif op == 'render':
+        options = dict(args[0])
+        png_level = options.pop('optimize_png', None)
+        with open(src, 'rb') as f:
+            data = f.read()
+        data = save_cover_data_to(data, **options)
+        if png_level is not None:
+            # optipng cannot read from a pipe and is slow on device filesystems
+            from calibre.ptempfile import TemporaryFile
+
+            with TemporaryFile(suffix='.png') as tpath:
+                with open(tpath, 'wb') as f:
+                    f.write(data)
+                optimize_png(tpath, level=png_level)
+                with open(tpath, 'rb') as f:
+                    data = f.read()
+        tdest = dest + '.tmp-cover'
+        with open(tdest, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        atomic_rename(tdest, dest)
+    else:
+        return f'Unknown cover operation: {op}'
+    try:
+        return os.path.getsize(dest)
+    except OSError as err:
+        return str(err)
+
+
+def process_cover_batch(tasks):
+    ans = []
+    for key, src, dest, operation in tasks:
         try:
-            if jpeg_quality >= 100:
-                stderr = optimize_jpeg(path)
-            else:
-                stderr = encode_jpeg(path, jpeg_quality)
+            result = process_cover(src, dest, operation)
         except Exception:
             import traceback
 
-            stderr = traceback.format_exc()
-        if stderr:
-            output_queue.put((book_id, stderr))
-        else:
+            result = traceback.format_exc()
+        ans.append((key, result))
+    return ans
+
+
+# }}}
+
+
+def process_covers(tasks, progress_callback=None, max_workers=None, batch_size=16, abort=None):
+    """
+    Process many cover images in a pool of worker processes, see
+    :func:`process_cover` for the supported operations. tasks is a sequence of
+    ``(key, src_path, dest_path, operation)`` tuples. The images are sent to the
+    workers in batches of batch_size, to amortize the cost of communicating
+    with the workers. progress_callback, if specified, is called with the key and
+    the result for every processed image. abort can be an Event to stop early.
+    Returns a mapping of key to result, which is either the size of the output
+    image or a string with error details. If a worker process crashes, every
+    image not yet processed gets the details of the crash as its result.
+    """
+    from calibre import detect_ncpus
+    from calibre.utils.ipc.pool import Pool
+
+    tasks = tuple(tasks)
+    if not tasks:
+        return {}
+    batches = [tasks[i : i + batch_size] for i in range(0, len(tasks), batch_size)]
+    max_workers = min(max_workers or detect_ncpus(), len(batches))
+    pool = Pool(max_workers=max_workers, name='ProcessCovers')
+    ans = {}
+
+    def report(results):
+        for key, result in results:
+            ans[key] = result
+            if progress_callback is not None:
+                progress_callback(key, result)
+
+    try:
+        for i, batch in enumerate(batches):
+            pool(i, __name__, 'process_cover_batch', batch)
+        pending = set(range(len(batches)))
+        while pending:
+            if abort is not None and abort.is_set():
+                break
             try:
-                sz = os.path.getsize(path)
-            except OSError as err:
-                sz = str(err)
-            output_queue.put((book_id, sz))
+                wr = pool.results.get(True, 0.1)
+            except Empty:
+                if pool.failed:
+                    # The batch being processed by the crashed worker never
+                    # gets a result, so report all remaining batches as failed
+                    tf = pool.terminal_failure
+                    err = f'{tf.message}\n{tf.tb}' if tf.tb else tf.message
+                    for i in sorted(pending):
+                        report((task[0], err) for task in batches[i])
+                    break
+                continue
+            pool.results.task_done()
+            pending.discard(wr.id)
+            if wr.is_terminal_failure:
+                report((task[0], 'The cover processing worker process crashed') for task in batches[wr.id])
+            elif wr.result.err is not None:
+                report((task[0], wr.result.err) for task in batches[wr.id])
+            else:
+                report(wr.result.value)
+    finally:
+        pool.shutdown()
+    return ans
 
 
 def compress_covers(path_map, jpeg_quality, progress_callback):
-    input_queue = Queue()
-    output_queue = Queue()
-    num_workers = detect_ncpus()
-    sz_map = {}
-    for book_id, (path, sz) in path_map.items():
-        input_queue.put((book_id, path))
-        sz_map[book_id] = sz
-    workers = [Thread(target=compress_worker, args=(input_queue, output_queue, jpeg_quality), daemon=True, name=f'CCover-{i}') for i in range(num_workers)]
-    [w.start() for w in workers]
-    pending = set(path_map)
-    while pending:
-        book_id, new_sz = output_queue.get()
-        pending.remove(book_id)
-        progress_callback(book_id, sz_map[book_id], new_sz)
-    for w in workers:
-        input_queue.put(None)
-    for w in workers:
-        w.join()
+    """
+    Compress the covers in path_map, a mapping of book_id to (path, size), in a
+    pool of worker processes. Returns the set of book ids whose covers were
+    changed.
+    """
+    changed = set()
+
+    def report(book_id, new_sz):
+        old_sz = path_map[book_id][1]
+        if isinstance(new_sz, int) and new_sz != old_sz:
+            changed.add(book_id)
+        progress_callback(book_id, old_sz, new_sz)
+
+    process_covers(((book_id, path, path, ('compress', jpeg_quality)) for book_id, (path, sz) in path_map.items()), report)
+    return changed
@@ -105,6 +105,12 @@ def owns_lock(self):
         with self._lock:
             return self._exclusive_owner is me or me in self._shared_owners
 
+    @property
+    def num_users(self):
+        """The number of threads currently holding or waiting to acquire this lock"""
+        with self._lock:
+            return len(self._shared_owners) + bool(self.is_exclusive) + len(self._shared_queue) + len(self._exclusive_queue)
+
     def release(self):
         """Release the lock."""
         # This decrements the appropriate lock counters, and if the lock
@@ -236,6 +242,10 @@ def release(self, *args):
     def owns_lock(self):
         return self._shlock.owns_lock()
 
+    @property
+    def num_users(self):
+        return self._shlock.num_users
+
 
 class DebugRWLockWrapper(RWLockWrapper):
     def __init__(self, *args, **kwargs):
@@ -673,7 +673,7 @@ def remove_items(self, item_ids, db, restrict_to_book_ids=None):
     def rename_item(self, item_id, new_name, db):
         raise NotImplementedError('Cannot rename formats')
 
-    def update_fmt(self, book_id, fmt, fname, size, db):
+    def update_fmt_cache(self, book_id, fmt, fname, size):
         fmts = list(self.book_col_map.get(book_id, []))
         try:
             fmts.remove(fmt)
@@ -689,12 +689,27 @@ def update_fmt(self, book_id, fmt, fname, size, db):
 
         self.fname_map[book_id][fmt] = fname
         self.size_map[book_id][fmt] = size
+
+    def update_fmt(self, book_id, fmt, fname, size, db):
+        self.update_fmt_cache(book_id, fmt, fname, size)
         db.execute(
             'INSERT OR REPLACE INTO data (book,format,uncompressed_size,name) VALUES (?,?,?,?)',
             (book_id, fmt, size, fname),
         )
         return max(self.size_map[book_id].values())
 
+    def update_fmts(self, rows, db):
+        """Same as update_fmt() for many formats at once. rows is a list of
+        (book_id, fmt, fname, size). Returns a map of book_id to the size of
+        the largest format of that book."""
+        for book_id, fmt, fname, size in rows:
+            self.update_fmt_cache(book_id, fmt, fname, size)
+        db.executemany(
+            'INSERT OR REPLACE INTO data (book,format,uncompressed_size,name) VALUES (?,?,?,?)',
+            [(book_id, fmt, size, fname) for book_id, fmt, fname, size in rows],
+        )
+        return {book_id: max(self.size_map[book_id].values()) for book_id in {r[0] for r in rows}}
+
 
 class IdentifiersTable(ManyToManyTable):
     supports_notes = False
@@ -3,6 +3,7 @@
 
 import glob
 import os
+import shutil
 from contextlib import suppress
 from datetime import timedelta
 from io import BytesIO
@@ -235,6 +236,77 @@ def test_add_books(self):  # {{{
 
     # }}}
 
+    def test_bulk_add_books(self):  # {{{
+        "Test the adding of books in bulk"
+        from calibre.ebooks.metadata.book.base import Metadata
+
+        cache = self.init_cache()
+        ae = self.assertEqual
+
+        def books():
+            for i in range(5):
+                mi = Metadata(f'Bulk {i}', authors=('Bulk Author',))
+                if i == 2:
+                    mi.cover_data = 'jpeg', IMG
+                yield mi, {'FMT1': BytesIO(b'fmt1 %d' % i), 'FMT2': BytesIO(b'fmt2 %d' % i)}
+            dup = Metadata('Bulk 1', authors=('Bulk Author',))
+            dup.cover_data = 'jpeg', IMG
+            yield dup, {'FMT1': BytesIO(b'dup')}
+
+        seen = []
+        ids, duplicates, failures = cache.bulk_add_books(books(), add_duplicates=False, batch_size=2, progress=lambda mi, book_id: seen.append(book_id))
+        ae(len(ids), 5)
+        ae(len(duplicates), 1)
+        ae(failures, [])
+        ae(sorted(seen, key=lambda x: x or 0), [None] + sorted(ids))
+        for i, book_id in enumerate(ids):
+            ae(cache.field_for('title', book_id), f'Bulk {i}')
+            ae(set(cache.formats(book_id)), {'FMT1', 'FMT2'})
+            ae(cache.format(book_id, 'FMT1'), b'fmt1 %d' % i)
+            ae(cache.field_for('size', book_id), len(b'fmt1 %d' % i))
+            ae(cache.field_for('cover', book_id), i == 2)
+        self.assertTrue(cache.cover(ids[2]))
+        self.assertFalse(cache.cover(ids[1]))
+        # Rejected duplicates keep their cover, so they can be added later
+        mi, format_map = duplicates[0]
+        ae(mi.cover_data, ('jpeg', IMG))
+        format_map['FMT1'].seek(0)
+        dup_ids = cache.add_books([(mi, format_map)])[0]
+        self.assertTrue(cache.cover(dup_ids[0]))
+        cache.close()
+        cache = self.init_cache()
+        for i, book_id in enumerate(ids):
+            ae(cache.format(book_id, 'FMT2'), b'fmt2 %d' % i)
+            ae(cache.field_for('cover', book_id), i == 2)
+
+    # }}}
+
+    def test_import_books_in_parallel(self):  # {{{
+        "Test adding books with metadata read in worker processes"
+        from calibre.db.adding import cdb_recursive_find, import_books_in_parallel
+
+        cache = self.init_cache()
+        ae = self.assertEqual
+        src = self.mkdtemp()
+        for i, name in enumerate(('one', 'two', 'three')):
+            d = os.path.join(src, str(i))
+            os.mkdir(d)
+            with open(os.path.join(d, f'Parallel {name}.txt'), 'wb') as f:
+                f.write(b'some text')
+        with open(os.path.join(src, '0', 'Parallel one.html'), 'wb') as f:
+            f.write(b'<p>some text</p>')
+        shutil.copytree(os.path.join(src, '1'), os.path.join(src, 'dup'))
+        ids, duplicates, failures = import_books_in_parallel(cache, cdb_recursive_find(src), max_workers=1)
+        ae(failures, [])
+        ae(len(ids), 3)
+        ae([mi.title for mi, paths in duplicates], ['Parallel two'])
+        titles = {cache.field_for('title', book_id): book_id for book_id in ids}
+        ae(set(titles), {'Parallel one', 'Parallel two', 'Parallel three'})
+        ae(set(cache.formats(titles['Parallel one'])), {'TXT', 'HTML'})
+        ae(cache.format(titles['Parallel two'], 'TXT'), b'some text')
+
+    # }}}
+
     def test_remove_books(self):  # {{{
         "Test removal of books"
         cl = self.cloned_library
@@ -494,6 +566,47 @@ def clear_extra_files(book_id):
 
     # }}}
 
+    def test_copy_books(self):  # {{{
+        from calibre.db.copy_to_library import copy_books
+
+        src_db = self.init_cache()
+        dest_db = self.init_cache(self.cloned_library)
+        book_ids = sorted(src_db.all_book_ids())
+        bookdir = os.path.dirname(src_db.format_abspath(1, '__COVER_INTERNAL__'))
+        with open(os.path.join(bookdir, 'exf'), 'w') as f:
+            f.write('exf')
+        src_db.set_annotations_for_book(1, 'FMT1', [({'type': 'bookmark', 'title': 'b1', 'seq': 1, 'timestamp': '2020-01-01T00:00:00+00:00'}, 1)])
+        before = set(dest_db.all_book_ids())
+        seen = []
+        results, failures = copy_books(book_ids, src_db, dest_db, allow_hardlinks=True, batch_size=2, progress=lambda *a: seen.append(a))
+        self.assertFalse(failures)
+        self.assertEqual(set(results), set(book_ids))
+        self.assertEqual(len(seen), len(book_ids))
+        for book_id, rdata in results.items():
+            new_book_id = rdata['new_book_id']
+            self.assertEqual(rdata['action'], 'add')
+            self.assertNotIn(new_book_id, before)
+            self.assertEqual(src_db.field_for('title', book_id), dest_db.field_for('title', new_book_id))
+            self.assertEqual(src_db.field_for('timestamp', book_id), dest_db.field_for('timestamp', new_book_id))
+            self.assertEqual(src_db.field_for('cover', book_id), dest_db.field_for('cover', new_book_id))
+            for fmt in src_db.formats(book_id):
+                self.assertEqual(src_db.format(book_id, fmt), dest_db.format(new_book_id, fmt))
+            self.assertEqual(src_db.all_annotations_for_book(book_id), dest_db.all_annotations_for_book(new_book_id))
+        new_book_id = results[1]['new_book_id']
+        self.assertIn('exf', [ef.relpath for ef in dest_db.list_extra_files(new_book_id)])
+        self.assertEqual(src_db.cover(1), dest_db.cover(new_book_id))
+
+        # Duplicates are skipped or merged exactly as by copy_one_book
+        results, failures = copy_books(book_ids, src_db, dest_db, duplicate_action='ignore')
+        self.assertFalse(failures)
+        self.assertEqual({r['action'] for r in results.values()}, {'duplicate'})
+        src_db.add_format(1, 'FMT1', BytesIO(b'merged'), run_hooks=False)
+        results, failures = copy_books([1], src_db, dest_db, duplicate_action='add_formats_to_existing')
+        self.assertEqual(results[1]['action'], 'automerge')
+        self.assertEqual(dest_db.format(new_book_id, 'FMT1'), b'merged')
+
+    # }}}
+
     def test_merging_extra_files(self):  # {{{
         db = self.init_cache()
 
@@ -338,6 +338,28 @@ def test_export_import(self):
                 bookdir = os.path.dirname(ic.format_abspath(1, '__COVER_INTERNAL__'))
                 self.assertEqual('exf', read(os.path.join(bookdir, 'exf')))
                 self.assertEqual('recurse', read(os.path.join(bookdir, 'sub', 'recurse')))
+        # Resuming an interrupted export
+        with TemporaryDirectory('export_lib') as tdir, TemporaryDirectory('import_lib') as idir:
+            exporter = Exporter(tdir, part_size=512 + Exporter.tail_size())
+            cache.export_library('l', exporter)
+            # Interrupted before commit, so the current part is incomplete
+            exporter.current_part.close()
+            resumed = Exporter(tdir, part_size=512 + Exporter.tail_size(), resume=True)
+            self.assertTrue(resumed.resumed_file_metadata)
+            cache.export_library('l', resumed)
+            resumed.commit()
+            self.assertFalse(os.path.exists(resumed.journal_path))
+            reused = [k for k, v in resumed.resumed_file_metadata.items() if tuple(v) == resumed.file_metadata.get(k) and 'metadata.db' not in k]
+            self.assertTrue(reused)
+            importer = Importer(tdir)
+            ic = import_library('l', importer, idir)
+            self.assertFalse(importer.corrupted_files)
+            for book_id in cache.all_book_ids():
+                self.assertEqual(cache.cover(book_id), ic.cover(book_id))
+                for fmt in cache.formats(book_id):
+                    self.assertEqual(cache.format(book_id, fmt), ic.format(book_id, fmt))
+            ic.close()
+
         r1 = cache.add_notes_resource(b'res1', 'res.jpg', mtime=time.time() - 113)
         r2 = cache.add_notes_resource(b'res2', 'res.jpg', mtime=time.time() - 1115)
         cache.set_notes_for('authors', 2, 'some notes', resource_hashes=(r1, r2))
@@ -368,6 +390,59 @@ def test_export_import(self):
             self.assertEqual(a, b)
             self.assertLess(abs(at - bt), 2)
 
+    def test_save_to_disk_in_parallel(self):
+        from calibre.library.save_to_disk import config, save_to_disk_in_parallel
+
+        cache = self.init_cache()
+        cache.set_field('title', {2: cache.field_for('title', 1)})
+        cache.set_field('authors', {2: cache.field_for('authors', 1)})
+        opts = config().parse()
+        opts.update_metadata = False
+        opts.template = '{title} - {authors}'
+        seen = []
+        with TemporaryDirectory('save_to_disk') as tdir:
+            failures = save_to_disk_in_parallel(cache, cache.all_book_ids(), tdir, opts, callback=lambda *a: seen.append(a[0]) or True, max_workers=2)
+            self.assertEqual(set(seen), set(cache.all_book_ids()))
+            self.assertEqual({f[0] for f in failures}, {book_id for book_id in cache.all_book_ids() if not cache.formats(book_id)})
+            saved = {}
+            for name in os.listdir(tdir):
+                ext = os.path.splitext(name)[1]
+                if ext not in {'.opf', '.jpg'}:
+                    saved[name] = read(os.path.join(tdir, name), 'rb')
+            expected = sorted(cache.format(book_id, fmt) for book_id in cache.all_book_ids() for fmt in cache.formats(book_id))
+            # Books 1 and 2 have the same path, so one of them gets a suffix
+            self.assertEqual(sorted(saved.values()), expected)
+
+    def test_save_to_disk_in_parallel_with_metadata(self):
+        from calibre.ebooks.metadata.meta import get_metadata
+        from calibre.library.save_to_disk import config, plugboard_save_to_disk_value, save_to_disk_in_parallel
+        from calibre.utils.resources import get_path as P
+
+        cache = self.init_cache()
+        with open(P('quick_start/eng.epub'), 'rb') as f:
+            cache.add_format(1, 'EPUB', f, run_hooks=False)
+        cache.set_field('title', {1: 'Saved title'})
+        cache.set_field('authors', {1: ['Saved Author']})
+        cache.set_field('tags', {1: ['saved tag']})
+        cache.set_pref('plugboards', {'epub': {plugboard_save_to_disk_value: [('{title} [plugboard]', 'title')]}})
+        opts = config().parse()
+        opts.update_metadata = True
+        opts.formats = 'epub'
+        opts.template = '{title}'
+        with TemporaryDirectory('save_to_disk') as tdir:
+            # The metadata is written into the saved files by worker processes
+            failures = save_to_disk_in_parallel(cache, [1], tdir, opts, max_workers=1)
+            self.assertEqual(failures, [])
+            saved = [x for x in os.listdir(tdir) if x.endswith('.epub')]
+            self.assertEqual(len(saved), 1)
+            with open(os.path.join(tdir, saved[0]), 'rb') as f:
+                mi = get_metadata(f, 'epub')
+            self.assertEqual(mi.title, 'Saved title [plugboard]')
+            self.assertEqual(mi.authors, ['Saved Author'])
+            self.assertEqual(mi.tags, ['saved tag'])
+            # The file in the library is not changed
+            self.assertNotEqual(get_metadata(BytesIO(cache.format(1, 'EPUB')), 'epub').title, mi.title)
+
     def test_find_books_in_directory(self):
         from calibre.db.adding import compile_rule, find_books_in_directory
 
@@ -3,6 +3,7 @@
 
 import inspect
 import numbers
+import os
 import reprlib
 import time
 from functools import partial
@@ -1188,3 +1189,39 @@ def test_legacy_saved_search(self):  # {{{
         db.close()
 
     # }}}
+
+    def test_check_library_incremental(self):  # {{{
+        "Test incremental library checking"
+        from calibre.library.check_library import CheckLibrary
+
+        library_path = self.cloned_library
+        db = self.init_legacy(library_path)
+        snapshot_path = os.path.join(self.mkdtemp(), 'snapshot.json')
+        past = time.time() - 100
+        for dirpath, dirnames, filenames in os.walk(library_path):
+            os.utime(dirpath, (past, past))
+
+        def check(**kw):
+            checker = CheckLibrary(library_path, db, snapshot_path=snapshot_path)
+            checker.scan_library([], [], **kw)
+            return {os.path.basename(x[1]) for x in checker.extra_files}
+
+        self.assertEqual(check(incremental=True), set())
+        self.assertTrue(os.path.exists(snapshot_path))
+        book_dir = os.path.dirname(db.new_api.format_abspath(1, '__COVER_INTERNAL__'))
+        with open(os.path.join(book_dir, 'extra-one'), 'w') as f:
+            f.write('x')
+        self.assertEqual(check(incremental=True), {'extra-one'})
+
+        # Changes that leave the folder mtime unchanged are only noticed when
+        # reported via changed_paths
+        book_dir = os.path.dirname(db.new_api.format_abspath(2, '__COVER_INTERNAL__'))
+        st = os.stat(book_dir)
+        with open(os.path.join(book_dir, 'extra-two'), 'w') as f:
+            f.write('x')
+        os.utime(book_dir, ns=(st.st_atime_ns, st.st_mtime_ns))
+        self.assertEqual(check(incremental=True, changed_paths=set()), {'extra-one'})
+        self.assertEqual(check(incremental=True, changed_paths={os.path.join(os.path.realpath(book_dir), 'extra-two')}), {'extra-one', 'extra-two'})
+        self.assertEqual(check(), {'extra-one', 'extra-two'})
+
+    # }}}
@@ -913,6 +913,24 @@ def test_find_identical_books(self):  # {{{
         ):
             self.assertEqual(books, cache.find_identical_books(mi))
             self.assertEqual(books, find_identical_books(mi, data))
+            self.assertEqual(books, find_identical_books(mi, data[:4]))
+
+        # The duplicate index must be kept up to date
+        mi = Metadata('The [Title] One', ['Author One'])
+        self.assertTrue(cache.has_book(Metadata('TITLE ONE')))
+        cache.set_field('title', {2: 'something else'})
+        self.assertFalse(cache.has_book(Metadata('TITLE ONE')))
+        self.assertEqual(set(), cache.find_identical_books(mi))
+        cache.set_field('title', {2: 'Title one'})
+        self.assertEqual({2}, cache.find_identical_books(mi))
+        cache.set_field('identifiers', {2: {'isbn': '9780306406157'}})
+        self.assertEqual({2}, cache.books_with_identifiers({'isbn': '9780306406157', 'x': 'y'}))
+        book_id = cache.create_book_entry(Metadata('title one', ['author one']))
+        self.assertEqual({2, book_id}, cache.find_identical_books(mi))
+        cache.remove_books((2,))
+        self.assertEqual({book_id}, cache.find_identical_books(mi))
+        self.assertFalse(cache.books_with_identifiers({'isbn': '9780306406157'}))
+        self.assertIn('title one', cache.data_for_has_book())
 
     # }}}
 
@@ -458,6 +458,88 @@ def read_all_extra_files(book_id=1):
 
     # }}}
 
+    def test_batched_backup(self):  # {{{
+        "Test the batched backup of changed metadata"
+        from calibre.db.backup import MetadataBackup
+        from calibre.ebooks.metadata.opf2 import OPF
+
+        cache = self.init_cache(self.cloned_library)
+        ae, af = self.assertEqual, self.assertFalse
+        cache.dump_metadata()
+        af(cache.dirtied_cache)
+        for pool_threshold in (1000, 1):
+            ae(cache.set_field('title', {1: 'title1', 2: 'title2', 3: 'title3'}), {1, 2, 3})
+            ae(cache.get_dirtied_books(), [1, 2, 3])
+            ae(set(cache.get_dirtied_books(2)), {1, 2})
+            mb = MetadataBackup(cache, interval=0.01, scheduling_interval=0, batch_size=2, max_workers=1, pool_threshold=pool_threshold)
+            mb.start()
+            try:
+                count = 30
+                while cache.dirty_queue_length() and count > 0:
+                    mb.join(1)
+                    count -= 1
+                af(cache.dirty_queue_length())
+            finally:
+                mb.stop()
+            mb.join(2)
+            af(mb.is_alive())
+            for book_id in (1, 2, 3):
+                ae(OPF(BytesIO(cache.read_backup(book_id))).title, f'title{book_id}')
+            cache.set_field('title', {1: 'x', 2: 'x', 3: 'x'})
+            cache.dump_metadata()
+
+        # Books whose backup cannot be written are retried later without
+        # changing their last modified date, then dropped from the queue
+        bad_path = cache.field_for('path', 2)
+        orig_write_backup = cache.backend.write_backup
+
+        def write_backup(path, raw, **kw):
+            if path == bad_path:
+                raise OSError('Read only folder')
+            return orig_write_backup(path, raw, **kw)
+
+        cache.backend.write_backup = write_backup
+        cache.set_field('title', {1: 'ok', 2: 'fails', 3: 'ok'})
+        last_modified = cache.field_for('last_modified', 2)
+        mb = MetadataBackup(cache, interval=0, scheduling_interval=0, batch_size=2, max_workers=0)
+        mb.do_batch()
+        ae(cache.get_dirtied_books(), [3, 2])
+        mb.do_batch()
+        ae(cache.get_dirtied_books(), [2])
+        ae(mb.failures, {2: 2})
+        attempts = 2
+        while cache.dirty_queue_length() and attempts < 10:
+            mb.do_batch()
+            attempts += 1
+        ae(attempts, mb.max_failures)
+        af(cache.dirty_queue_length())
+        af(mb.failures)
+        ae(cache.field_for('last_modified', 2), last_modified)
+        ae(OPF(BytesIO(cache.read_backup(3))).title, 'ok')
+        cache.backend.write_backup = orig_write_backup
+
+        # Books are still backed up when the worker processes fail
+        class BrokenWorkers(MetadataBackup):
+            worker_function = 'no_such_function'
+
+        cache.set_field('title', {1: 'pool1', 2: 'pool2', 3: 'pool3'})
+        mb = BrokenWorkers(cache, interval=0.01, scheduling_interval=0, batch_size=2, max_workers=1, pool_threshold=1)
+        mb.start()
+        try:
+            count = 30
+            while cache.dirty_queue_length() and count > 0:
+                mb.join(1)
+                count -= 1
+            af(cache.dirty_queue_length())
+            self.assertTrue(mb.is_alive())
+        finally:
+            mb.stop()
+        mb.join(2)
+        for book_id in (1, 2, 3):
+            ae(OPF(BytesIO(cache.read_backup(book_id))).title, f'pool{book_id}')
+
+    # }}}
+
     def test_set_cover(self):  # {{{
         "Test setting of cover"
         cache = self.init_cache()
@@ -483,6 +565,68 @@ def test_set_cover(self):  # {{{
 
     # }}}
 
+    def test_process_covers(self):  # {{{
+        "Test scaling and compressing covers in a worker pool"
+        from calibre.utils.img import image_from_path
+
+        cache = self.init_cache(self.cloned_library)
+        ae = self.assertEqual
+        cache.set_cover({1: IMG, 2: IMG, 3: None})
+        tdir = self.mkdtemp()
+        progress = {}
+        ans = cache.scale_covers((1, 2, 3), tdir, width=20, height=20, progress_callback=progress.__setitem__)
+        ae(set(ans), {1, 2})
+        ae(set(progress), {1, 2})
+        for book_id, path in ans.items():
+            ae(path, os.path.join(tdir, f'{book_id}.jpg'))
+            img = image_from_path(path)
+            self.assertLessEqual(max(img.width(), img.height()), 20)
+        ae(set(os.listdir(tdir)), {'1.jpg', '2.jpg'})
+
+        progress = {}
+        cache.dump_metadata()
+        changed = cache.compress_covers((1, 2, 3), 50, lambda book_id, old_sz, new_sz: progress.__setitem__(book_id, (old_sz, new_sz)))
+        ae(set(progress), {1, 2, 3})
+        ae(progress[3][1], 'ENOENT')
+        ae(changed, {book_id for book_id in (1, 2) if progress[book_id][0] != progress[book_id][1]})
+        for book_id in changed:
+            ae(os.path.getsize(cache.backend.cover_path(cache.field_for('path', book_id))), progress[book_id][1])
+
+        from calibre.db.covers import process_covers
+
+        src = cache.backend.cover_path(cache.field_for('path', 1))
+        options = {'resize_to': (10, 12), 'grayscale': True, 'data_fmt': 'png'}
+        ans = process_covers([(i, src, os.path.join(tdir, f'r{i}.png'), ('render', options)) for i in range(3)])
+        ae(set(ans), {0, 1, 2})
+        for i in range(3):
+            img = image_from_path(os.path.join(tdir, f'r{i}.png'))
+            ae((img.width(), img.height()), (10, 12))
+
+        # A crashed worker process does not abort processing, the images that
+        # could not be processed get error details
+        from unittest.mock import patch
+
+        from calibre.utils.ipc.pool import Pool
+
+        class CrashingPool(Pool):
+            def __call__(self, job_id, module, func, *args, **kwargs):
+                if job_id == 1:
+                    module, func = 'sys', 'exit'
+                return super().__call__(job_id, module, func, *args, **kwargs)
+
+        progress = {}
+        with patch('calibre.utils.ipc.pool.Pool', CrashingPool):
+            ans = process_covers(
+                [(i, src, os.path.join(tdir, f'c{i}.png'), ('render', options)) for i in range(3)], progress.__setitem__, max_workers=1, batch_size=1
+            )
+        ae(ans, progress)
+        ae(set(ans), {0, 1, 2})
+        self.assertIsInstance(ans[0], int)
+        for i in (1, 2):
+            self.assertIsInstance(ans[i], str)
+
+    # }}}
+
     def test_set_metadata(self):  # {{{
         "Test setting of metadata"
         ae = self.assertEqual
@@ -546,6 +690,80 @@ def test_set_metadata(self):  # {{{
 
     # }}}
 
+    def test_device_match_index(self):  # {{{
+        "Test matching of device books with library books"
+        cache = self.init_cache(self.cloned_library)
+        ae = self.assertEqual
+
+        def match(*books):
+            return cache.match_device_books([Metadata(*b) if isinstance(b, tuple) else b for b in books])
+
+        mi = Metadata('Title One', ['Author One'])
+        mi.uuid = cache.field_for('uuid', 1)
+        t2, a2 = cache.field_for('title', 2), cache.field_for('authors', 2)
+        ae(match(mi, (t2.upper() + '!', a2), ('Unknown title', a2)), [('UUID', 1), ('AUTHOR', 2), (None, None)])
+        mi = Metadata(t2, ['Someone else'])
+        mi.application_id = 2
+        ae(match(mi), [('APP_ID', 2)])
+        mi.application_id, mi.db_id = 1, 2
+        ae(match(mi), [('DB_ID', 2)])
+        ae(match((t2, [cache.field_for('author_sort', 2)])), [('AUTH_SORT', 2)])
+
+        # The index must be kept up to date as the library changes
+        cache.set_field('title', {2: 'Changed title'})
+        ae(match((t2, a2), ('changed TITLE', a2)), [(None, None), ('AUTHOR', 2)])
+        cache.set_field('authors', {2: ['New Author']})
+        ae(match(('Changed title', a2), ('Changed title', ['New Author']), ('Changed title', ['Author, New'])), [(None, None), ('AUTHOR', 2), ('AUTH_SORT', 2)])
+        cache.set_field('author_sort', {2: 'xxx'})
+        ae(match(('Changed title', ['Author, New']), ('Changed title', ['XXX'])), [(None, None), ('AUTH_SORT', 2)])
+        cache.rename_items('authors', {cache.get_item_id('authors', 'New Author'): 'Renamed Author'})
+        ae(match(('Changed title', ['Renamed Author'])), [('AUTHOR', 2)])
+        book_id = cache.create_book_entry(Metadata('Brand new', ['Some Author']))
+        ae(match(('Brand new', ['some author'])), [('AUTHOR', book_id)])
+        cache.remove_books((book_id,))
+        ae(match(('Brand new', ['some author'])), [(None, None)])
+
+    # }}}
+
+    def test_set_metadata_for_books(self):  # {{{
+        "Test setting metadata for many books at once"
+        ae = self.assertEqual
+        exclude = {'last_modified', 'format_metadata', 'formats', 'pages'}
+        cache = self.init_cache(self.cloned_library)
+        mi_map = {}
+        for src, dest in ((3, 1), (1, 2), (2, 3)):
+            mi = cache.get_metadata(src, get_cover=True, cover_as_data=True)
+            mi.title, mi.authors = f'Title {dest}', [f'Author {dest}', 'Common Author']
+            mi.tags = list(mi.tags) + ['common tag']
+            mi.set_identifier('isbn', f'97800000000{dest}')
+            mi_map[dest] = mi
+
+        # Set the metadata one book at a time for comparison
+        for book_id, mi in mi_map.items():
+            cache.set_metadata(book_id, mi)
+        expected = {book_id: cache.get_metadata(book_id, get_cover=True, cover_as_data=True) for book_id in mi_map}
+        paths = {book_id: cache.field_for('path', book_id) for book_id in mi_map}
+
+        cache = self.init_cache(self.cloned_library)
+        cache.dump_metadata()
+        ae(cache.set_metadata_for_books(mi_map), {1, 2, 3})
+        ae(cache.dirtied_cache.keys(), {1, 2, 3})
+        for book_id, mi in expected.items():
+            nmi = cache.get_metadata(book_id, get_cover=True, cover_as_data=True)
+            ae(nmi.cover_data, mi.cover_data)
+            self.compare_metadata(nmi, mi, exclude=exclude)
+            ae(cache.field_for('path', book_id), paths[book_id])
+            self.assertTrue(os.path.exists(cache.format_abspath(book_id, cache.formats(book_id)[0])))
+
+        # Errors in one book must not prevent the others from being set
+        mi_map = {1: Metadata('x', ['y']), 2: Metadata('x', ['y'])}
+        mi_map[1].rating, mi_map[2].rating = 'bad rating', 4
+        self.assertRaises(Exception, cache.set_metadata_for_books, mi_map)
+        cache.set_metadata_for_books(mi_map, ignore_errors=True)
+        ae(cache.field_for('rating', 2), 4)
+
+    # }}}
+
     def test_conversion_options(self):  # {{{
         "Test saving of conversion options"
         cache = self.init_cache()
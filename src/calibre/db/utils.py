@@ -7,7 +7,7 @@
 import shutil
 import sys
 import tempfile
-from collections import OrderedDict, namedtuple
+from collections import OrderedDict, defaultdict, namedtuple
 from contextlib import suppress
 from locale import localeconv
 from threading import RLock
@@ -69,29 +69,192 @@ def fuzzy_title(title):
     return title
 
 
+class DuplicateIndex:
+    """
+    An index of books by title and identifiers, used to quickly find possible
+    duplicates of books being added. Maps fuzzy titles (see
+    :func:`fuzzy_title`), lower cased titles and (identifier type, value)
+    pairs to the sets of ids of the books that have them.
+    """
+
+    def __init__(self, title_map, identifier_map):
+        self.fuzzy_title_map = defaultdict(set)
+        self.lower_title_map = defaultdict(set)
+        self.identifier_map = defaultdict(set)
+        self.book_keys = {}
+        for book_id, title in title_map.items():
+            self.add(book_id, title, identifier_map.get(book_id))
+
+    def add(self, book_id, title, identifiers=None):
+        self.discard(book_id)
+        title = as_unicode(title or '')
+        keys = self.book_keys[book_id] = fuzzy_title(title), icu_lower(title), tuple((identifiers or {}).items())
+        self.fuzzy_title_map[keys[0]].add(book_id)
+        self.lower_title_map[keys[1]].add(book_id)
+        for key in keys[2]:
+            self.identifier_map[key].add(book_id)
+
+    def discard(self, book_id):
+        keys = self.book_keys.pop(book_id, None)
+        if keys is not None:
+            fuzzy, lower, identifiers = keys
+            for m, key in ((self.fuzzy_title_map, fuzzy), (self.lower_title_map, lower)):
+                m[key].discard(book_id)
+                if not m[key]:
+                    del m[key]
+            for key in identifiers:
+                self.identifier_map[key].discard(book_id)
+                if not self.identifier_map[key]:
+                    del self.identifier_map[key]
+
+    def books_with_title(self, title):
+        "Books whose title is the same as title, ignoring case"
+        return self.lower_title_map.get(icu_lower(title).strip(), set())
+
+    def books_with_fuzzy_title(self, title):
+        "Books whose title is the same as title after applying :func:`fuzzy_title`"
+        return self.fuzzy_title_map.get(fuzzy_title(title), set())
+
+    def books_with_identifiers(self, identifiers):
+        "Books that have at least one of the specified identifiers"
+        ans = set()
+        for key in identifiers.items():
+            ans |= self.identifier_map.get(key, set())
+        return ans
+
+
+_device_match_pat = re.compile(r'(?u)\W|[_]')
+
+
+def device_match_key(x):
+    "Normalize a title or author for matching books on a device with books in the library"
+    try:
+        x = x.lower() if x else ''
+    except Exception:
+        x = ''
+    return _device_match_pat.sub('', x)
+
+
+class DeviceMatchIndex:
+    """
+    An index of books by uuid and by normalized (see :func:`device_match_key`)
+    title, authors and author sort, used to match the books on a device with
+    the books in the library, see :meth:`match`.
+    """
+
+    def __init__(self, books=()):
+        "books is an iterable of (book_id, title, authors, author_sort, uuid)"
+        self.uuid_map = {}
+        self.title_map = defaultdict(set)
+        self.authors_map = defaultdict(set)
+        self.author_sort_map = defaultdict(set)
+        self.book_keys = {}
+        for book in books:
+            self.add(*book)
+
+    def add(self, book_id, title, authors, author_sort, uuid):
+        from calibre.ebooks.metadata import authors_to_string
+
+        self.discard(book_id)
+        tkey = device_match_key(title)
+        akey, askey = device_match_key(authors_to_string(authors or ())), device_match_key(author_sort)
+        self.book_keys[book_id] = tkey, akey, askey, uuid
+        self.title_map[tkey].add(book_id)
+        if akey:
+            self.authors_map[tkey, akey].add(book_id)
+        if askey:
+            self.author_sort_map[tkey, askey].add(book_id)
+        if uuid:
+            self.uuid_map[uuid] = book_id
+
+    def discard(self, book_id):
+        keys = self.book_keys.pop(book_id, None)
+        if keys is not None:
+            tkey, akey, askey, uuid = keys
+            for m, key in ((self.title_map, tkey), (self.authors_map, (tkey, akey)), (self.author_sort_map, (tkey, askey))):
+                ids = m.get(key)
+                if ids is not None:
+                    ids.discard(book_id)
+                    if not ids:
+                        del m[key]
+            if uuid and self.uuid_map.get(uuid) == book_id:
+                del self.uuid_map[uuid]
+
+    def match(self, title, authors, uuid=None, application_id=None, db_id=None):
+        """
+        Find the book in the library matching a book on the device. Returns
+        ``(how, book_id)`` where how is one of ``UUID``, ``APP_ID``, ``DB_ID``,
+        ``AUTHOR`` or ``AUTH_SORT`` or ``(None, None)`` if there is no match.
+        A book matches if it has the same uuid, or failing that, the same title
+        and either the same id or the same authors or author sort. If there are
+        several books in the library with the same title and authors, one is
+        as good as another.
+        """
+        from calibre.ebooks.metadata import authors_to_string
+
+        if uuid:
+            book_id = self.uuid_map.get(uuid)
+            if book_id is not None:
+                return 'UUID', book_id
+        tkey = device_match_key(title)
+        ids = self.title_map.get(tkey)
+        if not ids:
+            return None, None
+        if application_id in ids:
+            return 'APP_ID', application_id
+        # Sonys know their db_id independent of the application_id
+        if db_id in ids:
+            return 'DB_ID', db_id
+        if authors:
+            # Compare against both author and author sort, because either can
+            # appear as the author
+            for akey in [device_match_key(authors_to_string(authors))] + [device_match_key(a) for a in authors]:
+                for how, m in (('AUTHOR', self.authors_map), ('AUTH_SORT', self.author_sort_map)):
+                    ids = m.get((tkey, akey))
+                    if ids:
+                        return how, max(ids)
+        return None, None
+
+
 def find_identical_books(mi, data):
-    author_map, aid_map, title_map, lang_map = data
-    found_books = None
-    for a in mi.authors:
-        author_ids = author_map.get(icu_lower(str(a)))
-        if author_ids is None:
-            return set()
-        books_by_author = {book_id for aid in author_ids for book_id in aid_map.get(aid, ())}
-        if found_books is None:
-            found_books = books_by_author
-        else:
-            found_books &= books_by_author
-        if not found_books:
+    author_map, aid_map, title_map, lang_map = data[:4]
+    # Data from older versions of calibre does not have the fuzzy title map
+    fuzzy_title_map = data[4] if len(data) > 4 else None
+    titleq = fuzzy_title(mi.title)
+    if fuzzy_title_map is not None:
+        # Look up the books with a matching title first, there are usually very
+        # few of them, then check their authors.
+        if not mi.authors:
             return set()
+        ans = set(fuzzy_title_map.get(titleq, ()))
+        for a in mi.authors:
+            if not ans:
+                return ans
+            author_ids = author_map.get(icu_lower(str(a)))
+            if author_ids is None:
+                return set()
+            ans = {book_id for book_id in ans if any(book_id in aid_map.get(aid, ()) for aid in author_ids)}
+    else:
+        found_books = None
+        for a in mi.authors:
+            author_ids = author_map.get(icu_lower(str(a)))
+            if author_ids is None:
+                return set()
+            books_by_author = {book_id for aid in author_ids for book_id in aid_map.get(aid, ())}
+            if found_books is None:
+                found_books = books_by_author
+            else:
+                found_books &= books_by_author
+            if not found_books:
+                return set()
 
-    ans = set()
-    if found_books is None:
-        return ans
-    titleq = fuzzy_title(mi.title)
-    for book_id in found_books:
-        title = title_map.get(book_id, '')
-        if fuzzy_title(title) == titleq:
-            ans.add(book_id)
+        ans = set()
+        if found_books is None:
+            return ans
+        for book_id in found_books:
+            title = title_map.get(book_id, '')
+            if fuzzy_title(title) == titleq:
+                ans.add(book_id)
 
     langq = tuple(filter(lambda x: x and x != 'und', map(canonicalize_lang, mi.languages or ())))
     if not langq:
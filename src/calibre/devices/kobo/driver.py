@@ -1602,6 +1602,12 @@ class KOBOTOUCH(KOBO):
 
     TIMESTAMP_STRING = '%Y-%m-%dT%H:%M:%SZ'
 
+    # When uploading at least this many books, their cover images are
+    # generated together in a pool of worker processes
+    MIN_BOOKS_FOR_COVER_POOL = 4
+    # Covers of books being uploaded, collected by upload_cover()
+    deferred_covers = None
+
     AURA_PRODUCT_ID = [0x4203]
     AURA_EDITION2_PRODUCT_ID = [0x4226]
     AURA_HD_PRODUCT_ID = [0x4193]
@@ -2653,7 +2659,14 @@ def should_modify(name: str, mi) -> bool:
 
         self.report_progress(0, 'Working...')
 
-        result = super().upload_books(files, names, on_card, end_session, metadata)
+        self.deferred_covers = []
+        try:
+            result = super().upload_books(files, names, on_card, end_session, metadata)
+        finally:
+            deferred_covers, self.deferred_covers = self.deferred_covers, None
+            if deferred_covers:
+                self.report_progress(1.0, _('Uploading covers to device...'))
+                self.upload_deferred_covers(deferred_covers)
         # debug_print('KoboTouch:upload_books - result=', result)
 
         if self.dbversion >= 53:
@@ -3033,6 +3046,8 @@ def update_device_database_collections(self, booklists, collections_attributes,
                             self.check_for_bookshelf(connection, category)
                         # if category in self.bookshelvelist:
                         #     debug_print("Category: ", category, " id = ", readstatuslist.get(category))
+                        # Books are added to the shelf together, after the loop
+                        shelf_books = []
                         for book in books:
                             # debug_print('    Title:', book.title, 'category: ', category)
                             show_debug = self.is_debugging_title(book.title)
@@ -3063,7 +3078,7 @@ def update_device_database_collections(self, booklists, collections_attributes,
                                 if category not in book.device_collections:
                                     if show_debug:
                                         debug_print('        Setting bookshelf on device')
-                                    self.set_bookshelf(connection, book, category)
+                                    shelf_books.append(book)
                                     category_added = True
                             elif category in readstatuslist:
                                 debug_print(f"KoboTouch:update_device_database_collections - about to set_readstatus - category='{category}'")
@@ -3093,6 +3108,8 @@ def update_device_database_collections(self, booklists, collections_attributes,
                                 book.device_collections.append(category)
                             elif show_debug:
                                 debug_print('            category not added to book.device_collections', book.device_collections)
+                        if shelf_books:
+                            self.set_bookshelf_for_books(connection, shelf_books, category)
                         debug_print(f"KoboTouch:update_device_database_collections - end for category='{category}'")
 
                 elif have_bookshelf_attributes:  # No collections but have set the shelf option
@@ -3180,6 +3197,10 @@ def upload_cover(self, path, filename, metadata, filepath):
         if self._card_a_prefix and os.path.abspath(path).startswith(os.path.abspath(self._card_a_prefix)) and not self.supports_covers_on_sdcard():
             return
 
+        if self.deferred_covers is not None:
+            self.deferred_covers.append((path, filename, metadata, filepath))
+            return
+
         # debug_print('KoboTouch: uploading cover')
         try:
             self._upload_cover(
@@ -3197,6 +3218,97 @@ def upload_cover(self, path, filename, metadata, filepath):
         except Exception as e:
             debug_print(f'KoboTouch: FAILED to upload cover={filepath} Exception={e!s}')
 
+    def upload_deferred_covers(self, jobs):
+        """
+        Upload the covers for several books, as collected by :meth:`upload_cover`
+        while uploading books. All the cover images are generated in a pool of
+        worker processes, unless there are only a few books or a subclass
+        customizes :meth:`_create_cover_data`.
+        """
+        if len(jobs) < self.MIN_BOOKS_FOR_COVER_POOL or type(self)._create_cover_data is not KOBOTOUCH._create_cover_data:
+            for path, filename, metadata, filepath in jobs:
+                try:
+                    self._upload_cover(
+                        path,
+                        filename,
+                        metadata,
+                        filepath,
+                        self.upload_grayscale,
+                        self.dithered_covers,
+                        self.keep_cover_aspect,
+                        self.letterbox_fs_covers,
+                        self.png_covers,
+                        letterbox_color=self.letterbox_fs_covers_color,
+                    )
+                except Exception as e:
+                    debug_print(f'KoboTouch: FAILED to upload cover={filepath} Exception={e!s}')
+            return
+        try:
+            self._upload_covers_in_pool(jobs)
+        except Exception as e:
+            debug_print(f'KoboTouch: FAILED to upload covers Exception={e!s}')
+
+    def _upload_covers_in_pool(self, jobs):
+        from calibre.db.covers import process_covers
+        from calibre.utils.imghdr import identify
+
+        debug_print(f'KoboTouch:_upload_covers_in_pool - {len(jobs)} books')
+        books = []
+        for path, filename, metadata, filepath in jobs:
+            if not metadata.cover:
+                continue
+            cover = self.normalize_path(metadata.cover.replace('/', os.sep))
+            if not os.path.exists(cover):
+                debug_print('KoboTouch:_upload_covers_in_pool - Cover file does not exist in library')
+                continue
+            extension = os.path.splitext(filepath)[1]
+            ContentType = self.get_content_type_from_extension(extension) if extension else self.get_content_type_from_path(filepath)
+            books.append((path, filename, cover, self.contentid_from_path(filepath, ContentType)))
+        if not books:
+            return
+
+        with self.database_transaction() as connection:
+            cursor = connection.cursor()
+            books = [(path, filename, cover, self._cover_image_id(cursor, ContentID)) for path, filename, cover, ContentID in books]
+            cursor.close()
+
+        png_covers = self.png_covers
+        tasks = []
+        for path, filename, cover, ImageID in books:
+            if ImageID is None:
+                continue
+            show_debug = self.is_debugging_title(filename)
+            path = self.images_path(path, ImageID)
+            image_dir = os.path.dirname(os.path.abspath(path))
+            if not os.path.exists(image_dir):
+                debug_print(f"KoboTouch:_upload_covers_in_pool - Image folder does not exist. Creating path='{image_dir}'")
+                os.makedirs(image_dir)
+            fmt, width, height = identify(cover)
+            for fpath, resize_to, expand_to, kobo_size, is_full_size, letterbox, quality in self._cover_renditions(
+                path, (width, height), self.keep_cover_aspect, self.letterbox_fs_covers, png_covers, show_debug
+            ):
+                options = {
+                    'resize_to': resize_to,
+                    'compression_quality': quality,
+                    'minify_to': expand_to,
+                    'grayscale': self.upload_grayscale,
+                    'eink': self.dithered_covers,
+                    'letterbox': letterbox,
+                    'data_fmt': 'png' if png_covers else 'jpeg',
+                    'letterbox_color': self.letterbox_fs_covers_color,
+                }
+                if png_covers:
+                    options['optimize_png'] = 1
+                tasks.append((fpath, cover, fpath, ('render', options)))
+
+        def report(fpath, result):
+            if isinstance(result, int):
+                debug_print(f'KoboTouch:_upload_covers_in_pool - uploaded to {fpath}')
+            else:
+                debug_print(f'KoboTouch: FAILED to upload cover={fpath} Error={result}')
+
+        process_covers(tasks, report)
+
     def imageid_from_contentid(self, ContentID):
         ImageID = ContentID.replace('/', '_')
         ImageID = ImageID.replace(' ', '_')
@@ -3259,6 +3371,66 @@ def _calculate_kobo_cover_size(self, library_size, kobo_size, expand, keep_cover
                 canvas_size = kobo_size
         return kobo_size, canvas_size
 
+    def _cover_image_id(self, cursor, ContentID):
+        cursor.execute('select ImageId from Content where BookID is Null and ContentID = ?', (ContentID,))
+        try:
+            result = next(cursor)
+            return result[0]
+        except StopIteration:
+            ImageID = self.imageid_from_contentid(ContentID)
+            debug_print(f"KoboTouch:_upload_cover - No rows exist in the database - generated ImageID='{ImageID}'")
+            return ImageID
+
+    def _cover_renditions(self, path, library_cover_size, keep_cover_aspect=False, letterbox_fs_covers=False, png_covers=False, show_debug=False):
+        """
+        Yield ``(fpath, resize_to, expand_to, kobo_size, is_full_size, letterbox, quality)``
+        for every cover image needed by the device for a book. path is the
+        path to the images of the book, without the ending.
+        """
+        for ending, cover_options in self.cover_file_endings().items():
+            kobo_size, min_dbversion, max_dbversion, is_full_size = cover_options
+            if show_debug:
+                debug_print(
+                    f'KoboTouch:_upload_cover - library_cover_size={library_cover_size} -> kobo_size={kobo_size},'
+                    f' min_dbversion={min_dbversion} max_dbversion={max_dbversion}, is_full_size={is_full_size}'
+                )
+
+            if self.dbversion >= min_dbversion and self.dbversion <= max_dbversion:
+                if show_debug:
+                    debug_print(f"KoboTouch:_upload_cover - creating cover for ending='{ending}'")  # , "library_cover_size'%s'"%library_cover_size)
+                fpath = path + ending
+                fpath = self.normalize_path(fpath.replace('/', os.sep))
+
+                # Never letterbox thumbnails, that's ugly. But for fullscreen covers, honor the setting.
+                letterbox = letterbox_fs_covers and is_full_size
+
+                # NOTE: Full size means we have to fit *inside* the
+                # given boundaries. Thumbnails, on the other hand, are
+                # *expanded* around those boundaries.
+                #       In Qt, it'd mean full-screen covers are resized
+                #       using Qt::KeepAspectRatio, while thumbnails are
+                #       resized using Qt::KeepAspectRatioByExpanding
+                #       (i.e., QSize's boundedTo() vs. expandedTo(). See also IM's '^' geometry token, for the same "expand" behavior.)
+                #       Note that Nickel itself will generate bounded thumbnails, while it will download expanded thumbnails for store-bought KePubs...
+                #       We chose to emulate the KePub behavior.
+                resize_to, expand_to = self._calculate_kobo_cover_size(library_cover_size, kobo_size, not is_full_size, keep_cover_aspect, letterbox)
+                if show_debug:
+                    debug_print(
+                        f'KoboTouch:_calculate_kobo_cover_size - expand_to={expand_to}'
+                        f' (vs. kobo_size={kobo_size}) & resize_to={resize_to}, keep_cover_aspect={keep_cover_aspect} '
+                        f'& letterbox_fs_covers={letterbox_fs_covers}, png_covers={png_covers}'
+                    )
+
+                # NOTE: To speed things up, we enforce a lower
+                # compression level for png_covers, as the final
+                # optipng pass will then select a higher compression
+                # level anyway,
+                #       so the compression level from that first pass
+                #       is irrelevant, and only takes up precious time
+                #       ;).
+                quality = 10 if png_covers else 90
+                yield fpath, resize_to, expand_to, kobo_size, is_full_size, letterbox, quality
+
     def _create_cover_data(
         self,
         cover_data,
@@ -3349,15 +3521,7 @@ def _upload_cover(
         try:
             with self.database_transaction() as connection:
                 cursor = connection.cursor()
-                t = (ContentID,)
-                cursor.execute('select ImageId from Content where BookID is Null and ContentID = ?', t)
-                try:
-                    result = next(cursor)
-                    ImageID = result[0]
-                except StopIteration:
-                    ImageID = self.imageid_from_contentid(ContentID)
-                    debug_print(f"KoboTouch:_upload_cover - No rows exist in the database - generated ImageID='{ImageID}'")
-
+                ImageID = self._cover_image_id(cursor, ContentID)
                 cursor.close()
 
             if ImageID is not None:
@@ -3377,85 +3541,45 @@ def _upload_cover(
                 fmt, width, height = identify(cover_data)
                 library_cover_size = (width, height)
 
-                for ending, cover_options in self.cover_file_endings().items():
-                    kobo_size, min_dbversion, max_dbversion, is_full_size = cover_options
-                    if show_debug:
-                        debug_print(
-                            f'KoboTouch:_upload_cover - library_cover_size={library_cover_size} -> kobo_size={kobo_size},'
-                            f' min_dbversion={min_dbversion} max_dbversion={max_dbversion}, is_full_size={is_full_size}'
-                        )
-
-                    if self.dbversion >= min_dbversion and self.dbversion <= max_dbversion:
-                        if show_debug:
-                            debug_print(f"KoboTouch:_upload_cover - creating cover for ending='{ending}'")  # , "library_cover_size'%s'"%library_cover_size)
-                        fpath = path + ending
-                        fpath = self.normalize_path(fpath.replace('/', os.sep))
-
-                        # Never letterbox thumbnails, that's ugly. But for fullscreen covers, honor the setting.
-                        letterbox = letterbox_fs_covers and is_full_size
-
-                        # NOTE: Full size means we have to fit *inside* the
-                        # given boundaries. Thumbnails, on the other hand, are
-                        # *expanded* around those boundaries.
-                        #       In Qt, it'd mean full-screen covers are resized
-                        #       using Qt::KeepAspectRatio, while thumbnails are
-                        #       resized using Qt::KeepAspectRatioByExpanding
-                        #       (i.e., QSize's boundedTo() vs. expandedTo(). See also IM's '^' geometry token, for the same "expand" behavior.)
-                        #       Note that Nickel itself will generate bounded thumbnails, while it will download expanded thumbnails for store-bought KePubs...
-                        #       We chose to emulate the KePub behavior.
-                        resize_to, expand_to = self._calculate_kobo_cover_size(library_cover_size, kobo_size, not is_full_size, keep_cover_aspect, letterbox)
-                        if show_debug:
-                            debug_print(
-                                f'KoboTouch:_calculate_kobo_cover_size - expand_to={expand_to}'
-                                f' (vs. kobo_size={kobo_size}) & resize_to={resize_to}, keep_cover_aspect={keep_cover_aspect} '
-                                f'& letterbox_fs_covers={letterbox_fs_covers}, png_covers={png_covers}'
-                            )
-
-                        # NOTE: To speed things up, we enforce a lower
-                        # compression level for png_covers, as the final
-                        # optipng pass will then select a higher compression
-                        # level anyway,
-                        #       so the compression level from that first pass
-                        #       is irrelevant, and only takes up precious time
-                        #       ;).
-                        quality = 10 if png_covers else 90
-
-                        # Return the data resized and properly grayscaled/dithered/letterboxed if requested
-                        data = self._create_cover_data(
-                            cover_data,
-                            resize_to,
-                            expand_to,
-                            kobo_size,
-                            uploadgrayscale,
-                            dithered_covers,
-                            keep_cover_aspect,
-                            is_full_size,
-                            letterbox,
-                            png_covers,
-                            quality,
-                            letterbox_color=letterbox_color,
-                        )
-
-                        # NOTE: If we're writing a PNG file, go through a quick
-                        # optipng pass to make sure it's encoded properly, as
-                        # Qt doesn't afford us enough control to do it right...
-                        #       Unfortunately, optipng doesn't support reading
-                        #       pipes, so this gets a bit clunky as we have go
-                        #       through a temporary file...
-                        debug_print(f'KoboTouch:_upload_cover - uploaded to {fpath}')
-                        if png_covers:
-                            tmp_cover = better_mktemp()
-                            with open(tmp_cover, 'wb') as f:
-                                f.write(data)
+                for fpath, resize_to, expand_to, kobo_size, is_full_size, letterbox, quality in self._cover_renditions(
+                    path, library_cover_size, keep_cover_aspect, letterbox_fs_covers, png_covers, show_debug
+                ):
+                    # Return the data resized and properly grayscaled/dithered/letterboxed if requested
+                    data = self._create_cover_data(
+                        cover_data,
+                        resize_to,
+                        expand_to,
+                        kobo_size,
+                        uploadgrayscale,
+                        dithered_covers,
+                        keep_cover_aspect,
+                        is_full_size,
+                        letterbox,
+                        png_covers,
+                        quality,
+                        letterbox_color=letterbox_color,
+                    )
 
-                            optimize_png(tmp_cover, level=1)
-                            # Crossing FS boundaries, can't rename, have to copy + delete :/
-                            shutil.copy2(tmp_cover, fpath)
-                            os.remove(tmp_cover)
-                        else:
-                            with open(fpath, 'wb') as f:
-                                f.write(data)
-                                fsync(f)
+                    # NOTE: If we're writing a PNG file, go through a quick
+                    # optipng pass to make sure it's encoded properly, as
+                    # Qt doesn't afford us enough control to do it right...
+                    #       Unfortunately, optipng doesn't support reading
+                    #       pipes, so this gets a bit clunky as we have go
+                    #       through a temporary file...
+                    debug_print(f'KoboTouch:_upload_cover - uploaded to {fpath}')
+                    if png_covers:
+                        tmp_cover = better_mktemp()
+                        with open(tmp_cover, 'wb') as f:
+                            f.write(data)
+
+                        optimize_png(tmp_cover, level=1)
+                        # Crossing FS boundaries, can't rename, have to copy + delete :/
+                        shutil.copy2(tmp_cover, fpath)
+                        os.remove(tmp_cover)
+                    else:
+                        with open(fpath, 'wb') as f:
+                            f.write(data)
+                            fsync(f)
         except Exception as e:
             err = str(e)
             debug_print(f'KoboTouch:_upload_cover - Exception string: {err}')
@@ -3608,54 +3732,51 @@ def get_bookshelflist(self, connection):
         return bookshelves
 
     def set_bookshelf(self, connection, book, shelfName):
-        show_debug = self.is_debugging_title(book.title)
-        if show_debug:
-            debug_print(f'KoboTouch:set_bookshelf book.ContentID="{book.contentID}"')
-            debug_print(f'KoboTouch:set_bookshelf book.current_shelves="{book.current_shelves}"')
-
-        if shelfName in book.current_shelves:
+        self.set_bookshelf_for_books(connection, (book,), shelfName)
+
+    def set_bookshelf_for_books(self, connection, books, shelfName):
+        # Put many books on a shelf with one query to find the existing
+        # entries and one batched statement each for inserts and updates
+        pending = []
+        for book in books:
+            show_debug = self.is_debugging_title(book.title)
             if show_debug:
-                debug_print('        book already on shelf.')
+                debug_print(f'KoboTouch:set_bookshelf book.ContentID="{book.contentID}"')
+                debug_print(f'KoboTouch:set_bookshelf book.current_shelves="{book.current_shelves}"')
+            if shelfName in book.current_shelves:
+                if show_debug:
+                    debug_print('        book already on shelf.')
+                continue
+            pending.append((book, show_debug))
+        if not pending:
             return
 
-        test_query = 'SELECT _IsDeleted FROM ShelfContent WHERE ShelfName = ? and ContentId = ?'
-        test_values = (
-            shelfName,
-            book.contentID,
-        )
         false = self.bool_for_query(False)
         addquery = f'INSERT INTO ShelfContent ("ShelfName","ContentId","DateModified","_IsDeleted","_IsSynced") VALUES (?, ?, ?, {false}, {false})'
-        add_values = (
-            shelfName,
-            book.contentID,
-            time.strftime(self.TIMESTAMP_STRING, time.gmtime()),
-        )
         updatequery = f'UPDATE ShelfContent SET _IsDeleted = {false} WHERE ShelfName = ? and ContentId = ?'
-        update_values = (
-            shelfName,
-            book.contentID,
-        )
+        timestamp = time.strftime(self.TIMESTAMP_STRING, time.gmtime())
 
         cursor = connection.cursor()
-        cursor.execute(test_query, test_values)
-        try:
-            result = next(cursor)
-        except StopIteration:
-            result = None
-
-        if result is None:
-            if show_debug:
-                debug_print('        Did not find a record - adding')
-            cursor.execute(addquery, add_values)
-        elif self.is_true_value(result['_IsDeleted']):
-            if show_debug:
-                debug_print('        Found a record - updating - result=', result)
-            cursor.execute(updatequery, update_values)
-
+        cursor.execute('SELECT ContentId, _IsDeleted FROM ShelfContent WHERE ShelfName = ?', (shelfName,))
+        existing = {row['ContentId']: self.is_true_value(row['_IsDeleted']) for row in cursor}
+        add_values, update_values = [], []
+        for book, show_debug in pending:
+            is_deleted = existing.get(book.contentID)
+            if is_deleted is None:
+                if show_debug:
+                    debug_print('        Did not find a record - adding')
+                add_values.append((shelfName, book.contentID, timestamp))
+            elif is_deleted:
+                if show_debug:
+                    debug_print('        Found a record - updating')
+                update_values.append((shelfName, book.contentID))
+            existing[book.contentID] = False
+        if add_values:
+            cursor.executemany(addquery, add_values)
+        if update_values:
+            cursor.executemany(updatequery, update_values)
         cursor.close()
 
-        # debug_print("KoboTouch:set_bookshelf - end")
-
     def check_for_bookshelf(self, connection, bookshelf_name):
         show_debug = self.is_debugging_title(bookshelf_name)
         if show_debug:
@@ -64,6 +64,18 @@ def filesystem_callback(self, msg: str) -> None:
     def is_folder_ignored(self, storage_or_storage_id, path) -> bool:
         return False
 
+    def filesystem_snapshot(self, storage_id):
+        """
+        Return the snapshot of the folders on storage_id from the previous
+        connection to the current device or None if the device has no serial
+        number to identify it.
+        """
+        if not self.current_serial_num:
+            return None
+        from calibre.devices.mtp.filesystem_cache import FilesystemSnapshot
+
+        return FilesystemSnapshot(self.current_serial_num, storage_id)
+
     def build_template_regexp(self):
         from calibre.devices.utils import build_template_regexp
 
@@ -2,6 +2,7 @@
 # License: GPLv3 Copyright: 2012, Kovid Goyal <kovid at kovidgoyal.net>
 
 import json
+import os
 import sys
 import time
 import weakref
@@ -314,3 +315,238 @@ def resolve_mtp_id_path(self, path):
             return id_map[object_id]
         except KeyError:
             raise ValueError(f'No object found with MTP path: {path}')
+
+
+class FilesystemSnapshot:
+    """
+    The folders listed on a storage of a device during the previous connection,
+    saved on disk keyed by the device serial number and storage id. Listing
+    folders is the slowest part of connecting to an MTP device, so folders
+    that have not changed since the snapshot was taken are not listed again,
+    their contents are taken from the snapshot instead. A folder is unchanged
+    if it has the same object id, name, path and modification time as in the
+    snapshot and had no sub folders. Folders with sub folders are always
+    listed, as changes to the contents of a sub folder do not change the
+    modification time of its parent.
+
+    MTP only guarantees that object ids stay the same within a session, so
+    the contents of the snapshot are only reused once the device has been
+    seen to keep the ids of all objects across a connection. If any of the
+    objects that were listed turn out to have different ids, :meth:`finish`
+    returns None and the storage must be listed again in full.
+    """
+
+    VERSION = 2
+
+    def __init__(self, device_uid, storage_id, location=None):
+        import hashlib
+
+        from calibre.constants import cache_dir
+
+        self.location = location or os.path.join(cache_dir(), 'mtp-snapshots')
+        key = hashlib.sha1(f'{device_uid}:{storage_id}'.encode('utf-8')).hexdigest()
+        self.path = os.path.join(self.location, key + '.json')
+        self.folders = {}
+        self.persistent_ids = False
+        self.listed, self.reused = {}, []
+        self.unchanged_folders = 0
+        try:
+            with open(self.path, 'rb') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except Exception:
+            import traceback
+
+            traceback.print_exc()
+            return
+        if data.get('version') == self.VERSION:
+            self.folders = {str(k): v for k, v in data['folders']}
+            self.persistent_ids = bool(data.get('persistent_ids'))
+
+    @staticmethod
+    def normalize(entry):
+        # Windows timestamps are tuples which become lists in JSON
+        return {k: tuple(v) if isinstance(v, list) else v for k, v in entry.items()}
+
+    def needs_listing(self, entry, path):
+        """
+        Called with every folder that is going to be listed and its path from
+        the root of the storage, returns False if the folder is unchanged, in
+        which case its contents are taken from the snapshot.
+        """
+        key, path = str(entry['id']), list(path)
+        self.listed[key] = path
+        modified = self.normalize(entry).get('modified')
+        snap = self.folders.get(key)
+        if (
+            self.persistent_ids
+            and snap is not None
+            and modified
+            and snap['path'] == path
+            and snap['entry'].get('name') == entry.get('name')
+            and self.normalize(snap['entry']).get('modified') == modified
+        ):
+            children = [self.normalize(x) for x in snap['children']]
+            if not any(x.get('is_folder') for x in children):
+                self.reused.extend(children)
+                self.unchanged_folders += 1
+                return False
+        return True
+
+    def ids_unchanged(self, entries):
+        """
+        Return (unchanged, count) where unchanged is False if any of entries
+        has a different path than the object with the same id in the snapshot
+        or a different id than the object with the same path, and count is the
+        number of entries that were compared.
+        """
+        old_paths = {}
+        for key, snap in self.folders.items():
+            old_paths[key] = tuple(snap['path'])
+            for child in snap['children']:
+                old_paths[str(child['id'])] = tuple(snap['path']) + (child.get('name'),)
+        old_ids = {v: k for k, v in old_paths.items()}
+        id_map = {str(e['id']): e for e in entries}
+        count = 0
+        for key, e in id_map.items():
+            path, seen = [e.get('name')], {key}
+            pid = str(e.get('parent_id'))
+            while pid in id_map and pid not in seen:
+                seen.add(pid)
+                path.append(id_map[pid].get('name'))
+                pid = str(id_map[pid].get('parent_id'))
+            path = tuple(reversed(path))
+            old_path, old_id = old_paths.get(key), old_ids.get(path)
+            if old_path is not None or old_id is not None:
+                count += 1
+                if old_path not in (None, path) or old_id not in (None, key):
+                    return False, count
+        return True, count
+
+    def finish(self, entries, save=True):
+        """
+        Return entries with the contents of unchanged folders from the
+        snapshot added. If save is True, the snapshot is replaced by one of
+        the folders that were listed. Returns None if the ids of the objects
+        on the device have changed since the snapshot was taken and contents
+        from the snapshot were used, in which case the storage must be listed
+        again, calling :meth:`needs_listing` and :meth:`finish` as before.
+        """
+        entries = list(entries)
+        unchanged, count = self.ids_unchanged(entries)
+        if not unchanged and self.reused:
+            self.persistent_ids = False
+            self.listed, self.reused = {}, []
+            self.unchanged_folders = 0
+            return None
+        entries += self.reused
+        self.reused = []
+        if save:
+            children = defaultdict(list)
+            folders = {}
+            for e in entries:
+                children[str(e.get('parent_id'))].append(e)
+                if e.get('is_folder'):
+                    folders[str(e['id'])] = e
+            data = {
+                'version': self.VERSION,
+                'persistent_ids': unchanged and count > 0,
+                'folders': [(k, {'entry': folders[k], 'path': path, 'children': children[k]}) for k, path in self.listed.items() if k in folders],
+            }
+            try:
+                from calibre.utils.filenames import atomic_rename
+
+                os.makedirs(self.location, exist_ok=True)
+                tpath = self.path + '.tmp'
+                with open(tpath, 'w') as f:
+                    json.dump(data, f)
+                atomic_rename(tpath, self.path)
+            except Exception:
+                import traceback
+
+                traceback.print_exc()
+        return entries
+
+
+def find_tests():
+    import tempfile
+    import unittest
+
+    class FilesystemSnapshotTest(unittest.TestCase):
+        def setUp(self):
+            self.tdir = tempfile.TemporaryDirectory()
+
+            def entry(id, parent_id, name, is_folder=False, modified=1):
+                return {'id': id, 'parent_id': parent_id, 'name': name, 'is_folder': is_folder, 'modified': modified, 'storage_id': 1}
+
+            self.entry = entry
+            self.tree = [entry(1, 0, 'books', True), entry(2, 1, 'a', True), entry(3, 2, 'a.epub'), entry(4, 1, 'b', True, modified=0)]
+            self.tree += [entry(5, 4, 'b.epub'), entry(6, 0, 'c.epub')]
+
+        def tearDown(self):
+            self.tdir.cleanup()
+
+        def snapshot(self, uid='serial'):
+            return FilesystemSnapshot(uid, 1, self.tdir.name)
+
+        def listing(self, snapshot):
+            listed = []
+
+            def walk(parent_id, path):
+                ans = []
+                for e in self.tree:
+                    if e['parent_id'] == parent_id:
+                        ans.append(dict(e))
+                        epath = path + (e['name'],)
+                        if e['is_folder'] and snapshot.needs_listing(e, epath):
+                            listed.append(e['id'])
+                            ans.extend(walk(e['id'], epath))
+                return ans
+
+            entries = snapshot.finish(walk(0, ()))
+            if entries is None:
+                listed.append(None)
+                entries = snapshot.finish(walk(0, ()))
+            return {x['id']: x['name'] for x in entries}, listed
+
+        def test_filesystem_snapshot(self):
+            all_objects = {e['id']: e['name'] for e in self.tree}
+            self.assertEqual(self.listing(self.snapshot()), (all_objects, [1, 2, 4]))
+            # Nothing is reused until the device has kept its object ids across a connection
+            self.assertEqual(self.listing(self.snapshot()), (all_objects, [1, 2, 4]))
+            # Folders with sub folders or no modification time are always listed
+            self.assertEqual(self.listing(self.snapshot()), (all_objects, [1, 4]))
+            self.tree.append(self.entry(7, 2, 'new.epub'))
+            self.tree[1]['modified'] = 2
+            all_objects[7] = 'new.epub'
+            self.assertEqual(self.listing(self.snapshot()), (all_objects, [1, 2, 4]))
+            self.assertEqual(self.listing(self.snapshot('other'))[1], [1, 2, 4])
+
+        def test_changed_object_ids(self):
+            self.listing(self.snapshot()), self.listing(self.snapshot())
+            self.assertEqual(self.listing(self.snapshot())[1], [1, 4])
+            # The device assigns the id of the folder a to a different folder,
+            # whose contents must not be taken from the snapshot
+            self.tree[1].update(name='other')
+            self.tree[2].update(name='other.epub', id=8)
+            objects, listed = self.listing(self.snapshot())
+            self.assertEqual(listed, [1, 2, 4])
+            self.assertEqual(objects[2], 'other')
+            self.assertNotIn(3, objects)
+            # The device assigns different ids to all objects, so the
+            # contents of the folder a, taken from the snapshot, have stale ids
+            self.listing(self.snapshot()), self.listing(self.snapshot())
+            self.assertEqual(self.listing(self.snapshot())[1], [1, 4])
+            for e in self.tree:
+                e['id'] += 10
+                if e['parent_id']:
+                    e['parent_id'] += 10
+            self.tree[1]['id'], self.tree[2]['parent_id'] = 2, 2
+            objects, listed = self.listing(self.snapshot())
+            self.assertEqual(listed, [11, 14, None, 11, 2, 14])
+            self.assertEqual(objects, {e['id']: e['name'] for e in self.tree})
+            # The snapshot is not used again until the ids are seen to persist
+            self.assertEqual(self.listing(self.snapshot())[1], [11, 2, 14])
+
+    return unittest.defaultTestLoader.loadTestsFromTestCase(FilesystemSnapshotTest)
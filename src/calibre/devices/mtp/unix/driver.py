@@ -295,7 +295,7 @@ def device_debug_info(self):
         ans += pprint.pformat(storage)
         return ans
 
-    def _filesystem_callback(self, fs_map, entry, level):
+    def _filesystem_callback(self, fs_map, snapshot, entry, level):
         name = entry.get('name', '')
         self.filesystem_callback(_('Found object: %s') % name)
         fs_map[entry.get('id', null)] = entry
@@ -311,6 +311,8 @@ def _filesystem_callback(self, fs_map, entry, level):
         ok = not self.is_folder_ignored(self._currently_getting_sid, path)
         if not ok:
             debug('Ignored object: {}'.format('/'.join(path)))
+        elif snapshot is not None and entry.get('is_folder', False):
+            ok = snapshot.needs_listing(entry, path)
         return ok
 
     @property
@@ -341,7 +343,16 @@ def filesystem_cache(self):
                         'is_system': True,
                     })
                     self._currently_getting_sid = str(sid)
-                    items, errs = dev.get_filesystem(sid, partial(self._filesystem_callback, {}))
+                    snapshot = self.filesystem_snapshot(sid)
+                    items, errs = dev.get_filesystem(sid, partial(self._filesystem_callback, {}, snapshot))
+                    if snapshot is not None:
+                        reused = snapshot.finish(items, save=not errs)
+                        if reused is None:
+                            debug(f'Object ids in storage {sid} have changed since the last connection, listing all folders again')
+                            items, errs = dev.get_filesystem(sid, partial(self._filesystem_callback, {}, snapshot))
+                            reused = snapshot.finish(items, save=not errs)
+                        items = reused
+                        debug(f'Reused the contents of {snapshot.unchanged_folders} unchanged folders in storage {sid}')
                     all_items.extend(items), all_errs.extend(errs)
                 if not all_items and all_errs:
                     raise DeviceError(f'Failed to read filesystem from {self.current_friendly_name} with errors: {self.format_errorstack(all_errs)}')
@@ -230,7 +230,7 @@ def is_suitable_wpd_device(self, devdata):
 
         return True
 
-    def _filesystem_callback(self, fs_map, obj, level):
+    def _filesystem_callback(self, fs_map, snapshot, obj, level):
         name = obj.get('name', '')
         self.filesystem_callback(_('Found object: %s') % name)
         if not obj.get('is_folder', False):
@@ -249,6 +249,8 @@ def _filesystem_callback(self, fs_map, obj, level):
         ok = not self.is_folder_ignored(self._currently_getting_sid, path)
         if not ok:
             debug('Ignored object: {}'.format('/'.join(path)))
+        elif snapshot is not None:
+            ok = snapshot.needs_listing(obj, path)
         return ok
 
     @property
@@ -280,7 +282,16 @@ def filesystem_cache(self):
                     'is_system': True,
                 }
                 self._currently_getting_sid = str(storage_id)
-                id_map = dev.get_filesystem(storage_id, partial(self._filesystem_callback, {}))
+                snapshot = self.filesystem_snapshot(storage_id)
+                id_map = dev.get_filesystem(storage_id, partial(self._filesystem_callback, {}, snapshot))
+                if snapshot is not None:
+                    entries = snapshot.finish(id_map.values())
+                    if entries is None:
+                        debug(f'Object ids in storage {storage_id} have changed since the last connection, listing all folders again')
+                        id_map = dev.get_filesystem(storage_id, partial(self._filesystem_callback, {}, snapshot))
+                        entries = snapshot.finish(id_map.values())
+                    id_map = {x['id']: x for x in entries}
+                    debug(f'Reused the contents of {snapshot.unchanged_folders} unchanged folders in storage {storage_id}')
                 for x in id_map.values():
                     x['storage_id'] = storage_id
                 all_storage.append(storage)
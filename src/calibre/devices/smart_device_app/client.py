@@ -0,0 +1,374 @@
+#!/usr/bin/env python
+# License: GPLv3 Copyright: 2026, Kovid Goyal <kovid at kovidgoyal.net>
+
+"""
+A minimal, in-memory implementation of the device side of the wireless device
+protocol, used to test the SMART_DEVICE_APP driver and to measure the effect
+of network latency on book transfers without a real device. Run this module
+to benchmark sending books with and without pipelining.
+"""
+
+import hashlib
+import json
+import socket
+import sys
+import time
+import traceback
+from contextlib import contextmanager
+from queue import Queue
+from threading import Thread
+
+
+def opcodes():
+    from calibre.devices.smart_device_app.driver import SMART_DEVICE_APP
+
+    return SMART_DEVICE_APP.opcodes
+
+
+class StandInClient(Thread):
+    """
+    Serve the device side of the protocol on sock, storing books and their
+    metadata in memory. Replies are delayed by latency seconds, to simulate a
+    slow network. Books whose lpaths are in reject_lpaths are refused.
+    """
+
+    def __init__(self, sock, can_pipeline=True, pipeline_window=8, can_batch_metadata=True, latency=0, password='', reject_lpaths=()):
+        Thread.__init__(self, name='StandInClient', daemon=True)
+        self.sock = sock
+        self.rfile = sock.makefile('rb')
+        self.can_pipeline, self.pipeline_window = can_pipeline, pipeline_window
+        self.can_batch_metadata = can_batch_metadata
+        self.latency, self.password = latency, password
+        self.reject_lpaths = frozenset(reject_lpaths)
+        self.opcodes = opcodes()
+        self.reverse_opcodes = {v: k for k, v in self.opcodes.items()}
+        self.uuid = '7f1a9a4e-stand-in-client'
+        self.books = {}
+        self.metadata = {}
+        # The opcode and number of books in every metadata message received
+        self.metadata_messages = []
+        self.received = []
+        self.failure = None
+        self.replies = Queue()
+        self.writer = Thread(target=self.write_replies, name='StandInClientWriter', daemon=True)
+
+    def run(self):
+        self.writer.start()
+        try:
+            while True:
+                opcode, arg = self.read_message()
+                if opcode is None:
+                    break
+                self.received.append(opcode)
+                handler = getattr(self, 'handle_' + opcode.lower(), None)
+                if handler is None:
+                    self.reply('ERROR', {'message': f'Unsupported operation: {opcode}'})
+                else:
+                    handler(arg)
+        except OSError:
+            pass
+        except Exception:
+            self.failure = traceback.format_exc()
+        finally:
+            self.replies.put(None)
+
+    # Network functions {{{
+
+    def read_message(self):
+        digits = b''
+        while True:
+            c = self.rfile.read(1)
+            if not c:
+                return None, None
+            if c == b'[':
+                break
+            digits += c
+        data = c + self.rfile.read(int(digits) - 1)
+        op, arg = json.loads(data)
+        return self.reverse_opcodes[op], arg
+
+    def send_raw(self, raw):
+        self.replies.put((time.monotonic() + self.latency, raw))
+
+    def reply(self, opcode, data):
+        raw = json.dumps([self.opcodes[opcode], data]).encode('utf-8')
+        self.send_raw(b'%d' % len(raw) + raw)
+
+    def write_replies(self):
+        while True:
+            x = self.replies.get()
+            if x is None:
+                break
+            due, raw = x
+            delay = due - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            try:
+                self.sock.sendall(raw)
+            except OSError:
+                break
+
+    # }}}
+
+    # Protocol handlers {{{
+
+    def handle_get_initialization_info(self, arg):
+        from calibre.devices.smart_device_app.driver import SMART_DEVICE_APP
+
+        ans = {
+            'versionOK': arg.get('serverProtocolVersion') == SMART_DEVICE_APP.PROTOCOL_VERSION,
+            'maxBookContentPacketLen': 64 * 1024,
+            'canStreamBooks': True,
+            'canStreamMetadata': True,
+            'canReceiveBookBinary': True,
+            'canDeleteMultipleBooks': True,
+            'canUseCachedMetadata': False,
+            'canSendOkToSendbook': True,
+            'canAcceptLibraryInfo': True,
+            'acceptedExtensions': ['epub', 'azw3', 'mobi', 'pdf', 'txt'],
+            'canPipelineBooks': self.can_pipeline and arg.get('canSupportPipelinedBooks', False),
+            'pipelineWindow': self.pipeline_window,
+            'canReceiveMetadataBatches': self.can_batch_metadata and arg.get('canSupportMetadataBatches', False),
+            'deviceKind': 'stand-in',
+            'deviceName': 'Stand-in client',
+            'appName': 'calibre stand-in client',
+            'ccVersionNumber': SMART_DEVICE_APP.CURRENT_CC_VERSION,
+            'coverHeight': 240,
+        }
+        if self.password:
+            ans['passwordHash'] = hashlib.sha1((self.password + arg.get('passwordChallenge', '')).encode('utf-8')).hexdigest()
+        self.reply('OK', ans)
+
+    def handle_get_device_information(self, arg):
+        self.reply('OK', {'device_info': {'device_store_uuid': self.uuid, 'device_name': 'Stand-in client'}, 'device_version': '1', 'version': '1'})
+
+    def handle_set_calibre_device_info(self, arg):
+        self.reply('OK', {})
+
+    handle_set_calibre_device_name = handle_set_library_info = handle_display_message = handle_set_calibre_device_info
+
+    def handle_free_space(self, arg):
+        self.reply('OK', {'free_space_on_device': 1 << 34})
+
+    def handle_total_space(self, arg):
+        self.reply('OK', {'total_space_on_device': 1 << 35})
+
+    def handle_get_book_count(self, arg):
+        self.reply('OK', {'count': len(self.metadata), 'willStream': True, 'willScan': True})
+        for mi in self.metadata.values():
+            self.reply('OK', mi)
+
+    def handle_send_book(self, arg):
+        lpath, pipelined = arg['lpath'], arg.get('willPipeline', False)
+        rejected = lpath in self.reject_lpaths
+        if arg.get('wantsSendOkToSendbook') and not pipelined:
+            if rejected:
+                # The driver does not send the book after an error
+                self.reply('ERROR', {'message': f'{lpath} rejected by the stand-in client'})
+                return
+            self.reply('OK', {'lpath': lpath})
+        data = self.rfile.read(arg['length'])
+        if len(data) != arg['length']:
+            raise OSError('Connection closed while receiving a book')
+        if pipelined and rejected:
+            self.reply('ERROR', {'pipelineIndex': arg['pipelineIndex'], 'message': f'{lpath} rejected by the stand-in client'})
+            return
+        self.books[lpath] = data
+        mi = dict(arg['metadata'])
+        mi['lpath'] = lpath
+        self.metadata[lpath] = mi
+        if pipelined:
+            self.reply('OK', {'pipelineIndex': arg['pipelineIndex'], 'lpath': lpath})
+
+    def handle_send_booklists(self, arg):
+        self.collections = arg.get('collections', {})
+
+    def handle_send_book_metadata(self, arg):
+        self.metadata_messages.append(('SEND_BOOK_METADATA', 1))
+        mi = arg['data']
+        self.metadata[mi['lpath']] = mi
+
+    def handle_send_book_metadata_batch(self, arg):
+        self.metadata_messages.append(('SEND_BOOK_METADATA_BATCH', len(arg['data'])))
+        for mi in arg['data']:
+            self.metadata[mi['lpath']] = mi
+
+    def handle_get_book_file_segment(self, arg):
+        data = self.books.get(arg['lpath'])
+        if data is None:
+            self.reply('ERROR', {'message': f'No book at {arg["lpath"]}'})
+            return
+        self.reply('OK', {'fileLength': len(data)})
+        self.send_raw(data)
+
+    def handle_delete_book(self, arg):
+        self.reply('OK', {})
+        for lpath in arg['lpaths']:
+            self.books.pop(lpath, None)
+            mi = self.metadata.pop(lpath, {})
+            self.reply('OK', {'uuid': mi.get('uuid', '')})
+
+    def handle_noop(self, arg):
+        # NOOPs with a count or priKey are requests for cached metadata, which
+        # this client does not use, and get no reply
+        if 'count' not in arg and 'priKey' not in arg:
+            self.reply('OK', {})
+
+    # }}}
+
+
+@contextmanager
+def connected_driver(**client_options):
+    """
+    Yield a (driver, client) pair, where the driver is connected to a
+    :class:`StandInClient` over a socket pair, after performing the
+    initialization handshake.
+    """
+    from calibre.devices.smart_device_app.driver import SMART_DEVICE_APP
+
+    driver_socket, client_socket = socket.socketpair()
+    client = StandInClient(client_socket, **client_options)
+    client.start()
+    driver = SMART_DEVICE_APP(None)
+    driver._initialize_state()
+    driver.set_progress_reporter(None)
+    driver.device_socket, driver.is_connected = driver_socket, True
+    try:
+        opcode, result = driver._call_client(
+            'GET_INITIALIZATION_INFO',
+            {
+                'serverProtocolVersion': driver.PROTOCOL_VERSION,
+                'passwordChallenge': '',
+                'canSupportLpathChanges': True,
+                'canSupportPipelinedBooks': True,
+                'canSupportMetadataBatches': True,
+            },
+        )
+        if opcode != 'OK':
+            raise ValueError(f'Initialization with the stand-in client failed: {result}')
+        driver.max_book_packet_len = result['maxBookContentPacketLen']
+        driver.can_send_ok_to_sendbook = result['canSendOkToSendbook']
+        driver.can_accept_library_info = result['canAcceptLibraryInfo']
+        driver.client_can_use_metadata_cache = result['canUseCachedMetadata']
+        driver.client_cache_uses_lpaths = False
+        driver.client_can_pipeline_books = result['canPipelineBooks']
+        driver.pipeline_window = max(1, min(result['pipelineWindow'], driver.MAX_PIPELINE_WINDOW))
+        driver.client_can_receive_metadata_batches = result['canReceiveMetadataBatches']
+        driver.exts_path_lengths = {}
+        yield driver, client
+    finally:
+        driver._close_device_socket()
+        client.join(5)
+        client_socket.close()
+
+
+def benchmark(num_books=50, book_size=256 * 1024, latency=0.02):
+    """
+    Return the time taken to send num_books books to a client with the
+    specified latency, with and without pipelining.
+    """
+    import os
+    import uuid
+    from io import BytesIO
+
+    from calibre.ebooks.metadata.book.base import Metadata
+
+    ans = {}
+    data = os.urandom(book_size)
+    for pipelined in (False, True):
+        with connected_driver(can_pipeline=pipelined, latency=latency) as (driver, client):
+            files, names, metadata = [], [], []
+            for i in range(num_books):
+                mi = Metadata(f'Book {i}', ['Some Author'])
+                mi.uuid = str(uuid.uuid4())
+                files.append(BytesIO(data))
+                names.append(f'book{i}.epub')
+                metadata.append(mi)
+            st = time.monotonic()
+            driver.upload_books(files, names, metadata=metadata)
+            ans['pipelined' if pipelined else 'serial'] = time.monotonic() - st
+    return ans
+
+
+def find_tests():
+    import unittest
+    import uuid
+    from io import BytesIO
+
+    from calibre.devices.errors import UserFeedback
+    from calibre.ebooks.metadata.book.base import Metadata
+
+    def books(num):
+        files, names, metadata = [], [], []
+        for i in range(num):
+            mi = Metadata(f'Book {i}', ['Some Author'])
+            mi.uuid = str(uuid.uuid4())
+            files.append(BytesIO(b'%d' % i * (1000 + i * 997)))
+            names.append(f'book{i}.epub')
+            metadata.append(mi)
+        return files, names, metadata
+
+    class StandInClientTest(unittest.TestCase):
+        def check_upload(self, **client_options):
+            files, names, metadata = books(13)
+            with connected_driver(**client_options) as (driver, client):
+                self.assertEqual(driver.client_can_pipeline_books, client_options.get('can_pipeline', True))
+                paths = driver.upload_books(files, names, metadata=metadata)
+                self.assertEqual(len(paths), len(files))
+                for (lpath, length), f in zip(paths, files):
+                    self.assertEqual(client.books[lpath], f.getvalue())
+                    self.assertEqual(length, len(f.getvalue()))
+                    self.assertIn(lpath, driver.known_metadata)
+                bl = driver.books()
+                self.assertEqual({b.lpath for b in bl}, {lpath for lpath, length in paths})
+                self.assertIsNone(client.failure)
+            return client
+
+        def test_upload(self):
+            pipelined = self.check_upload(pipeline_window=4, latency=0.001)
+            serial = self.check_upload(can_pipeline=False)
+            self.assertEqual(sorted(serial.books), sorted(pipelined.books))
+
+        def test_rejected_book(self):
+            files, names, metadata = books(10)
+            with connected_driver(pipeline_window=3) as (driver, client):
+                lpaths = [driver._create_upload_path(mi, name, create_dirs=False) for mi, name in zip(metadata, names)]
+                client.reject_lpaths = frozenset(lpaths[4:5])
+                self.assertRaises(UserFeedback, driver.upload_books, files, names, metadata=metadata)
+                # The books already in flight are received, no new books are sent
+                self.assertIn(lpaths[3], client.books)
+                self.assertNotIn(lpaths[4], client.books)
+                self.assertNotIn(lpaths[9], client.books)
+                # The connection is still usable after the error
+                self.assertEqual(driver.free_space()[0], 1 << 34)
+                self.assertIsNone(client.failure)
+
+        def test_metadata_batches(self):
+            for batched in (True, False):
+                files, names, metadata = books(120)
+                with connected_driver(can_batch_metadata=batched) as (driver, client):
+                    driver.upload_books(files, names, metadata=metadata)
+                    bl = driver.books()
+                    for book in bl:
+                        book.title = 'Changed ' + book.title
+                        book.set('_force_send_metadata_', True)
+                    driver.sync_booklists([list(bl)])
+                    driver.free_space()  # wait for the client to process all messages
+                    if batched:
+                        self.assertEqual(client.metadata_messages, [('SEND_BOOK_METADATA_BATCH', 50)] * 2 + [('SEND_BOOK_METADATA_BATCH', 20)])
+                    else:
+                        self.assertEqual(client.metadata_messages, [('SEND_BOOK_METADATA', 1)] * 120)
+                    self.assertTrue(all(mi['title'].startswith('Changed ') for mi in client.metadata.values()))
+                    self.assertIsNone(client.failure)
+
+    return unittest.defaultTestLoader.loadTestsFromTestCase(StandInClientTest)
+
+
+def main(args=sys.argv):
+    for latency in (0, 0.005, 0.02, 0.05):
+        times = benchmark(latency=latency)
+        print(f'Latency: {latency * 1000:.0f}ms serial: {times["serial"]:.2f}s pipelined: {times["pipelined"]:.2f}s')
+
+
+if __name__ == '__main__':
+    main()
@@ -17,7 +17,6 @@
 import sys
 import time
 import traceback
-from collections import defaultdict
 from errno import EAGAIN, EINTR
 from functools import wraps
 from threading import Event, RLock, Thread
@@ -236,6 +235,13 @@ class SMART_DEVICE_APP(DeviceConfig, DevicePlugin):
     BASE_PACKET_LEN = 4096
     PROTOCOL_VERSION = 1
     MAX_UNSUCCESSFUL_CONNECTS = 5
+    # The maximum number of books sent to clients that support pipelining
+    # before waiting for them to be acknowledged
+    MAX_PIPELINE_WINDOW = 32
+    DEFAULT_PIPELINE_WINDOW = 8
+    # The number of books whose metadata is sent in a single message to
+    # clients that support metadata batches
+    METADATA_BATCH_SIZE = 50
 
     SEND_NOOP_EVERY_NTH_PROBE = 5
     DISCONNECT_AFTER_N_SECONDS = 30 * 60  # 30 minutes
@@ -272,6 +278,7 @@ class SMART_DEVICE_APP(DeviceConfig, DevicePlugin):
         'SEND_BOOKLISTS': 7,
         'SEND_BOOK': 8,
         'SEND_BOOK_METADATA': 16,
+        'SEND_BOOK_METADATA_BATCH': 21,
         'SET_CALIBRE_DEVICE_INFO': 1,
         'SET_CALIBRE_DEVICE_NAME': 2,
         'TOTAL_SPACE': 4,
@@ -491,7 +498,7 @@ def _create_upload_path(self, mdata, fname, create_dirs=True):
             # If we have already seen this book's UUID, use the existing path
             if self.settings().extra_customization[self.OPT_OVERWRITE_BOOKS_UUID]:
                 existing_book = self._uuid_in_cache(mdata.uuid, ext)
-                if existing_book and existing_book.lpath and self.known_metadata.get(existing_book.lpath, None):
+                if existing_book and existing_book.lpath and self._known_metadata_for(existing_book.lpath):
                     return existing_book.lpath
 
             # If the device asked for it, try to use the UUID as the file name.
@@ -588,18 +595,24 @@ def _strip_prefix(self, path):
     # If the argument is a booklist or contains a book, use the metadata json
     # codec to first convert it to a string dict
     def _json_encode(self, op, arg):
+        def encode_book(v):
+            ans = self.json_codec.encode_book_metadata(v)
+            series = v.get('series', None)
+            if series:
+                tsorder = tweaks['save_template_title_series_sorting']
+                series = title_sort(series, order=tsorder)
+            else:
+                series = ''
+            self._debug('series sort = ', series)
+            ans['_series_sort_'] = series
+            return ans
+
         res = {}
         for k, v in arg.items():
             if isinstance(v, (Book, Metadata)):
-                res[k] = self.json_codec.encode_book_metadata(v)
-                series = v.get('series', None)
-                if series:
-                    tsorder = tweaks['save_template_title_series_sorting']
-                    series = title_sort(series, order=tsorder)
-                else:
-                    series = ''
-                self._debug('series sort = ', series)
-                res[k]['_series_sort_'] = series
+                res[k] = encode_book(v)
+            elif isinstance(v, list) and v and isinstance(v[0], (Book, Metadata)):
+                res[k] = [encode_book(x) for x in v]
             else:
                 res[k] = v
         from calibre.utils.config import to_json
@@ -785,8 +798,87 @@ def _put_file(self, infile, lpath, book_metadata, this_book, total_books):
             infile.close()
         return (-1, None) if failed else (length, lpath)
 
+    # Write several files to the device without waiting for each file to be
+    # acknowledged before sending the next one. Only used with clients that
+    # negotiated pipelining, see open(). The client acknowledges every book,
+    # in order, once it has been received, with the final lpath of the book.
+    # At most pipeline_window books are sent before waiting for an
+    # acknowledgement.
+    def _put_files_pipelined(self, jobs, progress=None):
+        from collections import deque
+
+        results = [None] * len(jobs)
+        pending = deque()
+        errors = []
+
+        def process_ack():
+            i, book_metadata, length, lpath = pending.popleft()
+            opcode, result = self._receive_from_client(print_debug_info=False)
+            if opcode is None:
+                raise ControlError(desc=f'Sending book {lpath} to device failed')
+            if result.get('pipelineIndex', i) != i:
+                self._close_device_socket()
+                raise PacketError(f'Device acknowledged book {result.get("pipelineIndex")} instead of {i}')
+            if opcode == 'ERROR':
+                errors.append((lpath, result.get('message', '')))
+            else:
+                lpath = result.get('lpath', lpath)
+                book_metadata.lpath = lpath
+                self._set_known_metadata(book_metadata)
+                results[i] = (length, lpath)
+            if progress is not None:
+                progress(i)
+
+        for i, (infile, lpath, book_metadata) in enumerate(jobs):
+            if errors:
+                break
+            close_ = False
+            if not hasattr(infile, 'read'):
+                infile, close_ = open(infile, 'rb'), True
+            try:
+                infile.seek(0, os.SEEK_END)
+                length = infile.tell()
+                book_metadata.size = length
+                infile.seek(0)
+                self._call_client(
+                    'SEND_BOOK',
+                    {
+                        'lpath': lpath,
+                        'length': length,
+                        'metadata': book_metadata,
+                        'thisBook': i,
+                        'totalBooks': len(jobs),
+                        'willStreamBooks': True,
+                        'willStreamBinary': True,
+                        'wantsSendOkToSendbook': False,
+                        'canSupportLpathChanges': True,
+                        'willPipeline': True,
+                        'pipelineIndex': i,
+                    },
+                    print_debug_info=False,
+                    wait_for_response=False,
+                )
+                while True:
+                    b = infile.read(self.max_book_packet_len)
+                    if not b:
+                        break
+                    self._send_byte_string(self.device_socket, b)
+            finally:
+                if close_:
+                    infile.close()
+            pending.append((i, book_metadata, length, lpath))
+            while len(pending) >= self.pipeline_window:
+                process_ack()
+        while pending:
+            process_ack()
+        self.time = None
+        if errors:
+            lpath, message = errors[0]
+            raise UserFeedback(msg=f'Sending book {lpath} to device failed', details=message, level=UserFeedback.ERROR)
+        return results
+
     def _metadata_in_cache(self, uuid, ext_or_lpath, lastmod):
-        from calibre.utils.date import now, parse_date
+        from calibre.utils.date import parse_date
 
         try:
             key = self._make_metadata_cache_key(uuid, ext_or_lpath)
@@ -794,16 +886,27 @@ def _metadata_in_cache(self, uuid, ext_or_lpath, lastmod):
                 if lastmod == 'None':
                     return None
                 lastmod = parse_date(lastmod)
-            if key in self.device_book_cache and self.device_book_cache[key]['book'].last_modified == lastmod:
-                self.device_book_cache[key]['last_used'] = now()
-                return self.device_book_cache[key]['book'].deepcopy(lambda: SDBook('', ''))
+            book = self.device_book_cache.get(key) if key else None
+            if book is not None and book.last_modified == lastmod:
+                self.device_book_cache.touch(key)
+                return book.deepcopy(lambda: SDBook('', ''))
         except Exception:
             traceback.print_exc()
         return None
 
+    # Return the metadata for the book at lpath, either as sent in this
+    # session or from the persistent cache
+    def _known_metadata_for(self, lpath):
+        ans = self.known_metadata.get(lpath, None)
+        if ans is None:
+            ans = self.device_book_cache.book_for_lpath(lpath)
+            if ans is not None:
+                self.known_metadata[lpath] = ans
+        return ans
+
     def _metadata_already_on_device(self, book):
         try:
-            v = self.known_metadata.get(book.lpath, None)
+            v = self._known_metadata_for(book.lpath)
             if v is not None:
                 # Metadata is the same if the uuids match, if the last_modified dates
                 # match, and if the height of the thumbnails is the same. The last
@@ -820,10 +923,7 @@ def _metadata_already_on_device(self, book):
 
     def _uuid_in_cache(self, uuid, ext):
         try:
-            for b in self.device_book_cache.values():
-                metadata = b['book']
-                if metadata.get('uuid', '') != uuid:
-                    continue
+            for metadata in self.device_book_cache.books_for_uuid(uuid):
                 if metadata.get('lpath', '').endswith(ext):
                     return metadata
         except Exception:
@@ -832,8 +932,6 @@ def _uuid_in_cache(self, uuid, ext):
 
     def _read_metadata_cache(self):
         self._debug('device uuid', self.device_uuid)
-        from calibre.utils.config import from_json
-
         try:
             old_cache_file_name = os.path.join(cache_dir(), 'device_drivers_' + self.__class__.__name__ + '_metadata_cache.pickle')
             if os.path.exists(old_cache_file_name):
@@ -848,70 +946,46 @@ def _read_metadata_cache(self):
         except Exception:
             pass
 
-        cache_file_name = os.path.join(cache_dir(), 'wireless_device_' + self.device_uuid + '_metadata_cache.json')
-        self.device_book_cache = defaultdict(dict)
+        # The metadata is stored in an SQLite database, entries are read lazily,
+        # see metadata_cache.py. Older versions rewrote a JSON file with all
+        # entries on every disconnect, import it if present.
+        from calibre.devices.smart_device_app.metadata_cache import MetadataCache
+
+        def decode(raw):
+            return self.json_codec.raw_to_book(raw, SDBook, self.PREFIX)
+
+        prefix = os.path.join(cache_dir(), 'wireless_device_' + self.device_uuid + '_metadata_cache')
+        self._close_metadata_cache()
         self.known_metadata = {}
+        self.device_book_cache = MetadataCache(prefix + '.sqlite', self.json_codec.encode_book_metadata, decode)
         try:
-            count = 0
-            if os.path.exists(cache_file_name):
-                with open(cache_file_name, mode='rb') as fd:
-                    while True:
-                        rec_len = fd.readline()
-                        if len(rec_len) != 8:
-                            break
-                        raw = fd.read(int(rec_len))
-                        book = json.loads(raw.decode('utf-8'), object_hook=from_json)
-                        key = list(book.keys())[0]
-                        metadata = self.json_codec.raw_to_book(book[key]['book'], SDBook, self.PREFIX)
-                        book[key]['book'] = metadata
-                        self.device_book_cache.update(book)
-
-                        lpath = metadata.get('lpath')
-                        self.known_metadata[lpath] = metadata
-                        count += 1
-            self._debug('loaded', count, 'cache items')
+            self.device_book_cache.execute('SELECT count(*) FROM books')
+            if os.path.exists(prefix + '.json'):
+                self._debug('imported', self.device_book_cache.import_legacy_cache(prefix + '.json'), 'cache items')
         except Exception:
             traceback.print_exc()
-            self.device_book_cache = defaultdict(dict)
-            self.known_metadata = {}
-            try:
-                if os.path.exists(cache_file_name):
-                    os.remove(cache_file_name)
-            except Exception:
-                traceback.print_exc()
+            self._close_metadata_cache()
+            for path in (prefix + '.sqlite', prefix + '.json'):
+                try:
+                    if os.path.exists(path):
+                        os.remove(path)
+                except Exception:
+                    traceback.print_exc()
+            self.device_book_cache = MetadataCache(prefix + '.sqlite', self.json_codec.encode_book_metadata, decode)
 
     def _write_metadata_cache(self):
         self._debug()
-        from calibre.utils.date import now
-
-        now_ = now()
-        from calibre.utils.config import to_json
-
         try:
-            purged = 0
-            count = 0
-            prefix = os.path.join(cache_dir(), 'wireless_device_' + self.device_uuid + '_metadata_cache')
-            with open(prefix + '.tmp', mode='wb') as fd:
-                for key, book in self.device_book_cache.items():
-                    if (now_ - book['last_used']).days > self.PURGE_CACHE_ENTRIES_DAYS:
-                        purged += 1
-                        continue
-                    json_metadata = defaultdict(dict)
-                    json_metadata[key]['book'] = self.json_codec.encode_book_metadata(book['book'])
-                    json_metadata[key]['last_used'] = book['last_used']
-                    result = as_bytes(json.dumps(json_metadata, indent=2, default=to_json))
-                    fd.write(f'{len(result) + 1:007}\n'.encode('ascii'))
-                    fd.write(result)
-                    fd.write(b'\n')
-                    count += 1
-            self._debug('wrote', count, 'entries, purged', purged, 'entries')
-
-            from calibre.utils.filenames import atomic_rename
-
-            atomic_rename(fd.name, prefix + '.json')
+            written, purged = self.device_book_cache.commit(self.PURGE_CACHE_ENTRIES_DAYS)
+            self._debug('wrote', written, 'entries, purged', purged, 'entries')
         except Exception:
             traceback.print_exc()
 
+    def _close_metadata_cache(self):
+        cache = getattr(self, 'device_book_cache', None)
+        if cache is not None:
+            cache.close()
+
     def _make_metadata_cache_key(self, uuid, lpath_or_ext):
         key = None
         if uuid and lpath_or_ext:
@@ -919,8 +993,6 @@ def _make_metadata_cache_key(self, uuid, lpath_or_ext):
         return key
 
     def _set_known_metadata(self, book, remove=False):
-        from calibre.utils.date import now
-
         lpath = book.lpath
         ext = os.path.splitext(lpath)[1]
         uuid = book.get('uuid', None)
@@ -932,20 +1004,20 @@ def _set_known_metadata(self, book, remove=False):
         if remove:
             self.known_metadata.pop(lpath, None)
             if key:
-                self.device_book_cache.pop(key, None)
+                self.device_book_cache.pop(key)
         else:
             # Check if we have another UUID with the same lpath. If so, remove it
             # Must try both the extension and the lpath because of the cache change
-            existing_uuid = self.known_metadata.get(lpath, {}).get('uuid', None)
+            existing = self._known_metadata_for(lpath)
+            existing_uuid = None if existing is None else existing.get('uuid', None)
             if existing_uuid and existing_uuid != uuid:
-                self.device_book_cache.pop(self._make_metadata_cache_key(existing_uuid, ext), None)
-                self.device_book_cache.pop(self._make_metadata_cache_key(existing_uuid, lpath), None)
+                self.device_book_cache.pop(self._make_metadata_cache_key(existing_uuid, ext))
+                self.device_book_cache.pop(self._make_metadata_cache_key(existing_uuid, lpath))
 
             new_book = book.deepcopy()
             self.known_metadata[lpath] = new_book
             if key:
-                self.device_book_cache[key]['book'] = new_book
-                self.device_book_cache[key]['last_used'] = now()
+                self.device_book_cache.set(key, new_book)
 
     # Force close a socket. The shutdown permits the close even if data transfer
     # is in progress
@@ -1118,6 +1190,8 @@ def open(self, connected_device, library_uuid):
                     'calibre_version': numeric_version,
                     'canSupportUpdateBooks': True,
                     'canSupportLpathChanges': True,
+                    'canSupportPipelinedBooks': True,
+                    'canSupportMetadataBatches': True,
                 },
             )
             if opcode != 'OK':
@@ -1165,6 +1239,14 @@ def open(self, connected_device, library_uuid):
             self._debug('Will ask for update books', self.will_ask_for_update_books)
             self.set_temp_mark_when_syncing_read = result.get('setTempMarkWhenReadInfoSynced', False)
             self._debug('Will set temp mark when syncing read', self.set_temp_mark_when_syncing_read)
+            self.client_can_pipeline_books = result.get('canPipelineBooks', False)
+            try:
+                self.pipeline_window = max(1, min(int(result.get('pipelineWindow', self.DEFAULT_PIPELINE_WINDOW)), self.MAX_PIPELINE_WINDOW))
+            except Exception:
+                self.pipeline_window = self.DEFAULT_PIPELINE_WINDOW
+            self._debug('Can pipeline books', self.client_can_pipeline_books, 'window', self.pipeline_window)
+            self.client_can_receive_metadata_batches = result.get('canReceiveMetadataBatches', False)
+            self._debug('Can receive metadata batches', self.client_can_receive_metadata_batches)
 
             if not self.settings().extra_customization[self.OPT_USE_METADATA_CACHE]:
                 self.client_can_use_metadata_cache = False
@@ -1395,13 +1477,13 @@ def books(self, oncard=None, end_session=True):
                 self._debug('processed cache. count=', len(books_on_device))
                 count_of_cache_items_deleted = 0
                 if self.client_cache_uses_lpaths:
-                    for lpath in tuple(self.known_metadata):
+                    for lpath in set(self.known_metadata) | self.device_book_cache.lpaths():
                         if lpath not in lpaths_on_device:
                             try:
-                                uuid = self.known_metadata[lpath].get('uuid', None)
+                                uuid = self._known_metadata_for(lpath).get('uuid', None)
                                 if uuid is not None:
                                     key = self._make_metadata_cache_key(uuid, lpath)
-                                    self.device_book_cache.pop(key, None)
+                                    self.device_book_cache.pop(key)
                                     self.known_metadata.pop(lpath, None)
                                     count_of_cache_items_deleted += 1
                             except Exception:
@@ -1489,20 +1571,37 @@ def sync_booklists(self, booklists, end_session=True):
         )
 
         if count:
+            batch_size = self.METADATA_BATCH_SIZE if self.client_can_receive_metadata_batches else 1
             for i, book in enumerate(books_to_send):
                 self._debug('sending metadata for book', book.lpath, book.title)
                 self._set_known_metadata(book)
-                opcode, result = self._call_client(
-                    'SEND_BOOK_METADATA',
-                    {
-                        'index': i,
-                        'count': count,
-                        'data': book,
-                        'supportsSync': (bool(self.is_read_sync_col) or bool(self.is_read_date_sync_col)),
-                    },
-                    print_debug_info=False,
-                    wait_for_response=False,
-                )
+                if batch_size > 1:
+                    if i % batch_size == 0:
+                        # Send many books in one message, saving the per message
+                        # overhead on the device
+                        self._call_client(
+                            'SEND_BOOK_METADATA_BATCH',
+                            {
+                                'index': i,
+                                'count': count,
+                                'data': books_to_send[i : i + batch_size],
+                                'supportsSync': (bool(self.is_read_sync_col) or bool(self.is_read_date_sync_col)),
+                            },
+                            print_debug_info=False,
+                            wait_for_response=False,
+                        )
+                else:
+                    self._call_client(
+                        'SEND_BOOK_METADATA',
+                        {
+                            'index': i,
+                            'count': count,
+                            'data': book,
+                            'supportsSync': (bool(self.is_read_sync_col) or bool(self.is_read_date_sync_col)),
+                        },
+                        print_debug_info=False,
+                        wait_for_response=False,
+                    )
 
                 if not self.have_bad_sync_columns:
                     # Update the local copy of the device's read info just in case
@@ -1548,6 +1647,24 @@ def upload_books(self, files, names, on_card=None, end_session=True, metadata=No
         names = iter(names)
         metadata = iter(metadata)
 
+        if self.client_can_pipeline_books:
+            jobs = []
+            for infile in files:
+                mdata, fname = next(metadata), next(names)
+                lpath = self._create_upload_path(mdata, fname, create_dirs=False)
+                self._debug('lpath', lpath)
+                if not hasattr(infile, 'read'):
+                    infile = USBMS.normalize_path(infile)
+                jobs.append((infile, lpath, SDBook(self.PREFIX, lpath, other=mdata)))
+
+            def progress(i):
+                self.report_progress((i + 1) / float(len(files)), _('Transferring books to device...'))
+
+            paths = [(lpath, length) for length, lpath in self._put_files_pipelined(jobs, progress)]
+            self.report_progress(1.0, _('Transferring books to device...'))
+            self._debug(f'finished uploading {len(files)} books')
+            return paths
+
         for i, infile in enumerate(files):
             mdata, fname = next(metadata), next(names)
             lpath = self._create_upload_path(mdata, fname, create_dirs=False)
@@ -1927,6 +2044,32 @@ def startup(self):
         self.listen_socket = None
         self.is_connected = False
 
+    def _initialize_state(self):
+        from calibre.devices.smart_device_app.metadata_cache import MetadataCache
+
+        self.is_connected = False
+        self.listen_socket = None
+        self.device_socket = None
+        self.json_codec = JsonCodec()
+        self.known_metadata = {}
+        self._close_metadata_cache()
+        self.device_book_cache = MetadataCache()
+        self.debug_time = time.time()
+        self.debug_start_time = time.time()
+        self.max_book_packet_len = 0
+        self.noop_counter = 0
+        self.connection_attempts = {}
+        self.client_wants_uuid_file_names = False
+        self.client_can_pipeline_books = False
+        self.pipeline_window = self.DEFAULT_PIPELINE_WINDOW
+        self.client_can_receive_metadata_batches = False
+        self.is_read_sync_col = None
+        self.is_read_date_sync_col = None
+        self.have_checked_sync_columns = False
+        self.have_bad_sync_columns = False
+        self.have_sent_future_dated_book_message = False
+        self.now = None
+
     def _startup_on_demand(self):
         if getattr(self, 'listen_socket', None) is not None:
             # we are already running
@@ -1938,24 +2081,7 @@ def _startup_on_demand(self):
         with self.sync_lock:
             if len(self.opcodes) != len(self.reverse_opcodes):
                 self._debug(self.opcodes, self.reverse_opcodes)
-            self.is_connected = False
-            self.listen_socket = None
-            self.device_socket = None
-            self.json_codec = JsonCodec()
-            self.known_metadata = {}
-            self.device_book_cache = defaultdict(dict)
-            self.debug_time = time.time()
-            self.debug_start_time = time.time()
-            self.max_book_packet_len = 0
-            self.noop_counter = 0
-            self.connection_attempts = {}
-            self.client_wants_uuid_file_names = False
-            self.is_read_sync_col = None
-            self.is_read_date_sync_col = None
-            self.have_checked_sync_columns = False
-            self.have_bad_sync_columns = False
-            self.have_sent_future_dated_book_message = False
-            self.now = None
+            self._initialize_state()
 
             compression_quality_ok = True
             try:
@@ -2068,6 +2194,7 @@ def _shutdown(self):
         # Force close any socket open by a device. This will cause any IO on the
         # socket to fail, eventually releasing the transaction lock.
         self._close_device_socket()
+        self._close_metadata_cache()
 
         # Now lockup so we can shutdown the control socket and unpublish mDNS
         with self.sync_lock:
@@ -0,0 +1,267 @@
+#!/usr/bin/env python
+# License: GPLv3 Copyright: 2026, Kovid Goyal <kovid at kovidgoyal.net>
+
+"""
+A persistent cache of the metadata of the books on a wireless device, stored
+in an SQLite database. Entries are only read from the database when they are
+needed and only entries that were changed are written back, so connecting to
+and disconnecting from a device with many books is fast.
+"""
+
+import json
+import os
+import time
+import traceback
+from contextlib import suppress
+
+import apsw
+
+from calibre.utils.config import from_json, to_json
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS books (
+    key TEXT PRIMARY KEY,
+    uuid TEXT NOT NULL DEFAULT '',
+    lpath TEXT NOT NULL DEFAULT '',
+    last_used REAL NOT NULL,
+    book TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS books_uuid_idx ON books (uuid);
+CREATE INDEX IF NOT EXISTS books_lpath_idx ON books (lpath);
+'''
+
+
+class MetadataCache:
+    """
+    A mapping of cache keys to book metadata objects. encode converts a book
+    into a JSON serializable dict and decode converts such a dict back into a
+    book. If path is None nothing is persisted.
+    """
+
+    def __init__(self, path=None, encode=None, decode=None):
+        self.path = path
+        self.encode, self.decode = encode, decode
+        self._conn = None
+        # Entries loaded or changed in this session
+        self.books = {}
+        self.last_used = {}
+        self.changed, self.removed = set(), set()
+
+    @property
+    def conn(self):
+        if self._conn is None and self.path is not None:
+            self._conn = apsw.Connection(self.path)
+            self._conn.cursor().execute('pragma busy_timeout=2000;' + SCHEMA)
+        return self._conn
+
+    def execute(self, sql, args=()):
+        if self.path is None:
+            return ()
+        return self.conn.cursor().execute(sql, args)
+
+    def close(self):
+        if self._conn is not None:
+            with suppress(Exception):
+                self._conn.close()
+            self._conn = None
+
+    def _load(self, key, raw):
+        try:
+            book = self.decode(json.loads(raw, object_hook=from_json))
+        except Exception:
+            traceback.print_exc()
+            return None
+        self.books[key] = book
+        return book
+
+    def _query(self, column, val):
+        for key, book in self.books.items():
+            if book.get(column, '') == val:
+                yield key, book
+        for key, raw in self.execute(f'SELECT key, book FROM books WHERE {column}=? ORDER BY last_used DESC', (val,)):
+            if key not in self.books and key not in self.removed:
+                book = self._load(key, raw)
+                if book is not None:
+                    yield key, book
+
+    def get(self, key):
+        if key in self.books:
+            return self.books[key]
+        if key in self.removed:
+            return None
+        for (raw,) in self.execute('SELECT book FROM books WHERE key=?', (key,)):
+            return self._load(key, raw)
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def set(self, key, book):
+        self.books[key] = book
+        self.last_used[key] = time.time()
+        self.changed.add(key)
+        self.removed.discard(key)
+
+    def touch(self, key):
+        self.last_used[key] = time.time()
+
+    def pop(self, key):
+        book = self.get(key)
+        self.books.pop(key, None)
+        self.last_used.pop(key, None)
+        self.changed.discard(key)
+        self.removed.add(key)
+        return book
+
+    def books_for_uuid(self, uuid):
+        for key, book in self._query('uuid', uuid):
+            yield book
+
+    def book_for_lpath(self, lpath):
+        for key, book in self._query('lpath', lpath):
+            return book
+
+    def lpaths(self):
+        ans = {book.get('lpath', '') for book in self.books.values()}
+        for key, lpath in self.execute('SELECT key, lpath FROM books'):
+            if key not in self.books and key not in self.removed:
+                ans.add(lpath)
+        ans.discard('')
+        return ans
+
+    def commit(self, purge_older_than_days=None):
+        """
+        Write changed entries to the database and delete entries not used in
+        the specified number of days. Returns the number of entries written and
+        the number purged.
+        """
+        if self.path is None:
+            return 0, 0
+        written = len(self.changed)
+        with self.conn:
+            c = self.conn.cursor()
+            c.executemany('DELETE FROM books WHERE key=?', ((key,) for key in self.removed))
+            c.executemany(
+                'INSERT OR REPLACE INTO books (key, uuid, lpath, last_used, book) VALUES (?, ?, ?, ?, ?)',
+                (
+                    (
+                        key,
+                        self.books[key].get('uuid', '') or '',
+                        self.books[key].get('lpath', '') or '',
+                        self.last_used[key],
+                        json.dumps(self.encode(self.books[key]), default=to_json),
+                    )
+                    for key in self.changed
+                ),
+            )
+            c.executemany('UPDATE books SET last_used=? WHERE key=?', ((t, key) for key, t in self.last_used.items() if key not in self.changed))
+            purged = 0
+            if purge_older_than_days is not None:
+                cutoff = time.time() - purge_older_than_days * 86400
+                for (key,) in c.execute('DELETE FROM books WHERE last_used < ? RETURNING key', (cutoff,)):
+                    self.books.pop(key, None)
+                    purged += 1
+        self.changed, self.removed = set(), set()
+        self.last_used = {k: v for k, v in self.last_used.items() if k in self.books}
+        return written, purged
+
+    def import_legacy_cache(self, path):
+        """
+        Import the entries from a cache in the old format, a sequence of JSON
+        records each preceded by its length, and delete it. Returns the number
+        of entries imported.
+        """
+        rows = []
+        with open(path, 'rb') as f:
+            while True:
+                rec_len = f.readline()
+                if len(rec_len) != 8:
+                    break
+                record = json.loads(f.read(int(rec_len)))
+                for key, entry in record.items():
+                    book = entry['book']
+                    last_used = from_json(entry['last_used']) if isinstance(entry.get('last_used'), dict) else None
+                    last_used = last_used.timestamp() if hasattr(last_used, 'timestamp') else time.time()
+                    rows.append((key, book.get('uuid') or '', book.get('lpath') or '', last_used, json.dumps(book)))
+        with self.conn:
+            self.conn.cursor().executemany('INSERT OR REPLACE INTO books (key, uuid, lpath, last_used, book) VALUES (?, ?, ?, ?, ?)', rows)
+        os.remove(path)
+        return len(rows)
+
+
+def find_tests():
+    import tempfile
+    import unittest
+
+    class MetadataCacheTest(unittest.TestCase):
+        def setUp(self):
+            from calibre.devices.smart_device_app.driver import SDBook
+            from calibre.ebooks.metadata.book.json_codec import JsonCodec
+
+            self.tdir = tempfile.TemporaryDirectory()
+            self.path = os.path.join(self.tdir.name, 'cache.sqlite')
+            codec = JsonCodec()
+            self.encode = codec.encode_book_metadata
+            self.decode = lambda raw: codec.raw_to_book(raw, SDBook, '')
+            self.book = lambda title, uuid: SDBook('', title + '.epub', other=self.make_metadata(title, uuid))
+
+        def make_metadata(self, title, uuid):
+            from calibre.ebooks.metadata.book.base import Metadata
+
+            ans = Metadata(title, ['Some Author'])
+            ans.uuid = uuid
+            return ans
+
+        def tearDown(self):
+            self.tdir.cleanup()
+
+        def cache(self):
+            return MetadataCache(self.path, self.encode, self.decode)
+
+        def test_metadata_cache(self):
+            c = self.cache()
+            for i in range(5):
+                c.set(f'u{i}.epub', self.book(f'b{i}', f'u{i}'))
+            self.assertEqual(c.commit(30), (5, 0))
+            c.close()
+
+            c = self.cache()
+            self.assertEqual(c.get('u1.epub').title, 'b1')
+            self.assertIsNone(c.get('missing'))
+            self.assertEqual(list(c.books), ['u1.epub'])
+            self.assertEqual(c.book_for_lpath('b2.epub').uuid, 'u2')
+            self.assertEqual([b.lpath for b in c.books_for_uuid('u3')], ['b3.epub'])
+            self.assertEqual(c.lpaths(), {f'b{i}.epub' for i in range(5)})
+            c.pop('u0.epub')
+            c.set('u1.epub', self.book('b1-changed', 'u1'))
+            self.assertNotIn('u0.epub', c)
+            self.assertIsNone(c.book_for_lpath('b0.epub'))
+            self.assertEqual(c.commit(30), (1, 0))
+            c.close()
+
+            c = self.cache()
+            self.assertEqual(c.lpaths(), {'b1-changed.epub'} | {f'b{i}.epub' for i in range(2, 5)})
+            c.execute('UPDATE books SET last_used=0 WHERE key=?', ('u2.epub',))
+            c.touch('u3.epub')
+            self.assertEqual(c.commit(30), (0, 1))
+            self.assertNotIn('u2.epub', c)
+            c.close()
+
+        def test_import_legacy_cache(self):
+            from calibre.utils.date import now
+
+            legacy = os.path.join(self.tdir.name, 'cache.json')
+            with open(legacy, 'wb') as f:
+                for i in range(3):
+                    record = {f'u{i}.epub': {'book': self.encode(self.book(f'b{i}', f'u{i}')), 'last_used': now()}}
+                    raw = json.dumps(record, indent=2, default=to_json).encode('utf-8')
+                    f.write(f'{len(raw) + 1:007}\n'.encode('ascii'))
+                    f.write(raw)
+                    f.write(b'\n')
+            c = self.cache()
+            self.assertEqual(c.import_legacy_cache(legacy), 3)
+            self.assertFalse(os.path.exists(legacy))
+            self.assertEqual(c.get('u2.epub').title, 'b2')
+            self.assertEqual(c.book_for_lpath('b0.epub').uuid, 'u0')
+            c.close()
+
+    return unittest.defaultTestLoader.loadTestsFromTestCase(MetadataCacheTest)
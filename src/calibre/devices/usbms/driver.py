@@ -9,6 +9,7 @@
 import json
 import os
 import shutil
+import time
 from itertools import cycle
 
 from calibre import fsync, prints
@@ -85,9 +86,21 @@ class USBMS(CLI, Device):
     CAN_SET_METADATA = []
     METADATA_CACHE = 'metadata.calibre'
     DRIVEINFO = 'driveinfo.calibre'
+    SCAN_SNAPSHOT = 'scan.calibre'
+    SCAN_SNAPSHOT_VERSION = 2
 
     SCAN_FROM_ROOT = False
 
+    # If True, the sizes and modification times of the files found when
+    # scanning for books are stored on the device. On the next connect, every
+    # folder is still listed, but books whose size and modification time have
+    # not changed are not checked for changes. The modification times of
+    # folders are not used, as many filesystems, such as FAT, do not update
+    # them reliably.
+    INCREMENTAL_SCAN = True
+    # The number of threads used to read metadata from new books
+    METADATA_READ_THREADS = 4
+
     def _update_driveinfo_record(self, dinfo, prefix, location_code, name=None):
         import uuid
 
@@ -199,6 +212,82 @@ def set_driveinfo_name(self, location_code, name):
     def formats_to_scan_for(self):
         return set(self.settings().format_map) | set(self.FORMATS)
 
+    def load_scan_snapshot(self, prefix):
+        if not self.INCREMENTAL_SCAN:
+            return {}
+        try:
+            with open(self.normalize_path(os.path.join(prefix, self.SCAN_SNAPSHOT)), 'rb') as f:
+                snapshot = json.loads(f.read())
+        except FileNotFoundError:
+            return {}
+        except Exception:
+            import traceback
+
+            traceback.print_exc()
+            return {}
+        if not isinstance(snapshot, dict) or snapshot.get('version') != self.SCAN_SNAPSHOT_VERSION:
+            return {}
+        return snapshot
+
+    def save_scan_snapshot(self, prefix, snapshot):
+        if not self.INCREMENTAL_SCAN:
+            return
+        snapshot['version'] = self.SCAN_SNAPSHOT_VERSION
+        try:
+            with open(self.normalize_path(os.path.join(prefix, self.SCAN_SNAPSHOT)), 'wb') as f:
+                f.write(json.dumps(snapshot).encode('utf-8'))
+                fsync(f)
+        except Exception:
+            # Failing to save the snapshot only means the next scan will be slower
+            import traceback
+
+            traceback.print_exc()
+
+    def scan_ebook_dir(self, prefix, ebook_dir, recursive, old_snapshot, new_snapshot, maxdepth=128):
+        """
+        Return a list of ``(filename, path, signature, old_signature)`` for
+        every file in ebook_dir, where signature is the (size, mtime) of the
+        file and old_signature is the one recorded in old_snapshot, if any.
+        The signatures are recorded in new_snapshot.
+        """
+        root = self.normalize_path(prefix)
+        old_dirs, new_dirs = old_snapshot.get('dirs', {}), new_snapshot.setdefault('dirs', {})
+        # Files modified very recently could be modified again within the
+        # granularity of the filesystem timestamps, so do not record them
+        recent = time.time_ns() - 2 * 10**9
+        ans = []
+        stack = [(ebook_dir, 0)]
+        while stack:
+            path, depth = stack.pop()
+            key = os.path.relpath(path, root).replace(os.sep, '/')
+            files, dirs = {}, []
+            try:
+                with os.scandir(path) as it:
+                    for e in it:
+                        try:
+                            if e.is_dir():
+                                if not e.is_symlink():
+                                    dirs.append(e.name)
+                                continue
+                            est = e.stat()
+                        except OSError:
+                            continue
+                        if e.name not in (self.METADATA_CACHE, self.SCAN_SNAPSHOT):
+                            files[e.name] = (est.st_size, est.st_mtime_ns)
+            except OSError:
+                continue
+            old_files = old_dirs.get(key) or {}
+            recorded = {}
+            for name, signature in files.items():
+                ans.append((name, path, signature, tuple(old_files.get(name, ()))))
+                if signature[1] < recent:
+                    recorded[name] = list(signature)
+            if recorded:
+                new_dirs[key] = recorded
+            if recursive and depth < maxdepth:
+                stack.extend((os.path.join(path, d), depth + 1) for d in sorted(dirs, reverse=True))
+        return ans
+
     def is_allowed_book_file(self, filename, path, prefix):
         return True
 
@@ -237,7 +326,11 @@ def books(self, oncard=None, end_session=True):
 
         all_formats = self.formats_to_scan_for()
 
-        def update_booklist(filename, path, prefix):
+        new_books = []
+        old_snapshot = self.load_scan_snapshot(prefix)
+        new_snapshot = {}
+
+        def update_booklist(filename, path, prefix, signature, old_signature):
             changed = False
             # Ignore AppleDouble files
             if filename.startswith('._'):
@@ -250,17 +343,30 @@ def update_booklist(filename, path, prefix):
                     idx = bl_cache.get(lpath, None)
                     if idx is not None:
                         bl_cache[lpath] = None
-                        if self.update_metadata_item(bl[idx]):
+                        # Books whose size and modification time are unchanged
+                        # since the last scan do not need to be checked
+                        unchanged = signature == old_signature and bl[idx].size == signature[0]
+                        if not unchanged and self.update_metadata_item(bl[idx]):
                             # print('update_metadata_item returned true')
                             changed = True
-                    elif bl.add_book(self.book_from_path(prefix, lpath), replace_metadata=False):
-                        changed = True
+                    elif lpath not in bl_cache:
+                        # Read the metadata for new books in parallel, below
+                        bl_cache[lpath] = None
+                        new_books.append(lpath)
                 except Exception:  # Probably a filename encoding error
                     import traceback
 
                     traceback.print_exc()
             return changed
 
+        def book_from_path(lpath):
+            try:
+                return self.book_from_path(prefix, lpath)
+            except Exception:  # Probably a filename encoding error
+                import traceback
+
+                traceback.print_exc()
+
         if isinstance(ebook_dirs, (str, bytes)):
             ebook_dirs = [ebook_dirs]
         for ebook_dir in ebook_dirs:
@@ -272,28 +378,23 @@ def update_booklist(filename, path, prefix):
             debug_print('USBMS: scan from root', self.SCAN_FROM_ROOT, ebook_dir)
             if not os.path.exists(ebook_dir):
                 continue
-            # Get all books in the ebook_dir directory
-            if self.SUPPORTS_SUB_DIRS or self.SUPPORTS_SUB_DIRS_FOR_SCAN:
-                # build a list of files to check, so we can accurately report progress
-                flist = []
-                for path, dirs, files in safe_walk(ebook_dir):
-                    for filename in files:
-                        if filename != self.METADATA_CACHE:
-                            flist.append({
-                                'filename': self.path_to_unicode(filename),
-                                'path': self.path_to_unicode(path),
-                            })
-                for i, f in enumerate(flist):
-                    self.report_progress(i / float(len(flist)), _('Getting list of books on device...'))
-                    changed = update_booklist(f['filename'], f['path'], prefix)
-                    if changed:
-                        need_sync = True
-            else:
-                paths = os.listdir(ebook_dir)
-                for i, filename in enumerate(paths):
-                    self.report_progress((i + 1) / float(len(paths)), _('Getting list of books on device...'))
-                    changed = update_booklist(self.path_to_unicode(filename), ebook_dir, prefix)
-                    if changed:
+            # Get all books in the ebook_dir directory, building a list of
+            # files to check first, so we can accurately report progress
+            recursive = bool(self.SUPPORTS_SUB_DIRS or self.SUPPORTS_SUB_DIRS_FOR_SCAN)
+            flist = self.scan_ebook_dir(prefix, ebook_dir, recursive, old_snapshot, new_snapshot)
+            for i, (filename, path, signature, old_signature) in enumerate(flist):
+                self.report_progress(i / float(len(flist)), _('Getting list of books on device...'))
+                changed = update_booklist(filename, path, prefix, signature, old_signature)
+                if changed:
+                    need_sync = True
+
+        if new_books:
+            from concurrent.futures import ThreadPoolExecutor
+
+            with ThreadPoolExecutor(max_workers=self.METADATA_READ_THREADS, thread_name_prefix='USBMSReadMetadata') as executor:
+                for i, book in enumerate(executor.map(book_from_path, new_books)):
+                    self.report_progress(i / float(len(new_books)), _('Reading metadata from new books on device...'))
+                    if book is not None and bl.add_book(book, replace_metadata=False):
                         need_sync = True
 
         # Remove books that are no longer in the filesystem. Cache contains
@@ -313,6 +414,9 @@ def update_booklist(filename, path, prefix):
             else:
                 self.sync_booklists((bl, None, None))
 
+        if new_snapshot.get('dirs') != old_snapshot.get('dirs'):
+            self.save_scan_snapshot(prefix, new_snapshot)
+
         self.report_progress(1.0, _('Getting list of books on device...'))
         debug_print('USBMS: Finished fetching list of books from device. oncard=', oncard)
         return bl
@@ -553,3 +657,87 @@ def book_from_path(cls, prefix, lpath):
         size = os.stat(cls.normalize_path(os.path.join(prefix, lpath))).st_size
         book = cls.book_class(prefix, lpath, other=mi, size=size)
         return book
+
+
+def find_tests():
+    import tempfile
+    import unittest
+
+    class IncrementalScanTest(unittest.TestCase):
+        def setUp(self):
+            from calibre.devices.folder_device.driver import FOLDER_DEVICE
+
+            self.tdir = tempfile.TemporaryDirectory()
+            self.root = self.tdir.name
+            self.dev = FOLDER_DEVICE(self.root)
+            self.dev.set_progress_reporter(lambda *a: None)
+            self.checked = []
+            orig = self.dev.update_metadata_item
+
+            def update_metadata_item(book):
+                self.checked.append(book.lpath)
+                return orig(book)
+
+            self.dev.update_metadata_item = update_metadata_item
+
+        def tearDown(self):
+            self.tdir.cleanup()
+
+        def write(self, lpath, data, age=60):
+            path = os.path.join(self.root, *lpath.split('/'))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(data)
+            t = time.time_ns() - age * 10**9
+            os.utime(path, ns=(t, t))
+
+        def books(self):
+            del self.checked[:]
+            return {b.lpath: b.size for b in self.dev.books()}
+
+        def freeze_dir_mtimes(self):
+            # Simulate filesystems that do not update folder modification times
+            ans = {}
+            for dirpath, dirnames, filenames in os.walk(self.root):
+                ans[dirpath] = os.stat(dirpath).st_mtime_ns
+            return ans
+
+        def restore_dir_mtimes(self, mtimes):
+            for path, t in mtimes.items():
+                os.utime(path, ns=(t, t))
+
+        def test_incremental_scan(self):
+            self.write('a.txt', b'aaa')
+            self.write('sub/b.txt', b'bbbb')
+            self.assertEqual(self.books(), {'a.txt': 3, 'sub/b.txt': 4})
+            self.assertTrue(os.path.exists(os.path.join(self.root, self.dev.SCAN_SNAPSHOT)))
+            # Nothing changed, so no book is checked
+            self.assertEqual(self.books(), {'a.txt': 3, 'sub/b.txt': 4})
+            self.assertEqual(self.checked, [])
+
+            # Adding, removing and editing files is noticed even when the
+            # modification times of the folders do not change
+            mtimes = self.freeze_dir_mtimes()
+            self.write('sub/c.txt', b'c')
+            os.remove(os.path.join(self.root, 'a.txt'))
+            self.write('sub/b.txt', b'bbbbbbbb', age=30)
+            self.restore_dir_mtimes(mtimes)
+            self.assertEqual(self.books(), {'sub/b.txt': 8, 'sub/c.txt': 1})
+            self.assertEqual(self.checked, ['sub/b.txt'])
+
+            # A file edited in place, keeping its size
+            mtimes = self.freeze_dir_mtimes()
+            self.write('sub/b.txt', b'BBBBBBBB', age=20)
+            self.restore_dir_mtimes(mtimes)
+            self.assertEqual(self.books(), {'sub/b.txt': 8, 'sub/c.txt': 1})
+            self.assertEqual(self.checked, ['sub/b.txt'])
+            self.assertEqual(self.books(), {'sub/b.txt': 8, 'sub/c.txt': 1})
+            self.assertEqual(self.checked, [])
+
+            # Files modified very recently are always checked
+            self.write('sub/c.txt', b'cc', age=0)
+            self.assertEqual(self.books(), {'sub/b.txt': 8, 'sub/c.txt': 2})
+            self.books()
+            self.assertEqual(self.checked, ['sub/c.txt'])
+
+    return unittest.defaultTestLoader.loadTestsFromTestCase(IncrementalScanTest)
@@ -5,17 +5,11 @@
 """
 
 import os
-import time
-import traceback
 from queue import Empty
 
-from calibre import extract, prints, walk
-from calibre.constants import filesystem_encoding
-from calibre.ptempfile import PersistentTemporaryDirectory
+from calibre import prints
 from calibre.utils.cleantext import clean_ascii_chars
 from calibre.utils.icu import numeric_sort_key
-from calibre.utils.ipc.job import ParallelJob
-from calibre.utils.ipc.server import Server
 from calibre.utils.localization import _
 
 # If the specified screen has either dimension larger than this value, no image
@@ -23,24 +17,6 @@
 MAX_SCREEN_SIZE = 3000
 
 
-def extract_comic(path_to_comic_file):
-    """
-    Un-archive the comic file.
-    """
-    tdir = PersistentTemporaryDirectory(suffix='_comic_extract')
-    if not isinstance(tdir, str):
-        # Needed in case the zip file has wrongly encoded unicode file/dir
-        # names
-        tdir = tdir.decode(filesystem_encoding)
-    extract(path_to_comic_file, tdir)
-    for x in walk(tdir):
-        bn = os.path.basename(x)
-        nbn = clean_ascii_chars(bn.replace('#', '_'))
-        if nbn and nbn != bn:
-            os.rename(x, os.path.join(os.path.dirname(x), nbn))
-    return tdir
-
-
 def generate_entries_from_dir(path):
     from functools import partial
 
@@ -98,15 +74,115 @@ def key(x):
     return pages
 
 
+def comic_archive_type(path_to_comic_file):
+    """
+    Return one of 'zip', 'rar' or '7z' for the specified comic file, or None
+    if the archive type is not recognized.
+    """
+    with open(path_to_comic_file, 'rb') as f:
+        id_ = f.read(3)
+    if id_ == b'Rar':
+        return 'rar'
+    if id_.startswith(b'PK'):
+        return 'zip'
+    if id_.startswith(b'7z'):
+        return '7z'
+    ext = os.path.splitext(path_to_comic_file)[1][1:].lower()
+    return {'zip': 'zip', 'cbz': 'zip', 'cbr': 'rar', 'rar': 'rar', 'cb7': '7z', '7z': '7z'}.get(ext)
+
+
+def archive_entries(path_to_comic_file, fmt):
+    """
+    Return a dict mapping the names of the members of the archive to a
+    function returning a sort key for the member when sorting on mtime,
+    suitable for passing to :func:`find_pages`.
+    """
+    from functools import partial
+
+    items = {}
+    if fmt == 'rar':
+        from calibre.utils.unrar import headers
+
+        for h in headers(path_to_comic_file):
+            items[h['filename']] = partial(h.get, 'file_time', 0)
+    elif fmt == 'zip':
+        from calibre.utils.zipfile import ZipFile
+
+        with ZipFile(path_to_comic_file) as zf:
+            for i in zf.infolist():
+                items[i.filename] = partial(getattr, i, 'date_time')
+    else:
+        from calibre.utils.seven_zip import open_archive
+
+        with open_archive(path_to_comic_file) as ar:
+            # 7z archives do not reliably store modification times, so use
+            # the order in which files were added to the archive instead
+            for i, name in enumerate(ar.getnames()):
+                items[name] = partial(int, i)
+    return items
+
+
+def read_pages_from_archive(path_to_comic_file, fmt, pages, callback):
+    """
+    Read the specified pages directly from the archive, without extracting it
+    to disk, calling ``callback(num, name, data)`` for every page, where num is
+    the index of the page in ``pages``. Pages are delivered in the order in
+    which they are stored in the archive, which need not be reading order.
+    """
+    page_nums = {name: i for i, name in enumerate(pages)}
+    if fmt == 'rar':
+        from calibre.utils.unrar import extract_members
+
+        current = []
+
+        def flush():
+            if current:
+                name, chunks = current
+                del current[:]
+                callback(page_nums[name], name, b''.join(chunks))
+
+        def on_member(x):
+            if isinstance(x, dict):
+                flush()
+                fname = x['filename']
+                if fname in page_nums:
+                    current.extend((fname, []))
+                    return True
+                return False
+            if isinstance(x, bytes):
+                current[1].append(x)
+
+        extract_members(path_to_comic_file, on_member)
+        flush()
+    elif fmt == 'zip':
+        from calibre.utils.zipfile import ZipFile
+
+        with ZipFile(path_to_comic_file) as zf:
+            for name in zf.namelist():
+                num = page_nums.get(name)
+                if num is not None:
+                    callback(num, name, zf.read(name))
+    else:
+        from calibre.utils.seven_zip import stream_files
+
+        def on_file(name, data):
+            num = page_nums.get(name)
+            if num is not None:
+                callback(num, name, data)
+
+        stream_files(path_to_comic_file, pages, on_file)
+
+
 class PageProcessor(list):  # {{{
     """
     Contains the actual image rendering logic. See :method:`render` and
     :method:`process_pages`.
     """
 
-    def __init__(self, path_to_page, dest, opts, num):
+    def __init__(self, path_to_page, dest, opts, num, data=None):
         list.__init__(self)
         self.path_to_page = path_to_page
+        self.data = data
         self.opts = opts
         self.num = num
         self.dest = dest
@@ -121,8 +197,11 @@ def render(self):
         from calibre.utils.filenames import make_long_path_useable
         from calibre.utils.img import crop_image, image_from_data, scale_image
 
-        with open(make_long_path_useable(self.path_to_page), 'rb') as f:
-            img = image_from_data(f.read())
+        if self.data is None:
+            with open(make_long_path_useable(self.path_to_page), 'rb') as f:
+                self.data = f.read()
+        img = image_from_data(self.data)
+        self.data = None
         width, height = img.width(), img.height()
         if self.num == 0:  # First image so create a thumbnail from it
             with open(os.path.join(self.dest, 'thumbnail.png'), 'wb') as f:
@@ -254,26 +333,6 @@ def process_pages(self):
 # }}}
 
 
-def render_pages(tasks, dest, opts, notification=lambda x, y: x):
-    """
-    Entry point for the job server.
-    """
-    failures, pages = [], []
-    for num, path in tasks:
-        try:
-            pages.extend(PageProcessor(path, dest, opts, num))
-            msg = _('Rendered %s') % path
-        except Exception:
-            failures.append(path)
-            msg = _('Failed %s') % path
-            if opts.verbose:
-                msg += '\n' + traceback.format_exc()
-        prints(msg)
-        notification(0.5, msg)
-
-    return pages, failures
-
-
 class Progress:
     def __init__(self, total, update):
         self.total = total
@@ -286,40 +345,153 @@ def __call__(self, percent, msg=''):
         self.update(float(self.done) / self.total, msg)
 
 
-def process_pages(pages, opts, update, tdir):
+def render_page(num, name, data, common_data=None):
+    """
+    Entry point for the worker pool used by :func:`stream_pages`.
+    """
+    dest, opts = common_data
+    return list(PageProcessor(name, dest, opts, num, data=data))
+
+
+def stream_pages(path_to_comic_file, dest, opts, update=lambda x, y='': None, max_workers=None):
     """
-    Render all identified comic pages.
+    Render all pages of the specified comic file into dest. Pages are read
+    directly from the archive and handed to a bounded pool of worker
+    processes as they are read, so the archive is never extracted to disk and
+    at most a few pages per worker are held in memory at any time. Processed
+    pages are written to dest as soon as each worker finishes with them.
+
+    Returns the list of rendered pages in reading order and the list of
+    pages that could not be rendered.
     """
+    fmt = comic_archive_type(path_to_comic_file)
+    if fmt is None:
+        raise ValueError(f'Unknown archive type for comic: {path_to_comic_file}')
+    pages = find_pages(archive_entries(path_to_comic_file, fmt), sort_on_mtime=opts.no_sort, verbose=opts.verbose)
+    if not pages:
+        raise ValueError(f'Could not find any pages in the comic: {path_to_comic_file}')
     progress = Progress(len(pages), update)
-    server = Server()
-    jobs = []
-    tasks = [(p, os.path.join(tdir, os.path.basename(p))) for p in pages]
-    tasks = server.split(pages)
-    for task in tasks:
-        jobs.append(ParallelJob('render_pages', '', progress, args=[task, tdir, opts]))
-        server.add_job(jobs[-1])
-    while True:
-        time.sleep(1)
-        running = False
-        for job in jobs:
+    rendered, failures = {}, []
+
+    if opts.no_process:
+
+        def copy_page(num, name, data):
+            bn = clean_ascii_chars(name.replace('\\', '/').rpartition('/')[-1].replace('#', '_'))
+            path = os.path.join(dest, f'{num} - {bn}')
+            with open(path, 'wb') as f:
+                f.write(data)
+            rendered[num] = [path]
+            progress(1, _('Copied %s') % name)
+
+        read_pages_from_archive(path_to_comic_file, fmt, pages, copy_page)
+    else:
+        from calibre.utils.ipc.pool import Failure, Pool
+
+        pool = Pool(max_workers=max_workers, name='ComicRender')
+        in_flight = {}
+        # Limit the number of pages that have been read from the archive but
+        # not yet rendered, so that memory usage stays bounded for huge comics
+        window = 2 * pool.max_workers
+
+        def collect_one():
             while True:
                 try:
-                    x = job.notifications.get_nowait()
-                    progress(*x)
+                    wr = pool.results.get(True, 0.1)
                 except Empty:
+                    if pool.failed:
+                        raise Failure(pool.terminal_failure)
+                else:
                     break
-            job.update()
-            if not job.is_finished:
-                running = True
-        if not running:
-            break
-    server.close()
-    ans, failures = [], []
-
-    for job in jobs:
-        if job.failed or job.result is None:
-            raise Exception(_('Failed to process comic: \n\n%s') % job.log_file.read())
-        pages, failures_ = job.result
-        ans += pages
-        failures += failures_
+            pool.results.task_done()
+            name = in_flight.pop(wr.id)
+            if wr.is_terminal_failure:
+                raise Failure(pool.terminal_failure)
+            if wr.result.err is None:
+                rendered[wr.id] = wr.result.value
+                msg = _('Rendered %s') % name
+            else:
+                failures.append(name)
+                msg = _('Failed %s') % name
+                if opts.verbose:
+                    msg += '\n' + wr.result.traceback
+            prints(msg)
+            progress(0.5, msg)
+
+        def submit(num, name, data):
+            while len(in_flight) >= window:
+                collect_one()
+            in_flight[num] = name
+            pool(num, 'calibre.ebooks.comic.input', 'render_page', num, name, data)
+
+        try:
+            pool.set_common_data((dest, opts))
+            read_pages_from_archive(path_to_comic_file, fmt, pages, submit)
+            while in_flight:
+                collect_one()
+        finally:
+            pool.shutdown()
+    ans = []
+    for num in sorted(rendered):
+        ans.extend(rendered[num])
     return ans, failures
+
+
+def find_tests():
+    import tempfile
+    import unittest
+    from types import SimpleNamespace
+
+    class ComicInputTest(unittest.TestCase):
+        pages = {f'pages/{i}.png': f'page {i}'.encode() for i in (1, 2, 10)}
+
+        def setUp(self):
+            self.tdir = tempfile.TemporaryDirectory()
+
+        def tearDown(self):
+            self.tdir.cleanup()
+
+        def make_archive(self, fmt):
+            path = os.path.join(self.tdir.name, 'comic.' + {'zip': 'cbz', '7z': 'cb7'}[fmt])
+            if fmt == 'zip':
+                from calibre.utils.zipfile import ZipFile
+
+                with ZipFile(path, 'w') as zf:
+                    for name, data in self.pages.items():
+                        zf.writestr(name, data)
+                    zf.writestr('notes.txt', b'not a page')
+            else:
+                from calibre.utils.seven_zip import open_archive
+
+                with open_archive(path, 'w') as zf:
+                    for name, data in self.pages.items():
+                        zf.writestr(data, name)
+                    zf.writestr(b'not a page', 'notes.txt')
+            return path
+
+        def test_read_pages_from_archive(self):
+            for fmt in ('zip', '7z'):
+                path = self.make_archive(fmt)
+                self.assertEqual(comic_archive_type(path), fmt)
+                pages = find_pages(archive_entries(path, fmt))
+                self.assertEqual(pages, ['pages/1.png', 'pages/2.png', 'pages/10.png'])
+                seen = {}
+
+                def callback(num, name, data):
+                    seen[num] = name, data
+
+                read_pages_from_archive(path, fmt, pages, callback)
+                self.assertEqual(seen, {i: (name, self.pages[name]) for i, name in enumerate(pages)}, fmt)
+
+        def test_stream_pages_without_processing(self):
+            for fmt in ('zip', '7z'):
+                path = self.make_archive(fmt)
+                dest = os.path.join(self.tdir.name, fmt)
+                os.mkdir(dest)
+                opts = SimpleNamespace(no_sort=False, verbose=False, no_process=True)
+                rendered, failures = stream_pages(path, dest, opts)
+                self.assertEqual(failures, [])
+                self.assertEqual([os.path.basename(x) for x in rendered], ['0 - 1.png', '1 - 2.png', '2 - 10.png'])
+                with open(rendered[-1], 'rb') as f:
+                    self.assertEqual(f.read(), self.pages['pages/10.png'])
+
+    return unittest.defaultTestLoader.loadTestsFromTestCase(ComicInputTest)
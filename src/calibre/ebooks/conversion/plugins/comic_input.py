@@ -6,7 +6,6 @@
 
 import codecs
 import os
-import shutil
 import textwrap
 
 from calibre import CurrentDir
@@ -155,30 +154,15 @@ def get_comics_from_collection(self, stream):
         return comics
 
     def get_pages(self, comic, tdir2):
-        from calibre.ebooks.comic.input import extract_comic, find_pages, process_pages
+        from calibre.ebooks.comic.input import stream_pages
 
-        tdir = extract_comic(comic)
-        new_pages = find_pages(tdir, sort_on_mtime=self.opts.no_sort, verbose=self.opts.verbose)
-        thumbnail = None
+        new_pages, failures = stream_pages(comic, tdir2, self.opts, self.report_progress)
+        if failures:
+            self.log.warning('Could not process the following pages (run with --verbose to see why):')
+            for f in failures:
+                self.log.warning('\t', f)
         if not new_pages:
-            raise ValueError(f'Could not find any pages in the comic: {comic}')
-        if self.opts.no_process:
-            n2 = []
-            for i, page in enumerate(new_pages):
-                n2.append(os.path.join(tdir2, f'{i} - {os.path.basename(page)}'))
-                shutil.copyfile(page, n2[-1])
-            new_pages = n2
-        else:
-            new_pages, failures = process_pages(new_pages, self.opts, self.report_progress, tdir2)
-            if failures:
-                self.log.warning('Could not process the following pages (run with --verbose to see why):')
-                for f in failures:
-                    self.log.warning('\t', f)
-            if not new_pages:
-                raise ValueError(f'Could not find any valid pages in comic: {comic}')
-            thumbnail = os.path.join(tdir2, 'thumbnail.' + self.opts.output_format.lower())
-            if not os.access(thumbnail, os.R_OK):
-                thumbnail = None
+            raise ValueError(f'Could not find any valid pages in comic: {comic}')
         return new_pages
 
     def get_images(self):
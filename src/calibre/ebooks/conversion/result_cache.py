@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+# License: GPLv3 Copyright: 2026, Kovid Goyal <kovid at kovidgoyal.net>
+
+"""
+An on-disk cache of conversion outputs, keyed on the identity of the input file,
+the output format, the conversion options and the calibre version, so that
+repeating a conversion just copies the previous result. The cache is bounded
+in size, the least recently used outputs are discarded first.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+from collections import OrderedDict
+from threading import Lock
+
+from calibre.constants import __version__, cache_dir
+from calibre.utils.filenames import atomic_rename
+
+# Options that do not affect the output of a conversion
+IGNORED_OPTIONS = frozenset(('verbose', 'debug_pipeline'))
+
+
+def file_hash(path, chunk_size=64 * 1024):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            raw = f.read(chunk_size)
+            if not raw:
+                break
+            sha.update(raw)
+    return sha.hexdigest()
+
+
+def normalize_options(recommendations):
+    """
+    Convert conversion options, either a dict or a list of ``(name, value,
+    level)`` recommendations, into a sorted list of ``(name, value)`` pairs.
+    Values that are paths to existing files are replaced by the hash of the
+    file contents, so that options pointing to temporary copies of the same
+    file, such as an OPF or cover image, compare equal.
+    """
+    if isinstance(recommendations, dict):
+        items = recommendations.items()
+    else:
+        items = (r[:2] for r in recommendations)
+    ans = {}
+    for name, val in items:
+        if name in IGNORED_OPTIONS:
+            continue
+        if isinstance(val, str) and val and os.path.isfile(val):
+            val = 'sha256:' + file_hash(val)
+        ans[name] = val
+    return sorted(ans.items())
+
+
+class ConversionCache:
+    """
+    :param location: The folder in which cached outputs are stored
+    :param max_size: The maximum total size of cached outputs, in bytes
+    """
+
+    def __init__(self, location=None, max_size=512 * 1024 * 1024):
+        self.location = location or os.path.join(cache_dir(), 'conversion-results')
+        self.max_size = max_size
+        self.lock = Lock()
+        self.entries = OrderedDict()
+        self.total_size = 0
+        os.makedirs(self.location, exist_ok=True)
+        existing = []
+        with os.scandir(self.location) as it:
+            for entry in it:
+                if entry.is_file() and not entry.name.startswith('.'):
+                    st = entry.stat()
+                    existing.append((st.st_mtime, entry.name, st.st_size))
+        for mtime, key, size in sorted(existing):
+            self.entries[key] = size
+            self.total_size += size
+        with self.lock:
+            self.expire()
+
+    @staticmethod
+    def key(input_hash, output_fmt, recommendations, extra=()):
+        """
+        Return the cache key for a conversion. input_hash identifies the
+        contents of the input file, for example, its hash from :func:`file_hash`
+        or, for a book in a library, the size and modification time of the
+        format. It must be JSON serializable. extra can be used to add other
+        data that affects the output, such as the hash of the metadata being
+        applied.
+        """
+        data = json.dumps([input_hash, output_fmt.lower(), normalize_options(recommendations), __version__, list(extra)], default=repr)
+        return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+    def path_for_key(self, key):
+        return os.path.join(self.location, key)
+
+    def get(self, key, dest):
+        """
+        Copy the cached output for key to dest. Returns False if there is no
+        cached output.
+        """
+        with self.lock:
+            if key not in self.entries:
+                return False
+            self.entries.move_to_end(key)
+        path = self.path_for_key(key)
+        try:
+            shutil.copyfile(path, dest)
+            os.utime(path)
+        except OSError:
+            with self.lock:
+                self.total_size -= self.entries.pop(key, 0)
+            return False
+        return True
+
+    def put(self, key, output_path):
+        """Store a copy of the file at output_path as the output for key."""
+        size = os.path.getsize(output_path)
+        if size > self.max_size:
+            return
+        path = self.path_for_key(key)
+        tpath = os.path.join(self.location, '.' + key)
+        shutil.copyfile(output_path, tpath)
+        atomic_rename(tpath, path)
+        with self.lock:
+            self.total_size += size - self.entries.pop(key, 0)
+            self.entries[key] = size
+            self.expire()
+
+    def expire(self):
+        while self.total_size > self.max_size and self.entries:
+            key, size = self.entries.popitem(last=False)
+            self.total_size -= size
+            try:
+                os.remove(self.path_for_key(key))
+            except OSError:
+                pass
+
+    def clear(self):
+        with self.lock:
+            self.max_size, orig = 0, self.max_size
+            try:
+                self.expire()
+            finally:
+                self.max_size = orig
+
+
+def find_tests():
+    import tempfile
+    import unittest
+
+    class ConversionCacheTest(unittest.TestCase):
+        def setUp(self):
+            self.tdir = tempfile.TemporaryDirectory()
+            self.cache_dir = os.path.join(self.tdir.name, 'cache')
+
+        def tearDown(self):
+            self.tdir.cleanup()
+
+        def write(self, name, data):
+            path = os.path.join(self.tdir.name, name)
+            with open(path, 'wb') as f:
+                f.write(data)
+            return path
+
+        def test_key(self):
+            k = ConversionCache.key
+            opf1, opf2 = self.write('1.opf', b'opf'), self.write('2.opf', b'opf')
+            self.assertEqual(k('h', 'EPUB', [('a', 1, 1), ('opf', opf1, 1)]), k('h', 'epub', {'opf': opf2, 'a': 1, 'verbose': 2}))
+            self.assertNotEqual(k('h', 'epub', {'a': 1}), k('h', 'epub', {'a': 2}))
+            self.assertNotEqual(k('h', 'epub', {}), k('h', 'mobi', {}))
+            self.assertNotEqual(k('h', 'epub', {}), k('h2', 'epub', {}))
+            self.assertNotEqual(k('h', 'epub', {}, ('m1',)), k('h', 'epub', {}, ('m2',)))
+
+        def test_cache(self):
+            c = ConversionCache(self.cache_dir, max_size=10)
+            dest = os.path.join(self.tdir.name, 'dest')
+            self.assertFalse(c.get('k1', dest))
+            c.put('k1', self.write('out1', b'12345'))
+            self.assertTrue(c.get('k1', dest))
+            with open(dest, 'rb') as f:
+                self.assertEqual(f.read(), b'12345')
+            # Too large to be cached
+            c.put('big', self.write('big', b'x' * 11))
+            self.assertFalse(c.get('big', dest))
+            # Least recently used entries are expired first
+            c.put('k2', self.write('out2', b'123'))
+            c.get('k1', dest)
+            c.put('k3', self.write('out3', b'123'))
+            self.assertEqual(list(c.entries), ['k1', 'k3'])
+            # The cache persists
+            c = ConversionCache(self.cache_dir, max_size=10)
+            self.assertEqual(c.total_size, 8)
+            self.assertTrue(c.get('k3', dest))
+            c.clear()
+            self.assertFalse(c.get('k3', dest))
+            self.assertEqual(os.listdir(self.cache_dir), [])
+
+    return unittest.defaultTestLoader.loadTestsFromTestCase(ConversionCacheTest)
@@ -0,0 +1,449 @@
+#!/usr/bin/env python
+# License: GPLv3 Copyright: 2026, Kovid Goyal <kovid at kovidgoyal.net>
+
+"""
+A long running conversion service. Conversions are run in a pool of
+pre-warmed worker processes, avoiding the cost of starting a new process,
+importing calibre and loading all plugins for every conversion. Jobs are
+submitted over a local socket, see :func:`convert_via_service`. Workers are
+replaced after running a fixed number of jobs or when their memory usage
+grows too large. Replacement workers are started and warmed up as soon as the
+worker they replace is retired.
+
+Clients must prove that they know a secret key, stored in a file readable only
+by the user running the service, before any request is read. Otherwise any
+local user could connect and run code as that user, since requests are
+pickled.
+"""
+
+import os
+import sys
+import time
+from collections import deque
+from contextlib import redirect_stderr, redirect_stdout, suppress
+from itertools import count
+from multiprocessing.connection import Client, Listener
+from queue import Empty, Queue
+from threading import Event, Lock, Thread
+
+from calibre.constants import iswindows
+from calibre.utils.ipc import socket_address
+
+DEFAULT_MAX_JOBS_PER_WORKER = 100
+DEFAULT_MAX_WORKER_MEMORY = 1024  # in MB
+AUTHKEY_SIZE = 32
+
+
+def service_address():
+    return socket_address('Conversion' if iswindows else 'conversion')
+
+
+def authkey_path():
+    from calibre.constants import config_dir
+
+    return os.path.join(config_dir, 'conversion-service-key')
+
+
+def service_authkey(path=None):
+    """
+    Return the key used to authenticate connections to the service, creating
+    it if it does not exist yet. The service and its clients must be run by
+    the same user.
+    """
+    path = path or authkey_path()
+    for i in range(50):
+        try:
+            with open(path, 'rb') as f:
+                key = f.read()
+        except FileNotFoundError:
+            try:
+                fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, 'O_BINARY', 0), 0o600)
+            except FileExistsError:
+                continue
+            key = os.urandom(AUTHKEY_SIZE)
+            with open(fd, 'wb') as f:
+                f.write(key)
+            return key
+        if len(key) == AUTHKEY_SIZE:
+            return key
+        # Being written by another process
+        time.sleep(0.01)
+    raise ValueError(f'The conversion service key in {path} is invalid, delete it and restart the conversion service')
+
+
+# Functions run in the worker processes {{{
+
+
+def warm_up():
+    """
+    Pay the one time costs of a conversion, such as loading plugins and
+    initializing the CSS parser and mimetypes database, before any jobs
+    arrive.
+    """
+    import logging
+
+    import css_parser
+
+    from calibre import get_types_map
+    from calibre.customize.ui import available_input_formats, available_output_formats
+    from calibre.ebooks.conversion import plumber  # noqa: F401
+
+    available_input_formats(), available_output_formats()
+    css_parser.log.setLevel(logging.WARN)
+    get_types_map()
+    return os.getpid()
+
+
+def convert(args, cwd, log_path=None):
+    """
+    Run a conversion. args are the ebook-convert command line arguments,
+    without the program name. They are interpreted relative to cwd. The
+    conversion log is written to log_path, if specified.
+    """
+    from calibre.ebooks.conversion.cli import main
+
+    orig_cwd = os.getcwd()
+    start = time.monotonic()
+    with open(log_path or os.devnull, 'w', encoding='utf-8', errors='replace') as log:
+        try:
+            os.chdir(cwd)
+            with redirect_stdout(log), redirect_stderr(log):
+                try:
+                    rc = main(['ebook-convert'] + list(args))
+                except SystemExit as e:
+                    rc = 0 if e.code is None else e.code
+        finally:
+            os.chdir(orig_cwd)
+    return {'returncode': rc if isinstance(rc, int) else 1, 'duration': time.monotonic() - start, 'pid': os.getpid()}
+
+
+# }}}
+
+
+class Stats:
+    def __init__(self, num_recent=1000):
+        self.started_at = time.monotonic()
+        self.completed = self.failed = 0
+        self.total_latency = self.total_run_time = 0.0
+        self.recent = deque(maxlen=num_recent)
+        self.lock = Lock()
+
+    def record(self, job_stats, ok):
+        with self.lock:
+            if ok:
+                self.completed += 1
+            else:
+                self.failed += 1
+            self.total_latency += job_stats['latency']
+            self.total_run_time += job_stats['run_time']
+            self.recent.append(job_stats['latency'])
+
+    def as_dict(self):
+        with self.lock:
+            num = self.completed + self.failed
+            elapsed = time.monotonic() - self.started_at
+            recent = sorted(self.recent)
+
+            def percentile(p):
+                return recent[min(len(recent) - 1, int(p * len(recent)))] if recent else 0
+
+            return {
+                'uptime': elapsed,
+                'completed': self.completed,
+                'failed': self.failed,
+                'throughput': num / elapsed if elapsed > 0 else 0,
+                'mean_latency': self.total_latency / num if num else 0,
+                'mean_run_time': self.total_run_time / num if num else 0,
+                'median_latency': percentile(0.5),
+                'p95_latency': percentile(0.95),
+            }
+
+
+class ConversionService:
+    """
+    Accept conversion jobs over a local socket and run them in a pool of
+    worker processes. Use :meth:`serve_forever` to run the service and
+    :func:`shutdown_service` to stop it.
+
+    :param max_jobs_per_worker: Replace a worker process after it has run this many conversions
+    :param max_worker_memory: Replace a worker process once it uses more than this many MB of memory
+    :param authkey: The key clients must know to connect, defaults to :func:`service_authkey`
+    """
+
+    def __init__(
+        self,
+        address=None,
+        max_workers=None,
+        max_jobs_per_worker=DEFAULT_MAX_JOBS_PER_WORKER,
+        max_worker_memory=DEFAULT_MAX_WORKER_MEMORY,
+        authkey=None,
+    ):
+        from calibre.utils.ipc.pool import Pool
+
+        self.address = address or service_address()
+        self.authkey = authkey or service_authkey()
+        self.pool = Pool(
+            max_workers=max_workers,
+            name='ConversionService',
+            max_jobs_per_worker=max_jobs_per_worker,
+            max_worker_memory=None if max_worker_memory is None else max_worker_memory * 1024 * 1024,
+            worker_init=(__name__, 'warm_up'),
+        )
+        self.job_counter = count(1)
+        self.lock = Lock()
+        self.waiting = {}
+        self.stats = Stats()
+        self.shutdown_requested = Event()
+        self.dispatcher = Thread(target=self.dispatch_results, name='ConversionServiceResults', daemon=True)
+        self.dispatcher.start()
+
+    def submit(self, func, args):
+        job_id = next(self.job_counter)
+        q = Queue()
+        with self.lock:
+            self.waiting[job_id] = q
+        self.pool(job_id, __name__, func, *args)
+        return q
+
+    def dispatch_results(self):
+        pool = self.pool
+        while not self.shutdown_requested.is_set():
+            try:
+                wr = pool.results.get(True, 0.1)
+            except Empty:
+                if pool.failed:
+                    break
+                continue
+            pool.results.task_done()
+            with self.lock:
+                q = self.waiting.pop(wr.id, None)
+            if q is not None:
+                q.put(wr)
+        # Fail any jobs that are still waiting
+        with self.lock:
+            waiting, self.waiting = self.waiting, {}
+        for q in waiting.values():
+            q.put(None)
+
+    def run_job(self, args, cwd, log_path=None):
+        submitted_at = time.monotonic()
+        q = self.submit('convert', (args, cwd, log_path))
+        wr = q.get()
+        latency = time.monotonic() - submitted_at
+        run_time = 0
+        if wr is None or wr.is_terminal_failure:
+            ans = {'ok': False, 'error': 'The conversion worker process crashed', 'traceback': ''}
+        elif wr.result.err is not None:
+            ans = {'ok': False, 'error': wr.result.err, 'traceback': wr.result.traceback}
+        else:
+            result = wr.result.value
+            run_time = result['duration']
+            ans = {'ok': result['returncode'] == 0, 'returncode': result['returncode']}
+        ans['stats'] = job_stats = {'latency': latency, 'run_time': run_time, 'queue_time': max(0, latency - run_time)}
+        self.stats.record(job_stats, ans['ok'])
+        return ans
+
+    def stats_as_dict(self):
+        ans = self.stats.as_dict()
+        ans['workers_recycled'] = self.pool.workers_recycled
+        ans['max_workers'] = self.pool.max_workers
+        return ans
+
+    def handle_connection(self, conn):
+        from multiprocessing import AuthenticationError
+        from multiprocessing.connection import answer_challenge, deliver_challenge
+
+        with conn:
+            try:
+                # Done here rather than by the listener so that a client that
+                # never answers the challenge cannot block other clients
+                deliver_challenge(conn, self.authkey)
+                answer_challenge(conn, self.authkey)
+                request = conn.recv()
+            except AuthenticationError, EOFError, OSError:
+                return
+            action = request.get('action')
+            if action == 'convert':
+                response = self.run_job(request['args'], request['cwd'], request.get('log_path'))
+            elif action == 'stats':
+                response = self.stats_as_dict()
+            elif action == 'shutdown':
+                self.shutdown_requested.set()
+                response = {'ok': True}
+            else:
+                response = {'ok': False, 'error': f'Unknown action: {action}'}
+            with suppress(OSError):
+                conn.send(response)
+
+    def serve_forever(self):
+        if not iswindows and not self.address.startswith('\0'):
+            with suppress(FileNotFoundError):
+                os.remove(self.address)
+        with Listener(address=self.address) as listener:
+            while not self.shutdown_requested.is_set():
+                try:
+                    conn = listener.accept()
+                except Exception:
+                    if self.shutdown_requested.is_set():
+                        break
+                    import traceback
+
+                    traceback.print_exc()
+                    continue
+                if self.shutdown_requested.is_set():
+                    conn.close()
+                    break
+                Thread(target=self.handle_connection, args=(conn,), name='ConversionServiceConnection', daemon=True).start()
+        self.shutdown()
+
+    def shutdown(self):
+        self.shutdown_requested.set()
+        self.pool.shutdown()
+        self.dispatcher.join()
+
+
+# Client API {{{
+
+
+def send_request(request, address=None, authkey=None):
+    with Client(address or service_address(), authkey=authkey or service_authkey()) as conn:
+        conn.send(request)
+        return conn.recv()
+
+
+def convert_via_service(input_path, output_path, *extra_args, address=None, authkey=None, log_path=None):
+    """
+    Convert input_path to output_path using a running conversion service.
+    extra_args are ebook-convert command line options. Relative paths are
+    resolved with respect to the current working directory of the caller.
+    Returns a dictionary with the keys ok and stats, which contains the
+    latency, queue_time and run_time of the job in seconds.
+    """
+    args = [input_path, output_path] + list(extra_args)
+    if log_path is not None:
+        log_path = os.path.abspath(log_path)
+    return send_request({'action': 'convert', 'args': args, 'cwd': os.getcwd(), 'log_path': log_path}, address, authkey)
+
+
+def service_stats(address=None, authkey=None):
+    return send_request({'action': 'stats'}, address, authkey)
+
+
+def shutdown_service(address=None, authkey=None):
+    ans = send_request({'action': 'shutdown'}, address, authkey)
+    # Wake up the listener so that it notices the shutdown request
+    with suppress(OSError, EOFError):
+        Client(address or service_address()).close()
+    return ans
+
+
+# }}}
+
+
+def option_parser():
+    from calibre.utils.config import OptionParser
+
+    parser = OptionParser(
+        usage='''%prog [options]
+
+Run a conversion service that performs conversions submitted over a local
+socket in a pool of pre-started worker processes.'''
+    )
+    parser.add_option('--workers', type=int, default=None, help='Number of worker processes. Defaults to the number of CPU cores.')
+    parser.add_option(
+        '--max-jobs-per-worker',
+        type=int,
+        default=DEFAULT_MAX_JOBS_PER_WORKER,
+        help='Replace a worker process after it has performed this many conversions. Default: %default',
+    )
+    parser.add_option(
+        '--max-worker-memory',
+        type=int,
+        default=DEFAULT_MAX_WORKER_MEMORY,
+        help='Replace a worker process once it is using more than this many MB of memory. Default: %default',
+    )
+    parser.add_option('--address', default=None, help='The address of the socket to listen on. Defaults to a per-user local socket.')
+    return parser
+
+
+def main(args=sys.argv):
+    parser = option_parser()
+    opts, args = parser.parse_args(args)
+    service = ConversionService(
+        address=opts.address,
+        max_workers=opts.workers,
+        max_jobs_per_worker=opts.max_jobs_per_worker or None,
+        max_worker_memory=opts.max_worker_memory or None,
+    )
+    try:
+        service.serve_forever()
+    except KeyboardInterrupt:
+        service.shutdown()
+    return 0
+
+
+def find_tests():
+    import tempfile
+    import unittest
+    from multiprocessing import AuthenticationError
+
+    class ConversionServiceTest(unittest.TestCase):
+        def setUp(self):
+            self.tdir = tempfile.TemporaryDirectory()
+            if iswindows:
+                self.address = rf'\\.\pipe\CalibreConversionTest-{os.getpid()}'
+            else:
+                self.address = os.path.join(self.tdir.name, 'service.sock')
+            self.authkey = service_authkey(os.path.join(self.tdir.name, 'key'))
+            self.service = ConversionService(address=self.address, max_workers=1, authkey=self.authkey)
+            self.thread = Thread(target=self.service.serve_forever, daemon=True)
+            self.thread.start()
+
+        def tearDown(self):
+            if self.thread.is_alive():
+                shutdown_service(self.address, self.authkey)
+                self.thread.join(60)
+            self.tdir.cleanup()
+
+        def request(self, action):
+            return send_request({'action': action}, self.address, self.authkey)
+
+        def test_authkey(self):
+            path = os.path.join(self.tdir.name, 'key')
+            self.assertEqual(service_authkey(path), self.authkey)
+            self.assertEqual(len(self.authkey), AUTHKEY_SIZE)
+            if not iswindows:
+                self.assertEqual(os.stat(path).st_mode & 0o777, 0o600)
+
+        def test_unauthenticated_clients_rejected(self):
+            with self.assertRaises(AuthenticationError):
+                send_request({'action': 'shutdown'}, self.address, os.urandom(AUTHKEY_SIZE))
+            with self.assertRaises(Exception), Client(self.address) as conn:
+                conn.send({'action': 'shutdown'})
+                conn.recv()
+            self.assertFalse(self.service.shutdown_requested.is_set())
+            self.assertEqual(self.request('stats')['completed'], 0)
+
+        def test_convert(self):
+            src = os.path.join(self.tdir.name, 'book.txt')
+            with open(src, 'w') as f:
+                f.write('Some text\n\nMore text\n')
+            dest, log = os.path.join(self.tdir.name, 'book.epub'), os.path.join(self.tdir.name, 'log.txt')
+            ans = convert_via_service(src, dest, address=self.address, authkey=self.authkey, log_path=log)
+            with open(log) as f:
+                self.assertTrue(ans['ok'], f.read())
+            self.assertTrue(os.path.exists(dest))
+            self.assertGreater(ans['stats']['run_time'], 0)
+            stats = self.request('stats')
+            self.assertEqual((stats['completed'], stats['failed']), (1, 0))
+            self.assertEqual(self.request('shutdown'), {'ok': True})
+            with suppress(OSError, EOFError):
+                Client(self.address).close()
+            self.thread.join(60)
+            self.assertFalse(self.thread.is_alive())
+
+    return unittest.defaultTestLoader.loadTestsFromTestCase(ConversionServiceTest)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
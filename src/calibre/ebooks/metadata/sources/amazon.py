@@ -31,7 +31,7 @@
 from calibre import as_unicode, browser, random_user_agent, xml_replace_entities
 from calibre.ebooks.metadata import check_isbn
 from calibre.ebooks.metadata.book.base import Metadata
-from calibre.ebooks.metadata.sources.base import Option, Source, fixauthors, fixcase
+from calibre.ebooks.metadata.sources.base import Option, Source, connection_pool, fixauthors, fixcase
 from calibre.utils.icu import lower as icu_lower
 from calibre.utils.localization import canonicalize_lang
 from calibre.utils.random_ua import accept_header_for_ua
@@ -1165,6 +1165,8 @@ class Amazon(Source):
     has_html_comments = True
     supports_gzip_transfer_encoding = True
     prefer_results_with_isbn = False
+    # Amazon blocks clients that make too many requests
+    bulk_rate_limit = 0.5
 
     AMAZON_DOMAINS = {
         'com': _('US'),
@@ -1287,6 +1289,8 @@ def browser(self):
             # ua = 'Mozilla/5.0 (Linux; Android 8.0.0; VTR-L29; rv:63.0) Gecko/20100101 Firefox/63.0'
             self._browser = br = browser(user_agent=ua)
             br.set_handle_gzip(True)
+            if not self.running_a_test:
+                br.set_connection_pool(connection_pool())
             if self.use_search_engine:
                 br.addheaders += [
                     ('Accept', accept_header_for_ua(ua)),
@@ -15,6 +15,27 @@
 from calibre.utils.localization import _, canonicalize_lang, get_lang
 from polyglot.builtins import cmp, iteritems
 
+_connection_pool = None
+_connection_pool_lock = threading.Lock()
+
+
+def connection_pool():
+    """
+    The pool of keep-alive connections and the on-disk HTTP cache shared by
+    the browsers of all metadata sources in this process.
+    """
+    global _connection_pool
+    with _connection_pool_lock:
+        if _connection_pool is None:
+            import os
+
+            from calibre.constants import cache_dir
+            from calibre.utils.http_cache import ConnectionPool, HTTPCache
+
+            cache = HTTPCache(os.path.join(cache_dir(), 'metadata-sources-http'))
+            _connection_pool = ConnectionPool(cache=cache)
+        return _connection_pool
+
 
 def create_log(ostream=None):
     from calibre.utils.logging import FileStream, ThreadSafeLog
@@ -235,6 +256,21 @@ class Source(Plugin):
     #: ISBNs will be ignored
     prefer_results_with_isbn = True
 
+    #: The maximum number of identify and cover downloads from this source
+    #: that run at the same time when downloading metadata for many books
+    bulk_concurrency = 1
+
+    #: The maximum number of identify and cover downloads from this source
+    #: started per second when downloading metadata for many books. None
+    #: means no limit.
+    bulk_rate_limit = None
+
+    #: If True, responses from this source without Cache-Control or Expires
+    #: headers are reused for the time set in the http_cache_ttl preference.
+    #: Only set this for sources that never return different content, such
+    #: as error or bot check pages, for the same URL.
+    cache_unmarked_responses = False
+
     def __init__(self, *args, **kwargs):
         Plugin.__init__(self, *args, **kwargs)
         self.running_a_test = False  # Set to True when using identify_test()
@@ -294,6 +330,10 @@ def browser(self):
             self._browser = browser(user_agent=self.user_agent, verify_ssl_certificates=not self.ignore_ssl_errors)
             if self.supports_gzip_transfer_encoding:
                 self._browser.set_handle_gzip(True)
+            if not self.running_a_test:
+                from calibre.ebooks.metadata.sources.prefs import msprefs
+
+                self._browser.set_connection_pool(connection_pool(), cache_default_ttl=msprefs['http_cache_ttl'] if self.cache_unmarked_responses else 0)
         return self._browser.clone_browser()
 
     # }}}
@@ -18,7 +18,7 @@
 
 
 class Worker(Thread):
-    def __init__(self, plugin, abort, title, authors, identifiers, timeout, rq, get_best_cover=False):
+    def __init__(self, plugin, abort, title, authors, identifiers, timeout, rq, get_best_cover=False, scheduler=None):
         Thread.__init__(self)
         self.daemon = True
 
@@ -30,9 +30,17 @@ def __init__(self, plugin, abort, title, authors, identifiers, timeout, rq, get_
         self.title, self.authors, self.identifiers = (title, authors, identifiers)
         self.timeout, self.rq = timeout, rq
         self.time_spent = None
+        self.scheduler = scheduler
 
     def run(self):
+        if self.scheduler is None:
+            self.download()
+        else:
+            self.scheduler.run(self.plugin, self.abort, self.download)
+
+    def download(self):
         start_time = time.time()
+        ok = False
         if not self.abort.is_set():
             try:
                 if self.plugin.can_get_multiple_covers:
@@ -56,9 +64,11 @@ def run(self):
                         identifiers=self.identifiers,
                         timeout=self.timeout,
                     )
+                ok = True
             except Exception:
                 self.log.exception('Failed to download cover from', self.plugin.name)
         self.time_spent = time.time() - start_time
+        return ok
 
 
 def is_worker_alive(workers):
@@ -88,7 +98,7 @@ def process_result(log, result):
     return (plugin, width, height, fmt, data)
 
 
-def run_download(log, results, abort, title=None, authors=None, identifiers={}, timeout=30, get_best_cover=False):
+def run_download(log, results, abort, title=None, authors=None, identifiers={}, timeout=30, get_best_cover=False, scheduler=None):
     """
     Run the cover download, putting results into the queue :param:`results`.
 
@@ -105,7 +115,7 @@ def run_download(log, results, abort, title=None, authors=None, identifiers={},
     plugins = [p for p in metadata_plugins(['cover']) if p.is_configured()]
 
     rq = Queue()
-    workers = [Worker(p, abort, title, authors, identifiers, timeout, rq, get_best_cover=get_best_cover) for p in plugins]
+    workers = [Worker(p, abort, title, authors, identifiers, timeout, rq, get_best_cover=get_best_cover, scheduler=scheduler) for p in plugins]
     for w in workers:
         w.start()
 
@@ -165,7 +175,7 @@ def run_download(log, results, abort, title=None, authors=None, identifiers={},
         log('\n' + '*' * 80)
 
 
-def download_cover(log, title=None, authors=None, identifiers={}, timeout=30):
+def download_cover(log, title=None, authors=None, identifiers={}, timeout=30, scheduler=None):
     '''
     Synchronous cover download. Returns the "best" cover as per user
     prefs/cover resolution.
@@ -177,7 +187,7 @@ def download_cover(log, title=None, authors=None, identifiers={}, timeout=30):
     rq = Queue()
     abort = Event()
 
-    run_download(log, rq, abort, title=title, authors=authors, identifiers=identifiers, timeout=timeout, get_best_cover=True)
+    run_download(log, rq, abort, title=title, authors=authors, identifiers=identifiers, timeout=timeout, get_best_cover=True, scheduler=scheduler)
 
     results = []
 
@@ -9,7 +9,7 @@
 from datetime import datetime
 from io import StringIO
 from operator import attrgetter
-from threading import Thread
+from threading import Event, Thread
 
 from calibre.customize.ui import all_metadata_plugins, metadata_plugins
 from calibre.ebooks.metadata import authors_to_sort_string, check_issn
@@ -29,23 +29,51 @@
 # Download worker {{{
 
 
+class ResultQueue(Queue):
+    def __init__(self, notify):
+        Queue.__init__(self)
+        self.notify = notify
+
+    def _put(self, item):
+        Queue._put(self, item)
+        self.notify()
+
+
 class Worker(Thread):
-    def __init__(self, plugin, kwargs, abort):
+    def __init__(self, plugin, kwargs, abort, notify=lambda: None, scheduler=None):
         Thread.__init__(self)
         self.daemon = True
 
-        self.plugin, self.kwargs, self.rq = plugin, kwargs, Queue()
-        self.abort = abort
+        self.plugin, self.kwargs, self.rq = plugin, kwargs, ResultQueue(notify)
+        self.abort, self.notify, self.scheduler = abort, notify, scheduler
         self.buf = StringIO()
         self.log = create_log(self.buf)
+        self.time_spent = None
+        # Whether the download has been allowed to start by the scheduler
+        self.started = scheduler is None
+        self.finished = False
 
     def run(self):
+        try:
+            if self.scheduler is None:
+                self.identify()
+            else:
+                self.scheduler.run(self.plugin, self.abort, self.identify)
+        finally:
+            self.finished = True
+            self.notify()
+
+    def identify(self):
+        self.started = True
+        self.notify()
         start = time.time()
         try:
-            self.plugin.identify(self.log, self.rq, self.abort, **self.kwargs)
+            ok = not self.plugin.identify(self.log, self.rq, self.abort, **self.kwargs)
         except Exception:
             self.log.exception('Plugin', self.plugin.name, 'failed')
-        self.plugin.dl_time_spent = time.time() - start
+            ok = False
+        self.time_spent = self.plugin.dl_time_spent = time.time() - start
+        return ok
 
     @property
     def name(self):
@@ -363,6 +391,7 @@ def identify(
     identifiers={},
     timeout=30,
     allowed_plugins=None,
+    scheduler=None,
 ):
     if title == _('Unknown'):
         title = None
@@ -384,11 +413,12 @@ def identify(
     log('Using plugins:', ', '.join(['%s %s' % (p.name, p.version) for p in plugins]))
     log('The log from individual plugins is below')
 
-    workers = [Worker(p, kwargs, abort) for p in plugins]
+    changed = Event()
+    workers = [Worker(p, kwargs, abort, changed.set, scheduler) for p in plugins]
     for w in workers:
         w.start()
 
-    first_result_at = None
+    first_result_at = all_started_at = None
     results = {}
     for p in plugins:
         results[p] = []
@@ -408,24 +438,32 @@ def get_results():
 
     wait_time = msprefs['wait_after_first_identify_result']
     while True:
-        time.sleep(0.2)
-
         if get_results() and first_result_at is None:
             first_result_at = time.time()
+        if all_started_at is None and all(w.started or w.finished for w in workers):
+            all_started_at = time.time()
 
-        if not is_worker_alive(workers):
+        if all(w.finished for w in workers):
             break
 
-        if first_result_at is not None and time.time() - first_result_at > wait_time:
-            log.warn('Not waiting any longer for more results. Still running sources:')
-            for worker in workers:
-                if worker.is_alive():
-                    log.debug('\t' + worker.name)
-            abort.set()
-            break
+        # When a scheduler is used, the wait after the first result only
+        # starts once every source has been allowed to start its download
+        timeout = None
+        if first_result_at is not None and all_started_at is not None:
+            timeout = max(first_result_at, all_started_at) + wait_time - time.time()
+            if timeout <= 0:
+                log.warn('Not waiting any longer for more results. Still running sources:')
+                for worker in workers:
+                    if not worker.finished:
+                        log.debug('\t' + worker.name)
+                abort.set()
+                break
+        changed.wait(timeout)
+        changed.clear()
 
     while not abort.is_set() and get_results():
         pass
+    time_spent_map = {w.plugin: w.time_spent for w in workers}
 
     sort_kwargs = dict(kwargs)
     for k in list(sort_kwargs):
@@ -450,7 +488,7 @@ def get_results():
         plog = logs[plugin].getvalue().strip()
         log('\n' + '*' * 30, plugin.name, '%s' % (plugin.version,), '*' * 30)
         log('Found %d results' % len(presults))
-        time_spent = getattr(plugin, 'dl_time_spent', None)
+        time_spent = time_spent_map[plugin]
         if time_spent is None:
             log('Downloading was aborted')
             longest, lp = -1, plugin.name
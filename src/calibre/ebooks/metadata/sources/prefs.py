@@ -23,6 +23,9 @@
 msprefs.defaults['series_map_rules'] = ()
 msprefs.defaults['id_link_rules'] = {}
 msprefs.defaults['keep_dups'] = False
+# How long downloaded pages without explicit cache headers are reused for, by
+# sources that opt in with cache_unmarked_responses
+msprefs.defaults['http_cache_ttl'] = 24 * 60 * 60  # seconds
 
 # Google covers are often poor quality (scans/errors) but they have high
 # resolution, so they trump covers from better sources. So make sure they
@@ -0,0 +1,239 @@
+#!/usr/bin/env python
+# License: GPLv3 Copyright: 2026, Kovid Goyal <kovid at kovidgoyal.net>
+
+"""
+Scheduling of metadata downloads for many books at once. Books are processed
+concurrently in a pool of threads, while the number of simultaneous downloads
+from each source and the rate at which they are started are limited by the
+bulk_concurrency and bulk_rate_limit attributes of the source. Identical
+queries are only run once.
+"""
+
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from threading import Lock, Semaphore
+
+
+class TokenBucket:
+    """
+    Allows rate operations per second on average, with bursts of up to burst
+    operations.
+    """
+
+    def __init__(self, rate, burst=1):
+        self.rate, self.burst = rate, max(1, burst)
+        self.tokens = float(self.burst)
+        self.last = time.monotonic()
+        self.lock = Lock()
+
+    def acquire(self, abort):
+        """Wait for a token, returns False if abort is set while waiting."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+                wait = (1 - self.tokens) / self.rate
+            if abort.wait(wait):
+                return False
+
+
+class SourceLimiter:
+    def __init__(self, name, concurrency=1, rate=None):
+        self.name = name
+        self.slots = Semaphore(max(1, concurrency))
+        self.bucket = None if not rate else TokenBucket(rate, burst=concurrency)
+        self.lock = Lock()
+        self.calls = self.errors = self.aborted = 0
+        self.total_time = self.max_time = self.total_wait = 0.0
+
+    def admit(self, abort):
+        """Wait until a download from this source can start, returns False if abort is set while waiting."""
+        start = time.monotonic()
+        while not self.slots.acquire(timeout=0.5):
+            if abort.is_set():
+                return False
+        if self.bucket is not None and not self.bucket.acquire(abort):
+            self.slots.release()
+            return False
+        with self.lock:
+            self.total_wait += time.monotonic() - start
+        return True
+
+    def release(self, elapsed, ok):
+        self.slots.release()
+        with self.lock:
+            self.calls += 1
+            self.errors += 0 if ok else 1
+            self.total_time += elapsed
+            self.max_time = max(self.max_time, elapsed)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'calls': self.calls,
+                'errors': self.errors,
+                'aborted': self.aborted,
+                'total_time': self.total_time,
+                'max_time': self.max_time,
+                'total_wait': self.total_wait,
+            }
+
+
+class Scheduler:
+    """
+    :param max_books: The maximum number of books that are processed at the same time
+    """
+
+    def __init__(self, max_books=4):
+        self.max_books = max_books
+        self.executor = ThreadPoolExecutor(max_books, thread_name_prefix='MetadataDownload')
+        self.lock = Lock()
+        self.limiters = {}
+        self.queries = {}
+
+    def limiter(self, plugin):
+        with self.lock:
+            ans = self.limiters.get(plugin.name)
+            if ans is None:
+                ans = self.limiters[plugin.name] = SourceLimiter(plugin.name, plugin.bulk_concurrency, plugin.bulk_rate_limit)
+            return ans
+
+    def run(self, plugin, abort, func):
+        """
+        Run func(), a download from the source plugin, once the limits for the
+        source allow it. func must return True if the download succeeded.
+        Returns False if abort was set before the download could start.
+        """
+        limiter = self.limiter(plugin)
+        if not limiter.admit(abort):
+            with limiter.lock:
+                limiter.aborted += 1
+            return False
+        start, ok = time.monotonic(), False
+        try:
+            ok = func()
+        finally:
+            limiter.release(time.monotonic() - start, ok)
+        return True
+
+    def submit(self, func, *args, **kwargs):
+        return self.executor.submit(func, *args, **kwargs)
+
+    def once(self, key, func, *args, **kwargs):
+        """
+        Return a future for the result of func(). If a function has already
+        been submitted with the same key, its future is returned instead.
+        """
+        with self.lock:
+            ans = self.queries.get(key)
+            if ans is None:
+                ans = self.queries[key] = Future()
+                run = True
+            else:
+                run = False
+        if run:
+            try:
+                ans.set_result(func(*args, **kwargs))
+            except BaseException as e:
+                ans.set_exception(e)
+        return ans
+
+    def stats(self):
+        """Return a mapping of source name to download statistics."""
+        with self.lock:
+            limiters = tuple(self.limiters.values())
+        return {lim.name: lim.stats() for lim in limiters}
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+
+
+def merge_stats(stats, other):
+    for name, s in other.items():
+        t = stats.setdefault(name, dict.fromkeys(s, 0))
+        for k, v in s.items():
+            t[k] = max(t[k], v) if k == 'max_time' else t[k] + v
+    return stats
+
+
+def format_stats(stats):
+    lines = []
+    for name, s in sorted(stats.items()):
+        avg = s['total_time'] / s['calls'] if s['calls'] else 0
+        lines.append(
+            f'{name}: {s["calls"]} downloads, {s["errors"]} errors, {s["aborted"]} aborted,'
+            f' average time: {avg:.2f}s, longest time: {s["max_time"]:.2f}s, time spent waiting: {s["total_wait"]:.2f}s'
+        )
+    return '\n'.join(lines)
+
+
+def find_tests():
+    import unittest
+    from threading import Event, Thread
+
+    class Plugin:
+        def __init__(self, name, concurrency, rate):
+            self.name, self.bulk_concurrency, self.bulk_rate_limit = name, concurrency, rate
+
+    class SchedulerTest(unittest.TestCase):
+        def test_token_bucket(self):
+            b = TokenBucket(50, burst=2)
+            abort = Event()
+            st = time.monotonic()
+            for i in range(7):
+                self.assertTrue(b.acquire(abort))
+            self.assertGreater(time.monotonic() - st, 4 / 50)
+            b = TokenBucket(0.001)
+            self.assertTrue(b.acquire(abort))
+            abort.set()
+            self.assertFalse(b.acquire(abort))
+
+        def test_limits(self):
+            s = Scheduler(max_books=8)
+            p = Plugin('p', 2, None)
+            lock = Lock()
+            running = []
+            peak = [0]
+
+            def work(ok):
+                with lock:
+                    running.append(1)
+                    peak[0] = max(peak[0], len(running))
+                time.sleep(0.02)
+                with lock:
+                    running.pop()
+                return ok
+
+            abort = Event()
+            futures = [s.submit(s.run, p, abort, lambda i=i: work(i % 3 != 0)) for i in range(9)]
+            self.assertTrue(all(f.result() for f in futures))
+            self.assertEqual(peak[0], 2)
+            stats = s.stats()['p']
+            self.assertEqual((stats['calls'], stats['errors']), (9, 3))
+            self.assertIn('p: 9 downloads, 3 errors', format_stats(merge_stats({}, s.stats())))
+            s.shutdown()
+
+        def test_once(self):
+            s = Scheduler()
+            calls = []
+
+            def query(x):
+                time.sleep(0.02)
+                calls.append(x)
+                return x * 2
+
+            futures = []
+            threads = [Thread(target=lambda: futures.append(s.once('k', query, 21))) for i in range(4)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            self.assertEqual([f.result() for f in futures], [42] * 4)
+            self.assertEqual(calls, [21])
+            s.shutdown()
+
+    return unittest.defaultTestLoader.loadTestsFromTestCase(SchedulerTest)
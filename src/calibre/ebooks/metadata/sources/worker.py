@@ -13,6 +13,7 @@
 from calibre.ebooks.metadata.sources.base import dump_caches, load_caches
 from calibre.ebooks.metadata.sources.covers import download_cover, run_download
 from calibre.ebooks.metadata.sources.identify import identify, msprefs
+from calibre.ebooks.metadata.sources.scheduler import Scheduler
 from calibre.ebooks.metadata.sources.update import patch_plugins
 from calibre.utils.date import as_utc
 from calibre.utils.localization import _
@@ -63,52 +64,96 @@ def wrapper(*a, **k):
     return wrapper
 
 
+def query_key(title, authors, identifiers):
+    return title, tuple(authors or ()), tuple(sorted((identifiers or {}).items()))
+
+
+def run_identify(scheduler, title, authors, identifiers):
+    log = GUILog()
+    try:
+        results = identify(log, Event(), title=title, authors=authors, identifiers=identifiers, scheduler=scheduler)
+    except Exception:
+        log.exception('Failed to download metadata for', title)
+        results = []
+    return results, log.plain_text
+
+
+def run_cover_download(scheduler, title, authors, identifiers):
+    log = GUILog()
+    cdata = download_cover(log, title=title, authors=authors, identifiers=identifiers, scheduler=scheduler)
+    return cdata, log.plain_text
+
+
+def process_book(scheduler, do_identify, covers, ensure_fields, tdir, book_id, mi):
+    # Returns whether identify failed, whether the cover download failed and
+    # whether anything was downloaded
+    mi = OPF(BytesIO(mi), basedir=tdir, populate_spine=False).to_book_metadata()
+    title, authors, identifiers = mi.title, mi.authors, mi.identifiers
+    failed_identify = failed_cover = False
+    downloaded = False
+    logs = []
+
+    if do_identify:
+        results, text = scheduler.once(('identify',) + query_key(title, authors, identifiers), run_identify, scheduler, title, authors, identifiers).result()
+        logs.append(text)
+        if results:
+            downloaded = True
+            mi = merge_result(mi, results[0].deepcopy_metadata(), ensure_fields=ensure_fields)
+            identifiers = mi.identifiers
+            if not mi.is_null('rating'):
+                # set_metadata expects a rating out of 10
+                mi.rating *= 2
+            with open(os.path.join(tdir, '%d.mi' % book_id), 'wb') as f:
+                f.write(metadata_to_opf(mi, default_lang='und'))
+        else:
+            logs.append(f'Failed to download metadata for {title}')
+            failed_identify = True
+
+    if covers:
+        cdata, text = scheduler.once(('cover',) + query_key(title, authors, identifiers), run_cover_download, scheduler, title, authors, identifiers).result()
+        logs.append(text)
+        if cdata is None:
+            failed_cover = True
+        else:
+            with open(os.path.join(tdir, '%d.cover' % book_id), 'wb') as f:
+                f.write(cdata[-1])
+            downloaded = True
+
+    with open(os.path.join(tdir, '%d.log' % book_id), 'wb') as f:
+        f.write('\n'.join(logs).encode('utf-8'))
+    return failed_identify, failed_cover, downloaded
+
+
 @shutdown_webengine_workers
 def main(do_identify, covers, metadata, ensure_fields, tdir):
+    """
+    Download metadata and/or covers for the books in metadata, a mapping of
+    book id to OPF data, several books at a time. Returns the ids of the books
+    for which identify failed, the ids of the books for which no cover was
+    found, whether nothing at all was downloaded and the download statistics
+    for each source.
+    """
     failed_ids = set()
     failed_covers = set()
     all_failed = True
-    log = GUILog()
     patch_plugins()
-
-    for book_id, mi in iteritems(metadata):
-        mi = OPF(BytesIO(mi), basedir=tdir, populate_spine=False).to_book_metadata()
-        title, authors, identifiers = mi.title, mi.authors, mi.identifiers
-        cdata = None
-        log.clear()
-
-        if do_identify:
-            results = []
-            try:
-                results = identify(log, Event(), title=title, authors=authors, identifiers=identifiers)
-            except Exception:
-                pass
-            if results:
-                all_failed = False
-                mi = merge_result(mi, results[0], ensure_fields=ensure_fields)
-                identifiers = mi.identifiers
-                if not mi.is_null('rating'):
-                    # set_metadata expects a rating out of 10
-                    mi.rating *= 2
-                with open(os.path.join(tdir, '%d.mi' % book_id), 'wb') as f:
-                    f.write(metadata_to_opf(mi, default_lang='und'))
-            else:
-                log.error('Failed to download metadata for', title)
+    scheduler = Scheduler()
+    try:
+        futures = {
+            book_id: scheduler.submit(process_book, scheduler, do_identify, covers, ensure_fields, tdir, book_id, mi) for book_id, mi in iteritems(metadata)
+        }
+        for book_id, future in iteritems(futures):
+            failed_identify, failed_cover, downloaded = future.result()
+            if failed_identify:
                 failed_ids.add(book_id)
-
-        if covers:
-            cdata = download_cover(log, title=title, authors=authors, identifiers=identifiers)
-            if cdata is None:
+            if failed_cover:
                 failed_covers.add(book_id)
-            else:
-                with open(os.path.join(tdir, '%d.cover' % book_id), 'wb') as f:
-                    f.write(cdata[-1])
+            if downloaded:
                 all_failed = False
+    finally:
+        scheduler.shutdown()
 
-        with open(os.path.join(tdir, '%d.log' % book_id), 'wb') as f:
-            f.write(log.plain_text.encode('utf-8'))
-
-    return failed_ids, failed_covers, all_failed
+    return failed_ids, failed_covers, all_failed, scheduler.stats()
 
 
 @shutdown_webengine_workers
@@ -253,7 +253,9 @@ def __init__(self, rootpath=None, opfpath=None, log=default_log, clone_data=None
         self.dirtied = set()
         self.pretty_print = set()
         self.cloned = False
-        self.cache_names = ('parsed_cache', 'mime_map', 'name_path_map', 'encoding_map', 'dirtied', 'pretty_print')
+        # Map of name to the set of names it links to, see link_targets()
+        self.link_targets_cache = {}
+        self.cache_names = ('parsed_cache', 'mime_map', 'name_path_map', 'encoding_map', 'dirtied', 'pretty_print', 'link_targets_cache')
         self.href_to_name_cache = {}
 
         if clone_data is not None:
@@ -514,6 +516,33 @@ def iterlinks(self, name, get_line_numbers=True):
             for elem in self.parsed(name).xpath('//*[@src]'):
                 yield (elem.get('src'), elem.sourceline, 0) if get_line_numbers else elem.get('src')
 
+    def link_targets(self, name):
+        """Return the set of canonical names of the files that name links to.
+        The result is cached and the cache is invalidated whenever name is
+        changed, so this is cheap to call repeatedly. Same file links
+        (fragments only) and links to external resources are not included."""
+        ans = self.link_targets_cache.get(name)
+        if ans is None:
+            targets = set()
+            for href in self.iterlinks(name, get_line_numbers=False):
+                if href and not href.startswith('#'):
+                    try:
+                        target = self.href_to_name(href, name)
+                    except ValueError:
+                        continue
+                    if target:
+                        targets.add(target)
+            self.link_targets_cache[name] = ans = frozenset(targets)
+        return ans
+
+    def names_linking_to(self, names):
+        """Return the set of names of files in this container that have at
+        least one link to a file in names. Uses the cached index from
+        :meth:`link_targets` so that only files that changed since the
+        last call are re-scanned."""
+        names = frozenset(names)
+        return {name for name in tuple(self.mime_map) if not self.link_targets(name).isdisjoint(names)}
+
     def abspath_to_name(self, fullpath, root=None):
         """
         Convert an absolute path to a canonical name relative to :attr:`root`
@@ -911,6 +940,7 @@ def remove_item(self, name, remove_from_guide=True):
             os.remove(path)
         self.mime_map.pop(name, None)
         self.parsed_cache.pop(name, None)
+        self.link_targets_cache.pop(name, None)
         self.dirtied.discard(name)
 
     def set_media_overlay_durations(self, duration_map=None):
@@ -932,6 +962,7 @@ def set_media_overlay_durations(self, duration_map=None):
     def dirty(self, name):
         """Mark the parsed object corresponding to name as dirty. See also: :meth:`parsed`."""
         self.dirtied.add(name)
+        self.link_targets_cache.pop(name, None)
 
     def remove_from_xml(self, item):
         "Removes item from parent, fixing indentation (works only with self closing items)"
@@ -1070,6 +1101,8 @@ def get_file_path_for_processing(self, name, allow_modification=True):
         if name in self.dirtied:
             self.commit_item(name)
         self.parsed_cache.pop(name, False)
+        if allow_modification:
+            self.link_targets_cache.pop(name, None)
         path = self.name_to_abspath(name)
         base = os.path.dirname(path)
         if not os.path.exists(base):
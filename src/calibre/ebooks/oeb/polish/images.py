@@ -4,6 +4,7 @@
 import os
 import tempfile
 from functools import partial
+from itertools import count
 from queue import Empty, Queue
 from threading import Event, Thread
 
@@ -11,6 +12,9 @@
 from calibre.utils.filenames import atomic_rename
 from calibre.utils.localization import _, ngettext
 
+# Below this number of images, starting worker processes costs more than it saves
+MIN_IMAGES_FOR_POOL = 8
+
 
 class Worker(Thread):
     daemon = True
@@ -46,29 +50,161 @@ def run(self):
                 self.queue.task_done()
 
     def compress(self, name, path, mime_type):
-        from calibre.utils.img import encode_jpeg, encode_webp, optimize_jpeg, optimize_png, optimize_webp
+        self.results[name] = (True, compress_image(path, mime_type, self.jpeg_quality, self.webp_quality))
 
-        if 'png' in mime_type:
-            func = optimize_png
-        elif 'webp' in mime_type:
-            if self.webp_quality is None:
-                func = optimize_webp
-            else:
-                func = partial(encode_webp, quality=self.jpeg_quality)
-        elif self.jpeg_quality is None:
-            func = optimize_jpeg
+
+def compress_image(path, mime_type, jpeg_quality=None, webp_quality=None):
+    """
+    Compress the image at path in place. Returns the size of the file before
+    and after compression. The file is left unchanged if compression does not
+    reduce its size.
+    """
+    from calibre.utils.img import encode_jpeg, encode_webp, optimize_jpeg, optimize_png, optimize_webp
+
+    if 'png' in mime_type:
+        func = optimize_png
+    elif 'webp' in mime_type:
+        if webp_quality is None:
+            func = optimize_webp
         else:
-            func = partial(encode_jpeg, quality=self.jpeg_quality)
-        before = os.path.getsize(path)
-        with open(path, 'rb') as f:
-            old_data = f.read()
-        func(path)
+            func = partial(encode_webp, quality=jpeg_quality)
+    elif jpeg_quality is None:
+        func = optimize_jpeg
+    else:
+        func = partial(encode_jpeg, quality=jpeg_quality)
+    before = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        old_data = f.read()
+    func(path)
+    after = os.path.getsize(path)
+    if after >= before:
+        with open(path, 'wb') as f:
+            f.write(old_data)
+        after = before
+    return before, after
+
+
+class ImageCompressionPool:
+    """
+    Compress images using a pool of worker processes, for use with
+    :func:`compress_images`. Unlike the default thread based workers, this
+    is not limited by the GIL. The same pool can be used for many books, in
+    which case the worker processes are re-used and images that are
+    byte-for-byte identical across books, such as publisher logos, are only
+    compressed once. Call :meth:`shutdown` when done, or use the pool as a
+    context manager.
+    """
+
+    def __init__(self, max_workers=None, max_cache_size=64 * 1024 * 1024):
+        self.max_workers = max_workers or detect_ncpus()
+        self.max_cache_size = max_cache_size
+        self.pool = None
+        self.cache = {}
+        self.cache_size = 0
+        self.cache_hits = 0
+        # Never re-used, so that a late result from a job of an earlier,
+        # cancelled run cannot be mistaken for the result of a new job
+        self.job_ids = count()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *a):
+        self.shutdown()
+
+    def shutdown(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+        self.cache.clear()
+        self.cache_size = 0
+
+    def cache_result(self, key, before, path):
         after = os.path.getsize(path)
-        if after >= before:
-            with open(path, 'wb') as f:
-                f.write(old_data)
-            after = before
-        self.results[name] = (True, (before, after))
+        data = None
+        if after < before:
+            if self.cache_size + after > self.max_cache_size:
+                return
+            with open(path, 'rb') as f:
+                data = f.read()
+            self.cache_size += len(data)
+        self.cache[key] = before, data
+
+    def apply_cached(self, key, path):
+        before, data = self.cache[key]
+        self.cache_hits += 1
+        if data is None:
+            return before, before
+        with open(path, 'wb') as f:
+            f.write(data)
+        return before, len(data)
+
+    def __call__(self, items, results, jpeg_quality=None, webp_quality=None, progress_callback=lambda name: True):
+        """
+        Compress the images specified by items, a list of (name, path,
+        mime_type) tuples, storing results for each name in results, in the
+        same form as :func:`compress_images`.
+        """
+        import hashlib
+
+        from calibre.utils.ipc.pool import Failure, Pool
+
+        in_flight, waiting = {}, {}
+        keep_going = True
+        for name, path, mt in items:
+            with open(path, 'rb') as f:
+                key = hashlib.sha1(f.read()).hexdigest(), mt, jpeg_quality, webp_quality
+            if key in self.cache:
+                results[name] = (True, self.apply_cached(key, path))
+                if not progress_callback(name):
+                    keep_going = False
+                    break
+                continue
+            if key in waiting:
+                # Identical image already scheduled, re-use its result
+                waiting[key].append((name, path))
+                continue
+            waiting[key] = []
+            if self.pool is None:
+                self.pool = Pool(max_workers=self.max_workers, name='CompressImages')
+            job_id = next(self.job_ids)
+            in_flight[job_id] = name, path, key
+            self.pool(job_id, 'calibre.ebooks.oeb.polish.images', 'compress_image', path, mt, jpeg_quality, webp_quality)
+
+        while in_flight:
+            try:
+                wr = self.pool.results.get(True, 0.1)
+            except Empty:
+                if self.pool.failed:
+                    raise Failure(self.pool.terminal_failure)
+                continue
+            self.pool.results.task_done()
+            if wr.is_terminal_failure:
+                raise Failure(self.pool.terminal_failure)
+            if wr.id not in in_flight:
+                continue
+            name, path, key = in_flight.pop(wr.id)
+            duplicates = waiting.pop(key)
+            if wr.result.err is None:
+                before, after = wr.result.value
+                results[name] = (True, (before, after))
+                self.cache_result(key, before, path)
+                for dname, dpath in duplicates:
+                    if key in self.cache:
+                        results[dname] = (True, self.apply_cached(key, dpath))
+                    else:
+                        results[dname] = (True, compress_image(dpath, key[1], jpeg_quality, webp_quality))
+            else:
+                results[name] = (False, wr.result.traceback)
+                for dname, dpath in duplicates:
+                    results[dname] = (False, wr.result.traceback)
+            if keep_going:
+                for n in [name] + [d[0] for d in duplicates]:
+                    if not progress_callback(n):
+                        # Cannot cancel jobs already sent to the workers, so
+                        # just wait for them to finish
+                        keep_going = False
+                        break
 
 
 def get_compressible_images(container):
@@ -271,7 +407,15 @@ def compress_images(
     png_to_format=None,
     gif_to_format=None,
     progress_callback=lambda n, t, name: True,
+    pool=None,
 ):
+    """
+    Losslessly compress the images in the container, optionally converting
+    PNG and GIF images to other formats first. If pool is an
+    :class:`ImageCompressionPool` it is used to do the compression in worker
+    processes. Otherwise a pool is created for books with many images and a
+    thread per CPU core is used for the rest.
+    """
     images = get_compressible_images(container)
     if names is not None:
         images &= set(names)
@@ -322,14 +466,14 @@ def compress_images(
     queue = Queue()
     abort = Event()
     seen = set()
-    num_to_process = 0
+    to_process = []
     for name in sorted(images):
         path = os.path.abspath(container.get_file_path_for_processing(name))
         path_key = os.path.normcase(path)
         if path_key not in seen:
-            num_to_process += 1
-            queue.put((name, path, container.mime_map[name]))
+            to_process.append((name, path, container.mime_map[name]))
             seen.add(path_key)
+    num_to_process = len(to_process)
 
     def pc(name):
         keep_going = progress_callback(len(results), num_to_process, name)
@@ -337,8 +481,25 @@ def pc(name):
             abort.set()
 
     progress_callback(0, num_to_process, '')
-    [Worker(abort, f'CompressImage{i}', queue, results, jpeg_quality, webp_quality, pc) for i in range(min(detect_ncpus(), num_to_process))]
-    queue.join()
+    own_pool = None
+    if pool is None and num_to_process >= MIN_IMAGES_FOR_POOL:
+        pool = own_pool = ImageCompressionPool(max_workers=min(detect_ncpus(), num_to_process))
+    if pool is None:
+        for item in to_process:
+            queue.put(item)
+        [Worker(abort, f'CompressImage{i}', queue, results, jpeg_quality, webp_quality, pc) for i in range(min(detect_ncpus(), num_to_process))]
+        queue.join()
+    else:
+
+        def ppc(name):
+            pc(name)
+            return not abort.is_set()
+
+        try:
+            pool(to_process, results, jpeg_quality=jpeg_quality, webp_quality=webp_quality, progress_callback=ppc)
+        finally:
+            if own_pool is not None:
+                own_pool.shutdown()
     before_total = after_total = 0
     processed_num = 0
     changed = conv_num > 0 or gif_conv_num > 0
@@ -13,7 +13,7 @@
 from calibre.ebooks.oeb.polish.download import download_external_resources, get_external_resources, replace_resources
 from calibre.ebooks.oeb.polish.embed import embed_all_fonts
 from calibre.ebooks.oeb.polish.hyphenation import add_soft_hyphens, remove_soft_hyphens
-from calibre.ebooks.oeb.polish.images import compress_images, remove_unused_images
+from calibre.ebooks.oeb.polish.images import ImageCompressionPool, compress_images, remove_unused_images
 from calibre.ebooks.oeb.polish.jacket import add_or_replace_jacket, find_existing_jacket, remove_jacket, replace_jacket
 from calibre.ebooks.oeb.polish.replace import smarten_punctuation
 from calibre.ebooks.oeb.polish.stats import StatsCollector
@@ -183,7 +183,7 @@ def download_resources(ebook, report) -> bool:
     return changed
 
 
-def polish_one(ebook, opts, report, customization=None):
+def polish_one(ebook, opts, report, customization=None, image_pool=None):
     def rt(x):
         return report('\n### ' + x)
 
@@ -278,7 +278,7 @@ def rt(x):
 
     if opts.compress_images:
         rt(_('Losslessly compressing images'))
-        if compress_images(ebook, report)[0]:
+        if compress_images(ebook, report, pool=image_pool)[0]:
             changed = True
         report('')
 
@@ -313,12 +313,21 @@ def rt(x):
 
 def polish(file_map, opts, log, report):
     st = time.time()
-    for inbook, outbook in file_map.items():
-        report(_('## Polishing: %s') % (inbook.rpartition('.')[-1].upper()))
-        ebook = get_container(inbook, log)
-        polish_one(ebook, opts, report)
-        ebook.commit(outbook)
-        report('-' * 70)
+    # When polishing several books, share a process pool for image
+    # compression so that workers and already compressed images are re-used.
+    # For a single book, compress_images() creates a pool if the book has
+    # many images.
+    image_pool = ImageCompressionPool() if opts.compress_images and len(file_map) > 1 else None
+    try:
+        for inbook, outbook in file_map.items():
+            report(_('## Polishing: %s') % (inbook.rpartition('.')[-1].upper()))
+            ebook = get_container(inbook, log)
+            polish_one(ebook, opts, report, image_pool=image_pool)
+            ebook.commit(outbook)
+            report('-' * 70)
+    finally:
+        if image_pool is not None:
+            image_pool.shutdown()
     report(_('Polishing took: %.1f seconds') % (time.time() - st))
 
 
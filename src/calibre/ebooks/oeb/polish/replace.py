@@ -102,7 +102,11 @@ def __call__(self, url):
         return href
 
 
-def replace_links(container, link_map, frag_map=lambda name, frag: frag, replace_in_opf=False):
+def unchanged_frag(name, frag):
+    return frag
+
+
+def replace_links(container, link_map, frag_map=unchanged_frag, replace_in_opf=False):
     """
     Replace links to files in the container. Will iterate over all files in the container and change the specified links in them.
 
@@ -113,7 +117,13 @@ def replace_links(container, link_map, frag_map=lambda name, frag: frag, replace
     :param replace_in_opf: If False, links are not replaced in the OPF file.
 
     """
-    for name, media_type in container.mime_map.items():
+    if frag_map is unchanged_frag:
+        # Only files that link to one of the changed files need to be
+        # rewritten, use the container's link index to find them
+        names = container.names_linking_to(link_map)
+    else:
+        names = tuple(container.mime_map)
+    for name in names:
         if name == container.opf_name and not replace_in_opf:
             continue
         repl = LinkReplacer(name, container, link_map, frag_map)
@@ -231,7 +231,7 @@ def split(container, name, loc_or_xpath, before=True, totals=None):
                         a.set('href', '#' + purl.fragment)
 
     # Fix all links in the container that point to anchors in the bottom tree
-    for fname, media_type in container.mime_map.items():
+    for fname in container.names_linking_to((name,)):
         if fname not in {name, bottom_name}:
             repl = SplitLinkReplacer(fname, anchors_in_bottom, name, bottom_name, container)
             container.replace_links(fname, repl)
@@ -430,8 +430,10 @@ def merge_html(container, names, master, insert_page_breaks=False):
 
         container.remove_item(name, remove_from_guide=False)
 
-    # Fix all links in the container that point to merged files
-    for fname, media_type in container.mime_map.items():
+    # Fix all links in the container that point to merged files, master has
+    # been modified so ensure its links are re-indexed
+    container.dirty(master)
+    for fname in container.names_linking_to(anchor_map):
         repl = MergeLinkReplacer(fname, anchor_map, master, container)
         container.replace_links(fname, repl)
 
@@ -184,6 +184,25 @@ def new_container():
 
         # self.run_external_tools(c, vim=True)
 
+    def test_link_index(self):
+        "Test the index of links between files"
+        book = get_simple_book()
+        c = get_container(book)
+        self.assertIn('index_split_000.html', c.names_linking_to(('stylesheet.css',)))
+        self.assertNotIn('stylesheet.css', c.names_linking_to(('index_split_000.html',)))
+        name = 'folder/added file.html'
+        c.add_file(name, b'<html><body><p>xxx</p></body></html>')
+        self.assertNotIn(name, c.names_linking_to(('cover.png',)))
+        root = c.parsed(name)
+        img = root.makeelement('{http://www.w3.org/1999/xhtml}img', src='../cover.png')
+        root.xpath('//*[local-name()="p"]')[0].append(img)
+        c.dirty(name)
+        self.assertIn(name, c.names_linking_to(('cover.png',)))
+        rename_files(c, {'cover.png': 'images/cover img.png'})
+        self.assertIn(name, c.names_linking_to(('images/cover img.png',)))
+        self.assertFalse(c.names_linking_to(('cover.png',)))
+        self.check_links(c)
+
     def test_file_add(self):
         "Test adding of files"
         book = get_simple_book()
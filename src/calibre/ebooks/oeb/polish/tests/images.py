@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# License: GPLv3 Copyright: 2026, Kovid Goyal <kovid at kovidgoyal.net>
+
+import os
+
+from calibre.ebooks.oeb.polish.images import ImageCompressionPool
+from calibre.ebooks.oeb.polish.tests.base import BaseTest
+
+
+def png_data(color):
+    from qt.core import QColor, QImage
+
+    from calibre.utils.img import image_to_data
+
+    img = QImage(64, 64, QImage.Format.Format_RGB32)
+    img.fill(QColor(color))
+    # Uncompressed, so that lossless compression always reduces the size
+    return image_to_data(img, fmt='PNG', png_compression_level=0)
+
+
+class ImageCompressionTest(BaseTest):
+    def make_images(self, colors, prefix=''):
+        items = []
+        for i, color in enumerate(colors):
+            path = os.path.join(self.tdir, f'{prefix}{i}.png')
+            with open(path, 'wb') as f:
+                f.write(png_data(color))
+            items.append((f'{prefix}{i}.png', path, 'image/png'))
+        return items
+
+    def test_compression_pool(self):
+        items = self.make_images(('red', 'green', 'red', 'blue'))
+        with ImageCompressionPool(max_workers=2) as pool:
+            results = {}
+            pool(items, results)
+            self.assertEqual(set(results), {name for name, path, mt in items})
+            for name, path, mt in items:
+                ok, (before, after) = results[name]
+                self.assertTrue(ok, name)
+                self.assertLess(after, before, name)
+                self.assertEqual(os.path.getsize(path), after, name)
+            # The duplicate red image shares the result of the first one
+            self.assertEqual(results['0.png'], results['2.png'])
+
+            # Identical images are only compressed once, even across runs
+            items = self.make_images(('blue', 'green'), prefix='again-')
+            hits, results = pool.cache_hits, {}
+            pool(items, results)
+            self.assertEqual(pool.cache_hits - hits, 2)
+            self.assertTrue(all(ok for ok, res in results.values()))
+
+            # Results of jobs from a cancelled run must not be confused with
+            # the jobs of the next run
+            first = self.make_images(('yellow', 'cyan', 'magenta'), prefix='cancelled-')
+            pool(first, {}, progress_callback=lambda name: False)
+            second = self.make_images(('white', 'black', 'gray'), prefix='next-')
+            results = {}
+            pool(second, results)
+            self.assertEqual(set(results), {name for name, path, mt in second})
+            for name, path, mt in second:
+                self.assertEqual(os.path.getsize(path), results[name][1][1], name)
@@ -5,7 +5,6 @@
 # Imports {{{
 import os
 import queue
-import re
 import sys
 import time
 import traceback
@@ -32,7 +31,6 @@
 from calibre.devices.interface import DevicePlugin, currently_connected_device
 from calibre.devices.scanner import DeviceScanner
 from calibre.ebooks.covers import cprefs, generate_cover, override_prefs, scale_cover
-from calibre.ebooks.metadata import authors_to_string
 from calibre.gui2 import (
     Dispatcher,
     FunctionDispatcher,
@@ -974,6 +972,10 @@ class DeviceSignals(QObject):  # {{{
 
 
 class DeviceMixin:  # {{{
+    # Set once set_books_in_library() has matched the books on the device
+    # against the library, book_on_device() relies on the matches
+    device_books_matched = False
+
     def init_device_mixin(self: Main):
         self.device_error_dialog = error_dialog(self, _('Error'), _('Error communicating with device'), ' ')
         self.device_error_dialog.setModal(False)
@@ -1804,7 +1806,7 @@ def book_on_device(self: Main, id, reset=False):
             self.book_db_uuid_path_map = None
             return
 
-        if not self.device_manager.is_device_connected or not hasattr(self, 'db_book_uuid_cache'):
+        if not self.device_manager.is_device_connected or not self.device_books_matched:
             return loc
 
         if self.book_db_id_cache is None:
@@ -1860,18 +1862,6 @@ def set_books_in_library(self: Main, booklists, reset=False, add_as_step_to_job=
         except Exception:
             return False
 
-        # Define the cleaning function
-        string_pat = re.compile(r'(?u)\W|[_]')
-
-        def clean_string(x):
-            try:
-                # Convert to lowercase if x is not None or empty
-                x = x.lower() if x else ''
-            except Exception:
-                x = ''
-            # Perform regex substitution
-            return string_pat.sub('', x)
-
         update_metadata = device_prefs['manage_device_metadata'] == 'on_connect' or force_send
 
         get_covers = False
@@ -1881,32 +1871,6 @@ def clean_string(x):
                 get_covers = True
                 desired_thumbnail_height = self.device_manager.device.THUMBNAIL_HEIGHT
 
-        # Force a reset if the caches are not initialized
-        if reset or not hasattr(self, 'db_book_title_cache'):
-            # Build a cache (map) of the library, so the search isn't On**2
-            db_book_title_cache = {}
-            db_book_uuid_cache = {}
-
-            for id_ in db.data.iterallids():
-                title = clean_string(db.new_api.field_for('title', id_))
-                if title not in db_book_title_cache:
-                    db_book_title_cache[title] = {'authors': {}, 'author_sort': {}, 'db_ids': {}}
-                # If there are multiple books in the library with the same title
-                # and author, then remember the last one. That is OK, because as
-                # we can't tell the difference between the books, one is as good
-                # as another.
-                au = db.new_api.field_for('authors', id_)
-                authors = clean_string(authors_to_string(au))
-                if authors:
-                    db_book_title_cache[title]['authors'][authors] = id_
-                if aus := db.new_api.field_for('author_sort', id_):
-                    aus = clean_string(aus)
-                    db_book_title_cache[title]['author_sort'][aus] = id_
-                db_book_title_cache[title]['db_ids'][id_] = id_
-                db_book_uuid_cache[db.new_api.field_for('uuid', id_)] = id_
-            self.db_book_title_cache = db_book_title_cache
-            self.db_book_uuid_cache = db_book_uuid_cache
-
         book_ids_to_refresh = set()
         book_formats_to_send = []
         books_with_future_dates = []
@@ -1942,21 +1906,6 @@ def updateq(id_, book):
             except Exception:
                 return True
 
-        def get_by_author(book, d, author):
-            book_id = d['authors'].get(author)
-            if book_id is not None:
-                book.in_library = 'AUTHOR'
-                book.application_id = book_id
-                update_book(book_id, book)
-                return True
-            book_id = d['author_sort'].get(author)
-            if book_id is not None:
-                book.in_library = 'AUTH_SORT'
-                book.application_id = book_id
-                update_book(book_id, book)
-                return True
-            return False
-
         # Now iterate through all the books on the device, setting the
         # in_library field. If the UUID matches a book in the library, then
         # do not consider that book for other matching. In all cases set
@@ -1974,9 +1923,13 @@ def get_by_author(book, d, author):
         start_time = time.time()
 
         with BusyCursor():
+            # The library maintains an index for matching, so this does not
+            # need to look at every book in the library
+            matches = iter(db.new_api.match_device_books(book for booklist in booklists for book in booklist))
             current_book_count = 0
             for booklist in booklists:
                 for book in booklist:
+                    how, id_ = next(matches)
                     if current_book_count % 100 == 0:
                         self.status_bar.show_message(
                             _('Analyzing books on the device: %d%% finished') % (int((float(current_book_count) / total_book_count) * 100.0)),
@@ -1994,55 +1947,29 @@ def get_by_author(book, d, author):
                             flags=QEventLoop.ProcessEventsFlag.ExcludeUserInputEvents | QEventLoop.ProcessEventsFlag.ExcludeSocketNotifiers
                         )
                     current_book_count += 1
-                    book.in_library = None
-                    if getattr(book, 'uuid', None) in self.db_book_uuid_cache:
-                        id_ = db_book_uuid_cache[book.uuid]
+                    book.in_library = how
+                    if how == 'UUID':
                         if updateq(id_, book):
                             update_book(id_, book)
-                        book.in_library = 'UUID'
                         # ensure that the correct application_id is set
                         book.application_id = id_
                         continue
-                    # No UUID exact match. Try metadata matching.
-                    book_title = clean_string(book.title)
-                    d = self.db_book_title_cache.get(book_title, None)
-                    if d is not None:
-                        # At this point we know that the title matches. The book
-                        # will match if any of the db_id, author, or author_sort
-                        # also match.
-                        if getattr(book, 'application_id', None) in d['db_ids']:
-                            id_ = getattr(book, 'application_id', None)
-                            update_book(id_, book)
-                            book.in_library = 'APP_ID'
-                            # app_id already matches a db_id. No need to set it.
-                            continue
-                        # Sonys know their db_id independent of the application_id
-                        # in the metadata cache. Check that as well.
-                        if getattr(book, 'db_id', None) in d['db_ids']:
-                            update_book(book.db_id, book)
-                            book.in_library = 'DB_ID'
-                            book.application_id = book.db_id
-                            continue
-                        # We now know that the application_id is not right. Set it
-                        # to None to prevent book_on_device from accidentally
-                        # matching on it. It will be set to a correct value below if
-                        # the book is matched with one in the library
+                    if how is None:
+                        # Book not matched. Clear its application ID to prevent
+                        # book_on_device from accidentally matching on it.
                         book.application_id = None
-                        if book.authors:
-                            # Compare against both author and author sort, because
-                            # either can appear as the author
-                            all_book_authors = clean_string(authors_to_string(book.authors))
-                            if not get_by_author(book, d, all_book_authors):
-                                for author in book.authors:
-                                    if get_by_author(book, d, clean_string(author)):
-                                        break
                     else:
-                        # Book definitely not matched. Clear its application ID
-                        book.application_id = None
+                        # Matched on title and one of the application_id,
+                        # db_id, author or author_sort
+                        book.application_id = id_
+                        update_book(id_, book)
+                        if how in ('APP_ID', 'DB_ID'):
+                            continue
                     # Set author_sort if it isn't already
                     asort = getattr(book, 'author_sort', None)
                     if not asort and book.authors:
                         book.author_sort = self.current_db.author_sort_from_authors(book.authors)
+            self.device_books_matched = True
 
             if update_metadata:
                 if self.device_manager.is_device_connected:
@@ -472,7 +472,7 @@ def update_db_prefs_cache(self):
     def start_metadata_backup(self):
         from calibre.db.backup import MetadataBackup
 
-        self.metadata_backup = MetadataBackup(self.db)
+        self.metadata_backup = MetadataBackup(self.db, batch_size=50)
         self.metadata_backup.start()
 
     def stop_metadata_backup(self):
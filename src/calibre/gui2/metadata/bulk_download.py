@@ -9,6 +9,7 @@
 from qt.core import QDialog, QDialogButtonBox, QGridLayout, QIcon, QLabel, Qt
 
 from calibre.ebooks.metadata.opf2 import metadata_to_opf
+from calibre.ebooks.metadata.sources.scheduler import format_stats, merge_stats
 from calibre.gui2.threaded_jobs import ThreadedJob
 from calibre.ptempfile import PersistentTemporaryDirectory, PersistentTemporaryFile
 from calibre.startup import connect_lambda
@@ -221,7 +222,8 @@ def run(self):
 
 
 def download(all_ids, tf, db, do_identify, covers, ensure_fields, log=None, abort=None, notifications=None):
-    batch_size = 10
+    # Books in a batch are downloaded concurrently, see calibre.ebooks.metadata.sources.scheduler
+    batch_size = 40
     batches = split_jobs(all_ids, batch_size=batch_size)
     tdir = PersistentTemporaryDirectory('_metadata_bulk')
     heartbeat = HeartBeat(tdir)
@@ -230,6 +232,7 @@ def download(all_ids, tf, db, do_identify, covers, ensure_fields, log=None, abor
     failed_covers = set()
     title_map = {}
     lm_map = {}
+    source_stats = {}
     ans = set()
     all_failed = True
     aborted = False
@@ -264,7 +267,8 @@ def download(all_ids, tf, db, do_identify, covers, ensure_fields, log=None, abor
                 raise
             count += batch_size
 
-            fids, fcovs, allf = ret['result']
+            fids, fcovs, allf, stats = ret['result']
+            merge_stats(source_stats, stats)
             if not allf:
                 all_failed = False
             failed_ids = failed_ids.union(fids)
@@ -280,6 +284,8 @@ def download(all_ids, tf, db, do_identify, covers, ensure_fields, log=None, abor
         if abort.is_set():
             aborted = True
         log(f'Download complete, with {len(failed_ids)} failures')
+        if source_stats:
+            log('Statistics for each source:\n' + format_stats(source_stats))
         return (aborted, ans, tdir, tf, failed_ids, failed_covers, title_map, lm_map, all_failed)
     finally:
         notifier.keep_going = False
@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+# License: GPLv3 Copyright: 2026, Kovid Goyal <kovid at kovidgoyal.net>
+
+import unittest
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
+
+
+def _make_book(lpath, **extra):
+    return SimpleNamespace(title=lpath, authors=['Author'], author_sort='Author', lpath=lpath, uuid=None, application_id=None, **extra)
+
+
+class BooksOnDeviceTest(unittest.TestCase):
+    def test_book_on_device_after_matching(self):
+        from calibre.gui2 import ensure_app
+        from calibre.gui2.device import DeviceMixin
+
+        ensure_app()
+        main = [_make_book('b1.epub'), _make_book('b2.epub')]
+        carda = [_make_book('b3.epub'), _make_book('b4.epub')]
+        booklists = [main, carda, []]
+        db = MagicMock()
+        db.new_api.match_device_books.return_value = [('UUID', 1), (None, None), ('AUTHOR', 1), ('APP_ID', 2)]
+
+        class Main(DeviceMixin):
+            def __init__(self):
+                self.device_manager = MagicMock(is_device_connected=True)
+                self.current_db = db
+                self.status_bar = MagicMock()
+                self.library_view = MagicMock()
+                self.book_db_id_cache = None
+
+            def booklists(self):
+                return booklists
+
+        gui = Main()
+        self.assertEqual(gui.book_on_device(1), [None, None, None, 0, set()])
+        with patch('calibre.gui2.device.device_prefs', {'manage_device_metadata': 'manual'}):
+            gui.set_books_in_library(booklists)
+        self.assertEqual([b.in_library for b in main + carda], ['UUID', None, 'AUTHOR', 'APP_ID'])
+        self.assertEqual(gui.book_on_device(1), [True, True, None, 2, {'b1.epub', 'b3.epub'}])
+        self.assertEqual(gui.book_on_device(2), [None, True, None, 1, {'b4.epub'}])
+        self.assertEqual(gui.book_on_device(3), [None, None, None, 0, set()])
+        # Once the device is disconnected nothing is on the device
+        gui.device_manager.is_device_connected = False
+        self.assertEqual(gui.book_on_device(1), [None, None, None, 0, set()])
+
+
+def find_tests():
+    return unittest.defaultTestLoader.loadTestsFromTestCase(BooksOnDeviceTest)
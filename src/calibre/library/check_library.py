@@ -2,11 +2,13 @@
 # License: GPLv3 Copyright: 2010, Kovid Goyal <kovid@kovidgoyal.net>
 
 import fnmatch
+import json
 import os
 import re
+import time
 import traceback
 
-from calibre.constants import filesystem_encoding
+from calibre.constants import cache_dir, filesystem_encoding
 from calibre.db.constants import COVER_FILE_NAME, DATA_DIR_NAME, METADATA_FILE_NAME, NOTES_DIR_NAME, TRASH_DIR_NAME
 from calibre.ebooks import BOOK_EXTENSIONS
 from calibre.utils.localization import _
@@ -21,6 +23,7 @@
     TRASH_DIR_NAME,
     NOTES_DIR_NAME,
 })
+SNAPSHOT_VERSION = 1
 
 '''
 Checks fields:
@@ -47,12 +50,29 @@
 ]
 
 
+def library_change_watcher(library_path):
+    """
+    Return an object that tracks changes to the library folder, for long
+    running processes that check the library periodically. Calling it returns
+    the set of paths changed since the last call, suitable for the
+    changed_paths argument of :meth:`CheckLibrary.scan_library`. Create it
+    before the first incremental scan, so that no changes are missed. Only
+    works on Linux.
+    """
+    from calibre.utils.inotify import INotifyTreeWatcher
+
+    return INotifyTreeWatcher(library_path)
+
+
 class CheckLibrary:
-    def __init__(self, library_path, db):
+    def __init__(self, library_path, db, snapshot_path=None):
         if isinstance(library_path, bytes):
             library_path = library_path.decode(filesystem_encoding)
         self.src_library_path = os.path.abspath(library_path)
         self.db = db
+        self.snapshot_path = snapshot_path or os.path.join(cache_dir(), 'check-library', f'{db.library_id}.json')
+        self.snapshot = self.new_snapshot = self.changed_dirs = None
+        self.seen_book_dirs = set()
 
         self.is_case_sensitive = db.is_case_sensitive
 
@@ -98,31 +118,102 @@ def ignore_name(self, filename):
                 return True
         return False
 
-    def scan_library(self, name_ignores, extension_ignores):
+    def load_snapshot(self):
+        try:
+            with open(self.snapshot_path, 'rb') as f:
+                data = json.loads(f.read())
+        except OSError, ValueError:
+            return {}
+        if data.get('version') != SNAPSHOT_VERSION or data.get('library_path') != self.src_library_path:
+            return {}
+        return data['dirs']
+
+    def save_snapshot(self):
+        from calibre.utils.filenames import atomic_rename
+
+        os.makedirs(os.path.dirname(self.snapshot_path), exist_ok=True)
+        raw = json.dumps({'version': SNAPSHOT_VERSION, 'library_path': self.src_library_path, 'dirs': self.new_snapshot}, ensure_ascii=False)
+        tpath = self.snapshot_path + '.tmp'
+        with open(tpath, 'wb') as f:
+            f.write(raw.encode('utf-8'))
+        atomic_rename(tpath, self.snapshot_path)
+
+    def dirs_for_changed_paths(self, changed_paths):
+        base = os.path.realpath(self.src_library_path)
+        ans = set()
+        for path in changed_paths:
+            rpath = os.path.relpath(path, base)
+            ans.add(rpath)
+            ans.add(os.path.dirname(rpath))
+        return {'' if x == '.' else x for x in ans}
+
+    def list_dir(self, relpath):
+        # Return the list of (name, is_dir) for the entries in the folder at
+        # relpath. In incremental mode, the listing from the snapshot is used
+        # if the folder is unchanged.
+        path = os.path.join(self.src_library_path, relpath)
+        if self.snapshot is None:
+            with os.scandir(path) as it:
+                return [(e.name, e.is_dir()) for e in it]
+        prev = self.snapshot.get(relpath)
+        if prev is not None and self.changed_dirs is not None and relpath not in self.changed_dirs:
+            self.new_snapshot[relpath] = prev
+            return prev[2]
+        st = os.stat(path)
+        if prev is not None and prev[0] == st.st_mtime_ns and prev[1] == st.st_ino:
+            self.new_snapshot[relpath] = prev
+            return prev[2]
+        with os.scandir(path) as it:
+            entries = [(e.name, e.is_dir()) for e in it]
+        # A folder modified within the mtime granularity of the filesystem
+        # could change again without its mtime changing, so dont record it
+        if time.time() - st.st_mtime > 2:
+            self.new_snapshot[relpath] = [st.st_mtime_ns, st.st_ino, entries]
+        return entries
+
+    def book_dir_exists(self, path):
+        key = path if self.is_case_sensitive else path.lower()
+        return key in self.seen_book_dirs or os.path.exists(os.path.join(self.src_library_path, path))
+
+    def scan_library(self, name_ignores, extension_ignores, incremental=False, changed_paths=None):
+        """
+        Scan the library folder for problems. If incremental is True, a
+        snapshot of the listing of every folder is saved and subsequent
+        incremental scans only list folders whose mtime or inode has changed.
+        changed_paths can be the set of paths changed since the previous scan,
+        as reported by :func:`library_change_watcher`, in which case unchanged
+        folders are not examined at all.
+        """
         self.ignore_names = frozenset(name_ignores)
         self.ignore_ext = frozenset('.' + e for e in extension_ignores)
+        if incremental:
+            self.snapshot, self.new_snapshot = self.load_snapshot(), {}
+            if changed_paths is not None and None not in changed_paths:
+                self.changed_dirs = self.dirs_for_changed_paths(changed_paths)
 
         lib = self.src_library_path
-        for auth_dir in os.listdir(lib):
+        for auth_dir, is_dir in self.list_dir(''):
             if self.ignore_name(auth_dir) or auth_dir in IGNORE_AT_TOP_LEVEL:
                 continue
             auth_path = os.path.join(lib, auth_dir)
             # First check: author must be a directory
-            if not os.path.isdir(auth_path):
+            if not is_dir:
                 self.invalid_authors.append((auth_dir, auth_dir, 0))
                 continue
 
             # Look for titles in the author directories
             found_titles = False
             try:
-                for title_dir in os.listdir(auth_path):
-                    if self.ignore_name(title_dir):
-                        continue
+                for title_dir, title_is_dir in self.list_dir(auth_dir):
                     title_path = os.path.join(auth_path, title_dir)
                     db_path = os.path.join(auth_dir, title_dir)
+                    if title_is_dir:
+                        self.seen_book_dirs.add(db_path if self.is_case_sensitive else db_path.lower())
+                    if self.ignore_name(title_dir):
+                        continue
                     m = self.db_id_regexp.search(title_dir)
                     # Second check: title must have an ID and must be a directory
-                    if m is None or not os.path.isdir(title_path):
+                    if m is None or not title_is_dir:
                         self.invalid_titles.append((auth_dir, db_path, 0))
                         continue
 
@@ -130,7 +221,7 @@ def scan_library(self, name_ignores, extension_ignores):
                     # Third check: the id_ must be in the DB and the paths must match
                     if self.is_case_sensitive:
                         if db_path not in self.all_dbpaths:
-                            if int(id_) not in self.all_ids or os.path.exists(os.path.join(lib, self.dbpath(int(id_)))):
+                            if int(id_) not in self.all_ids or self.book_dir_exists(self.dbpath(int(id_))):
                                 self.extra_titles.append((title_dir, db_path, 0))
                                 continue
                             else:
@@ -163,7 +254,7 @@ def scan_library(self, name_ignores, extension_ignores):
         # Check for formats and covers in db for book dirs that are gone
         for id_ in self.all_ids:
             path = self.dbpath(id_)
-            if not os.path.exists(os.path.join(lib, path)):
+            if not self.book_dir_exists(path):
                 if self.is_case_sensitive and id_ in self.malformed_paths_ids:
                     continue
 
@@ -173,6 +264,8 @@ def scan_library(self, name_ignores, extension_ignores):
                     self.missing_formats.append((title_dir, os.path.join(path, fmt[0] + '.' + fmt[1].lower()), id_))
                 if self.db.has_cover(id_):
                     self.missing_covers.append((title_dir, os.path.join(path, COVER_FILE_NAME), id_))
+        if incremental:
+            self.save_snapshot()
 
     def is_ebook_file(self, filename):
         ext = os.path.splitext(filename)[1]
@@ -187,9 +280,7 @@ def is_ebook_file(self, filename):
     def process_book(self, lib, book_info):
         db_path, title_dir, book_id = book_info
         filenames = frozenset(
-            f
-            for f in os.listdir(os.path.join(lib, db_path))
-            if not self.ignore_name(f) and (os.path.splitext(f)[1] not in self.ignore_ext or f == COVER_FILE_NAME)
+            f for f, is_dir in self.list_dir(db_path) if not self.ignore_name(f) and (os.path.splitext(f)[1] not in self.ignore_ext or f == COVER_FILE_NAME)
         )
         book_id = int(book_id)
         formats = frozenset(filter(self.is_ebook_file, filenames))
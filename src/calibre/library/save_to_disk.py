@@ -4,9 +4,11 @@
 import os
 import re
 import traceback
+from collections import deque
 
-from calibre import prints, sanitize_file_name, strftime
+from calibre import detect_ncpus, prints, sanitize_file_name, strftime
 from calibre.constants import DEBUG, iswindows, preferred_encoding
+from calibre.db.constants import DATA_FILE_PATTERN
 from calibre.db.errors import NoSuchFormat
 from calibre.db.lazy import FormatsList
 from calibre.ebooks.metadata import fmt_sidx, title_sort
@@ -66,6 +68,11 @@ def find_plugboard(device_name, format, plugboards):
     return cpb
 
 
+def plugboards_for_formats(formats, plugboards, device_name=plugboard_save_to_disk_value):
+    """Resolve the plugboard for every format once, rather than once per book."""
+    return {fmt: find_plugboard(device_name, fmt, plugboards) for fmt in formats}
+
+
 def config(defaults=None):
     if defaults is None:
         c = Config('save_to_disk', _('Options to control saving to disk'))
@@ -266,12 +273,18 @@ def get_components(
     safe_format=True,
     last_has_extension=True,
     single_dir=False,
+    formatter=None,
+    template_cache=None,
 ):
+    # Pass in formatter and template_cache when evaluating the same template
+    # for many books, so that it is compiled only once
     format_args = get_component_metadata(template, mi, book_id, timefmt)
+    formatter = formatter or Formatter()
+    column_name = None if template_cache is None else 'save_to_disk_template'
     if safe_format:
-        components = Formatter().safe_format(template, format_args, 'G_C-EXCEPTION!', mi)
+        components = formatter.safe_format(template, format_args, 'G_C-EXCEPTION!', mi, column_name=column_name, template_cache=template_cache)
     else:
-        components = Formatter().unsafe_format(template, format_args, mi)
+        components = formatter.unsafe_format(template, format_args, mi, column_name=column_name, template_cache=template_cache)
     components = [x.strip() for x in components.split('/')]
     components = [sanitize_func(x) for x in components if x]
     if not components:
@@ -303,7 +316,7 @@ def save_book_to_disk(book_id, db, root, opts, length):
     return do_save_book_to_disk(db, book_id, mi, plugboards, formats, root, opts, length)
 
 
-def get_path_components(opts, mi, book_id, path_length):
+def get_path_components(opts, mi, book_id, path_length, formatter=None, template_cache=None):
     try:
         components = get_components(
             opts.template,
@@ -317,6 +330,8 @@ def get_path_components(opts, mi, book_id, path_length):
             safe_format=False,
             last_has_extension=False,
             single_dir=opts.single_dir,
+            formatter=formatter,
+            template_cache=template_cache,
         )
     except Exception as e:
         raise ValueError(_('Failed to calculate path for save to disk. Template: %(templ)s\nError: %(err)s') % dict(templ=opts.template, err=e))
@@ -454,6 +469,180 @@ def save_to_disk(db, ids, root, opts=None, callback=None):
     return failures
 
 
+def write_book_for_parallel_save(db, book_id, mi, base_path, formats, extra_files, opts, tdir):
+    # Run in a thread pool by save_to_disk_in_parallel(). Returns whether any
+    # formats were written and the data needed by update_serialized_metadata()
+    from calibre.customize.ui import can_set_metadata
+    from calibre.ebooks.metadata.opf2 import metadata_to_opf
+
+    base_name = os.path.basename(base_path)
+    dirpath = os.path.dirname(base_path)
+    os.makedirs(make_long_path_useable(dirpath), exist_ok=True)
+    data = {'fmts': []}
+    last_modified = getattr(mi, 'last_modified', None)
+    if last_modified is not None:
+        data['last_modified'] = last_modified.isoformat()
+    mi.cover, mi.cover_data = None, (None, None)
+    cdata = db.cover(book_id) if opts.save_cover or opts.update_metadata else None
+    if cdata:
+        cpath = base_path + '.jpg' if opts.save_cover else os.path.join(tdir, f'{book_id}.jpg')
+        with open(make_long_path_useable(cpath), 'wb') as f:
+            f.write(cdata)
+        if opts.save_cover:
+            mi.cover = base_name + '.jpg'
+        data['cover'] = cpath
+    if opts.write_opf or opts.update_metadata:
+        opf_path = base_path + '.opf' if opts.write_opf else os.path.join(tdir, f'{book_id}.opf')
+        with open(make_long_path_useable(opf_path), 'wb') as f:
+            f.write(metadata_to_opf(mi))
+        data['opf'] = opf_path
+    for relpath in extra_files:
+        data_dest_path = os.path.abspath(os.path.join(dirpath, relpath))
+        try:
+            db.copy_extra_file_to(book_id, relpath, data_dest_path)
+        except FileNotFoundError:
+            os.makedirs(make_long_path_useable(os.path.dirname(data_dest_path)), exist_ok=True)
+            db.copy_extra_file_to(book_id, relpath, data_dest_path)
+    formats_written = False
+    for fmt in formats:
+        fmt_path = base_path + '.' + str(fmt)
+        try:
+            db.copy_format_to(book_id, fmt, fmt_path)
+        except NoSuchFormat:
+            continue
+        formats_written = True
+        if opts.update_metadata and can_set_metadata(fmt):
+            data['fmts'].append(fmt_path)
+    return formats_written, data
+
+
+def save_to_disk_in_parallel(db, ids, root, opts=None, callback=None, max_workers=None):
+    """
+    Same as :func:`save_to_disk`, but designed for saving large numbers of
+    books. The path template is compiled only once and the plugboards are
+    resolved once per format. The files are copied by a pool of threads and
+    the metadata is embedded into the saved files by a pool of worker
+    processes. Unlike :func:`save_to_disk`, extra data files are saved if
+    opts.save_extra_files is set and books whose paths would collide get
+    a numeric suffix. Books are reported to callback in the order in which
+    they complete.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from queue import Empty
+
+    from calibre.ptempfile import TemporaryDirectory
+    from calibre.utils.ipc.pool import Failure, Pool
+
+    root, opts, length = sanitize_args(root, opts)
+    db = db.new_api
+    ids = list(ids)
+    max_workers = max_workers or min(8, detect_ncpus())
+    formatter, template_cache = Formatter(), {}
+    failures, titles, used_paths = [], {}, set()
+    waiting_for_metadata = set()
+    aborted = False
+    pool = None
+
+    def book_done(book_id, failed, tb=''):
+        nonlocal aborted
+        title = titles.pop(book_id, None)
+        if failed:
+            failures.append((book_id, title, tb))
+        if callable(callback) and not aborted and not callback(int(book_id), title, failed, tb):
+            aborted = True
+
+    def prepare(book_id):
+        mi = db.get_metadata(book_id)
+        titles[book_id] = mi.title
+        if mi.pubdate:
+            mi.pubdate = as_local_time(mi.pubdate)
+        if mi.timestamp:
+            mi.timestamp = as_local_time(mi.timestamp)
+        components = get_path_components(opts, mi, book_id, length, formatter=formatter, template_cache=template_cache)
+        base_path = q = os.path.join(root, *components)
+        # Books are written concurrently, so they must not share a path
+        n = 0
+        while os.path.normcase(q) in used_paths:
+            n += 1
+            q = f'{base_path} ({n})'
+        used_paths.add(os.path.normcase(q))
+        formats = get_formats(db.formats(book_id), opts.formats)
+        extra_files = ()
+        if opts.save_extra_files:
+            extra_files = tuple(ef.relpath for ef in db.list_extra_files(book_id, pattern=DATA_FILE_PATTERN))
+        return mi, q, formats, extra_files
+
+    def books_written(book_id, future):
+        try:
+            formats_written, data = future.result()
+        except Exception:
+            return book_done(book_id, True, traceback.format_exc())
+        if not formats_written:
+            return book_done(book_id, True, _('Requested formats not available'))
+        if pool is None or not data['fmts']:
+            return book_done(book_id, False)
+        waiting_for_metadata.add(book_id)
+        pool(book_id, 'calibre.library.save_to_disk', 'update_serialized_metadata', data)
+
+    def consume_metadata_results(block=False):
+        while waiting_for_metadata:
+            try:
+                wr = pool.results.get(block, 0.1)
+            except Empty:
+                if pool.failed:
+                    raise Failure(pool.terminal_failure)
+                if not block:
+                    return
+                continue
+            pool.results.task_done()
+            waiting_for_metadata.discard(wr.id)
+            if wr.is_terminal_failure:
+                book_done(wr.id, True, _('The update metadata worker process crashed'))
+                continue
+            result = wr.result
+            if result.err is not None:
+                prints('Failed to set metadata for', titles.get(wr.id), result.err, result.traceback)
+            for fmt, tb in result.value or ():
+                prints('Failed to set metadata for the', fmt, 'format of', titles.get(wr.id))
+                prints(tb)
+            book_done(wr.id, False)
+
+    if opts.update_metadata:
+        all_formats = {fmt.lower() for book_id in ids for fmt in db.formats(book_id)}
+        pool = Pool(name='SaveToDisk')
+        pool.set_common_data({
+            'plugboard_cache': plugboards_for_formats(all_formats, db.pref('plugboards', {})),
+            'template_functions': db.pref('user_template_functions', []),
+            'library_id': db.library_id,
+        })
+    pending = deque()
+    try:
+        with TemporaryDirectory('_save_to_disk') as tdir, ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='SaveToDisk') as executor:
+            for book_id in ids:
+                if aborted:
+                    break
+                try:
+                    args = prepare(book_id)
+                except Exception:
+                    titles.setdefault(book_id, db.field_for('title', book_id))
+                    book_done(book_id, True, traceback.format_exc())
+                    continue
+                pending.append((book_id, executor.submit(write_book_for_parallel_save, db, book_id, *args, opts, tdir)))
+                # Limit the number of books in flight
+                if len(pending) > 2 * max_workers:
+                    books_written(*pending.popleft())
+                if pool is not None:
+                    consume_metadata_results()
+            while pending:
+                books_written(*pending.popleft())
+            if pool is not None:
+                consume_metadata_results(block=True)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    return failures
+
+
 def read_serialized_metadata(data):
     from calibre.ebooks.metadata.opf2 import OPF
     from calibre.utils.date import parse_date
@@ -1,10 +1,12 @@
 #!/usr/bin/env python
 # License: GPLv3 Copyright: 2018, Kovid Goyal <kovid at kovidgoyal.net>
 
+import hashlib
 import json as stdlib_json
 import os
 import shutil
 import tempfile
+from itertools import count
 from threading import Lock
 
 from calibre.customize.ui import input_profiles, output_profiles, run_plugins_on_postconvert
@@ -20,6 +22,10 @@
 receive_data_methods = {'GET', 'POST'}
 conversion_jobs = {}
 cache_lock = Lock()
+# Ids for conversions satisfied from the results cache, these never collide
+# with ids of real jobs, which are non-negative
+cached_job_ids = count(-1, -1)
+_results_cache = None
 
 
 class JobStatus:
@@ -34,6 +40,7 @@ def __init__(self, job_id, book_id, tdir, library_id, pathtoebook, conversion_da
         self.running = self.ok = True
         self.last_check_at = monotonic()
         self.was_aborted = False
+        self.cache_key = None
 
     def cleanup(self):
         safe_delete_tree(self.tdir)
@@ -78,6 +85,19 @@ def safe_delete_tree(path):
         pass
 
 
+def results_cache(ctx):
+    global _results_cache
+    size = getattr(ctx.opts, 'conversion_cache_size', 0)
+    if size <= 0:
+        return None
+    with cache_lock:
+        if _results_cache is None:
+            from calibre.ebooks.conversion.result_cache import ConversionCache
+
+            _results_cache = ConversionCache(max_size=size * 1024 * 1024)
+        return _results_cache
+
+
 def job_done(job):
     with cache_lock:
         try:
@@ -122,22 +142,40 @@ def queue_job(ctx, rd, library_id, db, fmt, book_id, conversion_data):
     from calibre.ebooks.metadata.opf2 import metadata_to_opf
 
     tdir = tempfile.mkdtemp(dir=rd.tdir)
-    with tempfile.NamedTemporaryFile(prefix='', suffix=('.' + fmt.lower()), dir=tdir, delete=False) as src_file:
-        db.copy_format_to(book_id, fmt, src_file)
-    with tempfile.NamedTemporaryFile(prefix='', suffix='.jpeg', dir=tdir, delete=False) as cover_file:
-        cover_copied = db.copy_cover_to(book_id, cover_file)
-    cover_path = cover_file.name if cover_copied else None
     mi = db.get_metadata(book_id)
     mi.application_id = mi.uuid
     raw = metadata_to_opf(mi)
-    with tempfile.NamedTemporaryFile(prefix='', suffix='.opf', dir=tdir, delete=False) as opf_file:
-        opf_file.write(raw)
     recs = GuiRecommendations()
     recs.update(conversion_data['options'])
     recs['gui_preferred_input_format'] = conversion_data['input_fmt'].lower()
     save_specifics(db, book_id, recs)
     recs = [(k, v, OptionRecommendation.HIGH) for k, v in recs.items()]
+    rcache = results_cache(ctx)
+    cache_key = None
+    if rcache is not None:
+        # Identify the input by the state of the files in the library, so that
+        # nothing needs to be copied or hashed to find a cached result
+        fm = db.format_metadata(book_id, fmt, allow_cache=False)
+        if fm:
+            input_id = (library_id, book_id, fmt.upper(), fm['size'], fm['mtime'].isoformat())
+            extra = (hashlib.sha256(raw).hexdigest(), db.cover_timestamp(book_id))
+            cache_key = rcache.key(input_id, conversion_data['output_fmt'], recs, extra)
+            job_status = JobStatus(None, book_id, tdir, library_id, None, conversion_data)
+            if rcache.get(cache_key, job_status.output_path):
+                job_status.job_id = job_id = next(cached_job_ids)
+                job_status.running = False
+                expire_old_jobs()
+                with cache_lock:
+                    conversion_jobs[job_id] = job_status
+                return job_id
 
+    with tempfile.NamedTemporaryFile(prefix='', suffix=('.' + fmt.lower()), dir=tdir, delete=False) as src_file:
+        db.copy_format_to(book_id, fmt, src_file)
+    with tempfile.NamedTemporaryFile(prefix='', suffix='.jpeg', dir=tdir, delete=False) as cover_file:
+        cover_copied = db.copy_cover_to(book_id, cover_file)
+    cover_path = cover_file.name if cover_copied else None
+    with tempfile.NamedTemporaryFile(prefix='', suffix='.opf', dir=tdir, delete=False) as opf_file:
+        opf_file.write(raw)
     job_id = ctx.start_job(
         f'Convert book {book_id} ({fmt})',
         'calibre.srv.convert',
@@ -147,7 +185,8 @@ def queue_job(ctx, rd, library_id, db, fmt, book_id, conversion_data):
     )
     expire_old_jobs()
     with cache_lock:
-        conversion_jobs[job_id] = JobStatus(job_id, book_id, tdir, library_id, src_file.name, conversion_data)
+        conversion_jobs[job_id] = job_status = JobStatus(job_id, book_id, tdir, library_id, src_file.name, conversion_data)
+        job_status.cache_key = cache_key
     return job_id
 
 
@@ -202,6 +241,13 @@ def conversion_status(ctx, rd, job_id):
             if library_id != job_status.library_id:
                 raise HTTPNotFound('job library_id does not match')
             fmt = job_status.output_path.rpartition('.')[-1]
+            if job_status.cache_key is not None and (rcache := results_cache(ctx)) is not None:
+                try:
+                    rcache.put(job_status.cache_key, job_status.output_path)
+                except OSError:
+                    import traceback
+
+                    traceback.print_exc()
             try:
                 db.add_format(job_status.book_id, fmt, job_status.output_path)
             except NoSuchBook:
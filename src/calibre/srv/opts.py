@@ -79,6 +79,14 @@ def __new__(cls, *args):
     'max_job_time',
     60,
     _('Maximum amount of time worker processes are allowed to run (in minutes). Set to zero for no limit.'),
+    _('Size of the conversion results cache (in MB)'),
+    'conversion_cache_size',
+    0,
+    _(
+        'Converting a book to a format with the same options as an earlier conversion re-uses the'
+        ' earlier output instead of converting again. This controls the maximum disk space'
+        ' used to store earlier outputs. Set to zero to disable.'
+    ),
     _('The port on which to listen for connections'),
     'port',
     8080,
@@ -256,6 +264,7 @@ class Options:
     worker_count: int
     max_jobs: int
     max_job_time: int
+    conversion_cache_size: int
     port: int
     url_prefix: str | None
     num_per_page: int
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# License: GPLv3 Copyright: 2026, Kovid Goyal <kovid at kovidgoyal.net>
+
+import os
+from io import BytesIO
+from types import SimpleNamespace
+
+from calibre.srv.tests.base import LibraryBaseTest
+
+
+class ConvertTest(LibraryBaseTest):
+    def test_conversion_results_cache(self):
+        from calibre.db.cache import Cache
+        from calibre.db.legacy import create_backend
+        from calibre.ebooks.conversion.result_cache import ConversionCache
+        from calibre.srv import convert
+
+        db = Cache(create_backend(self.library_path))
+        db.init()
+        self.objects_to_close.append(db)
+        started = []
+
+        def start_job(name, module, func, args=(), job_done_callback=None):
+            started.append(args)
+            return len(started)
+
+        ctx = SimpleNamespace(opts=SimpleNamespace(conversion_cache_size=1), start_job=start_job)
+        rd = SimpleNamespace(tdir=self.mkdtemp())
+        conversion_data = {'input_fmt': 'FMT1', 'output_fmt': 'TXT', 'options': {}}
+        orig_cache, convert._results_cache = convert._results_cache, ConversionCache(self.mkdtemp())
+        rcache = convert._results_cache
+
+        def queue():
+            job_id = convert.queue_job(ctx, rd, 'lib', db, 'FMT1', 1, conversion_data)
+            with convert.cache_lock:
+                return convert.conversion_jobs.pop(job_id)
+
+        try:
+            job_status = queue()
+            self.assertEqual(len(started), 1)
+            self.assertTrue(job_status.running)
+            # Simulate the conversion finishing
+            with open(job_status.output_path, 'wb') as f:
+                f.write(b'converted')
+            rcache.put(job_status.cache_key, job_status.output_path)
+            job_status.cleanup()
+
+            # The same conversion is satisfied from the cache, without
+            # starting a job or copying the input into the job folder
+            job_status = queue()
+            self.assertEqual(len(started), 1)
+            self.assertLess(job_status.job_id, 0)
+            self.assertFalse(job_status.running)
+            self.assertEqual(os.listdir(job_status.tdir), [os.path.basename(job_status.output_path)])
+            with open(job_status.output_path, 'rb') as f:
+                self.assertEqual(f.read(), b'converted')
+            job_status.cleanup()
+
+            # Changing the input or the metadata invalidates the cached result
+            db.add_format(1, 'FMT1', BytesIO(b'changed book1fmt1'), run_hooks=False)
+            queue().cleanup()
+            self.assertEqual(len(started), 2)
+            db.set_field('title', {1: 'changed title'})
+            queue().cleanup()
+            self.assertEqual(len(started), 3)
+        finally:
+            rcache.clear()
+            convert._results_cache = orig_cache
@@ -7,10 +7,26 @@
 from http.cookiejar import CookieJar
 
 from mechanize import Browser as B
-from mechanize import HTTPSHandler
+from mechanize import HTTPHandler, HTTPSHandler
 
 
-class ModernHTTPSHandler(HTTPSHandler):
+class PooledHandler:
+    connection_pool = None
+    cache_default_ttl = None
+
+    def do_open(self, http_class, req):
+        if self.connection_pool is not None:
+            ans = self.connection_pool.open(self, http_class, req)
+            if ans is not None:
+                return ans
+        return super().do_open(http_class, req)
+
+
+class PooledHTTPHandler(PooledHandler, HTTPHandler):
+    pass
+
+
+class ModernHTTPSHandler(PooledHandler, HTTPSHandler):
     ssl_context = None
 
     def https_open(self, req):
@@ -33,10 +49,13 @@ class Browser(B):
     each thread has a browser clone. Every clone uses the same thread safe
     cookie jar. All clones share the same browser configuration.
 
-    Also adds support for fine-tuning SSL verification via an SSL context object.
+    Also adds support for fine-tuning SSL verification via an SSL context object
+    and for sharing keep-alive connections and an HTTP cache between clones, see
+    :meth:`set_connection_pool`.
     """
 
     handler_classes = B.handler_classes.copy()
+    handler_classes['http'] = PooledHTTPHandler  # type: ignore
     handler_classes['https'] = ModernHTTPSHandler  # type: ignore
 
     def __init__(self, *args, **kwargs):
@@ -125,6 +144,18 @@ def set_proxies(self, *args, **kwargs):
         B.set_proxies(self, *args, **kwargs)
         self._clone_actions['set_proxies'] = ('set_proxies', args, kwargs)
 
+    def set_connection_pool(self, pool, cache_default_ttl=None):
+        """
+        Use the specified :class:`calibre.utils.http_cache.ConnectionPool` for
+        HTTP and HTTPS requests. Pass None to stop using a pool.
+        cache_default_ttl overrides the number of seconds for which responses
+        without freshness information are reused by the cache of the pool.
+        """
+        for scheme in ('http', 'https'):
+            self._ua_handlers[scheme].connection_pool = pool  # type: ignore
+            self._ua_handlers[scheme].cache_default_ttl = cache_default_ttl  # type: ignore
+        self._clone_actions['set_connection_pool'] = ('set_connection_pool', (pool,), {'cache_default_ttl': cache_default_ttl})
+
     def add_password(self, *args, **kwargs):
         B.add_password(self, *args, **kwargs)
         self._clone_actions['add_password'] = ('add_password', args, kwargs)
@@ -12,14 +12,15 @@
 import tempfile
 import time
 import uuid
-from collections import Counter
+from collections import Counter, deque
+from contextlib import suppress
 from typing import NamedTuple
 
 from calibre import prints
 from calibre.constants import config_dir, filesystem_encoding, iswindows
 from calibre.utils.config import JSONConfig
 from calibre.utils.config_base import StringConfig, create_global_prefs, prefs
-from calibre.utils.filenames import samefile
+from calibre.utils.filenames import atomic_rename, samefile
 from calibre.utils.localization import _
 from polyglot.binary import as_hex_unicode
 from polyglot.builtins import error_message
@@ -68,25 +69,83 @@ def __exit__(self, *args):
         self.close()
 
 
+def read_file_for_export(path, max_size_in_memory, hash_large_files=False):
+    # Run in a thread pool, see Exporter.add_files(). Files larger than
+    # max_size_in_memory are not read, they are streamed into the export
+    # later, by the thread that writes the export.
+    with open(path, 'rb') as f:
+        st = os.fstat(f.fileno())
+        if st.st_size <= max_size_in_memory:
+            data = f.read()
+            return data, hashlib.sha1(data).hexdigest(), st.st_mtime
+        digest = None
+        if hash_large_files:
+            hasher = hashlib.sha1()
+            while chunk := f.read(1024 * 1024):
+                hasher.update(chunk)
+            digest = hasher.hexdigest()
+        return None, digest, st.st_mtime
+
+
 class Exporter:
     VERSION = 1
     TAIL_FMT = b'!II?'  # part_num, version, is_last
     MDATA_SZ_FMT = b'!Q'
     EXT = '.calibre-data'
+    JOURNAL = 'export-journal.json'
 
     @classmethod
     def tail_size(cls):
         return struct.calcsize(cls.TAIL_FMT)
 
-    def __init__(self, path_to_export_dir, part_size=None):
+    def __init__(self, path_to_export_dir, part_size=None, resume=False):
         # default part_size is 1 GB
         self.part_size = (1 << 30) if part_size is None else part_size
         self.base = os.path.abspath(path_to_export_dir)
         self.commited_parts = []
         self.current_part = None
         self.file_metadata = {}
+        self.resumed_file_metadata = {}
         self.tail_sz = self.tail_size()
         self.metadata: dict[str, object] = {'file_metadata': self.file_metadata}
+        if resume:
+            self.load_journal()
+
+    @property
+    def journal_path(self):
+        return os.path.join(self.base, self.JOURNAL)
+
+    def write_journal(self):
+        # Record the committed parts and the files in them, so that an
+        # interrupted export can be resumed, see load_journal()
+        raw = json.dumps({'parts': [os.path.basename(x) for x in self.commited_parts], 'file_metadata': self.file_metadata}, ensure_ascii=False)
+        tpath = self.journal_path + '.tmp'
+        with open(tpath, 'wb') as f:
+            f.write(raw.encode('utf-8'))
+        atomic_rename(tpath, self.journal_path)
+
+    def load_journal(self):
+        """
+        Continue an export that was interrupted. The parts committed before
+        the interruption are kept and files from them are re-used by
+        :meth:`add_files` if their mtime and digest have not changed.
+        """
+        try:
+            with open(self.journal_path, 'rb') as f:
+                journal = json.loads(f.read())
+        except FileNotFoundError:
+            return
+        parts = [os.path.join(self.base, x) for x in journal['parts']]
+        for x in parts:
+            if not os.path.exists(x):
+                raise ValueError(f'Cannot resume export, the part {x} is missing')
+        for name in os.listdir(self.base):
+            path = os.path.join(self.base, name)
+            if name.endswith(self.EXT) and path not in parts:
+                # Partially written part
+                os.remove(path)
+        self.commited_parts = parts
+        self.resumed_file_metadata = journal['file_metadata']
 
     def set_metadata(self, key, val):
         if key in self.metadata:
@@ -130,6 +189,11 @@ def commit_part(self, is_last=False):
             self.current_part.close()
             self.commited_parts.append(self.current_part.name)
             self.current_part = None
+            if is_last:
+                with suppress(FileNotFoundError):
+                    os.remove(self.journal_path)
+            else:
+                self.write_journal()
 
     def commit(self):
         raw = json.dumps(self.metadata, ensure_ascii=False)
@@ -153,6 +217,51 @@ def add_file(self, fileobj, key):
     def start_file(self, key, mtime=None):
         return FileDest(key, self, mtime=mtime)
 
+    def add_data(self, key, data, digest=None, mtime=None):
+        start_part_number, start_pos = self.current_pos()
+        written = self.write(data)
+        if len(data) != written:
+            raise RuntimeError(f'Exporter failed to write all data: {len(data)} != {written}')
+        self.file_metadata[key] = (start_part_number, start_pos, len(data), digest or hashlib.sha1(data).hexdigest(), mtime)
+
+    def add_files(self, files, max_workers=None, max_size_in_memory=16 * 1024 * 1024):
+        """
+        Add many files to the export. files must be an iterable of ``(key,
+        path, record_mtime)``. The files are read and hashed by a pool of
+        threads, but written in the order in which they are specified, so the
+        export is identical to the one produced by calling :meth:`add_file`
+        for every file. Files larger than max_size_in_memory are streamed
+        into the export directly.
+        """
+        from concurrent.futures import ThreadPoolExecutor
+
+        from calibre import detect_ncpus
+
+        max_workers = max_workers or min(8, detect_ncpus())
+        hash_large_files = bool(self.resumed_file_metadata)
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='Exporter') as executor:
+            for key, path, record_mtime in files:
+                pending.append((key, path, record_mtime, executor.submit(read_file_for_export, path, max_size_in_memory, hash_large_files)))
+                # Limit the amount of data read ahead
+                if len(pending) > 2 * max_workers:
+                    self._add_read_file(*pending.popleft())
+            while pending:
+                self._add_read_file(*pending.popleft())
+
+    def _add_read_file(self, key, path, record_mtime, future):
+        data, digest, mtime = future.result()
+        if not record_mtime:
+            mtime = None
+        prev = self.resumed_file_metadata.get(key)
+        if prev is not None and digest is not None and prev[3] == digest and prev[4] == mtime:
+            self.file_metadata[key] = tuple(prev)
+        elif data is None:
+            with open(path, 'rb') as f, self.start_file(key, mtime=mtime) as dest:
+                shutil.copyfileobj(f, dest)
+        else:
+            self.add_data(key, data, digest, mtime)
+
     def export_dir(self, path, dir_key):
         pkey = as_hex_unicode(dir_key)
         self.metadata[dir_key] = files = []
@@ -192,7 +301,12 @@ def all_known_libraries():
     return added
 
 
-def export(destdir, library_paths=None, dbmap=None, progress1=None, progress2=None, abort=None):
+def export(destdir, library_paths=None, dbmap=None, progress1=None, progress2=None, abort=None, resume=False):
+    """
+    Export the specified libraries and the calibre settings to destdir. If
+    resume is True and destdir contains an interrupted export, the export is
+    continued, re-using the files that were already exported.
+    """
     from calibre.db.backend import DB
     from calibre.db.cache import Cache
 
@@ -200,7 +314,7 @@ def export(destdir, library_paths=None, dbmap=None, progress1=None, progress2=No
         library_paths = all_known_libraries()
     dbmap = dbmap or {}
     dbmap = {os.path.normcase(os.path.abspath(k)): v for k, v in dbmap.items()}
-    exporter = Exporter(destdir)
+    exporter = Exporter(destdir, resume=resume)
     exporter.metadata['libraries'] = libraries = {}
     total = len(library_paths) + 1
     for i, (lpath, count) in enumerate(library_paths.items()):
@@ -12,7 +12,7 @@
 from math import ceil
 
 from calibre import force_unicode, prints, sanitize_file_name
-from calibre.constants import filesystem_encoding, ismacos, iswindows, preferred_encoding
+from calibre.constants import filesystem_encoding, islinux, ismacos, iswindows, preferred_encoding
 from calibre.utils.localization import _, get_udc
 
 
@@ -499,6 +499,49 @@ def hardlink_file(src, dest):
     os.link(src, dest)
 
 
+def reflink_file(src, dest):
+    """
+    Create dest as a copy-on-write clone of src. Only works on filesystems
+    that support reflinks, such as btrfs and XFS on Linux, raises OSError
+    otherwise.
+    """
+    if not islinux:
+        raise OSError(errno.EOPNOTSUPP, 'Reflinks are not supported on this platform')
+    import fcntl
+
+    FICLONE = 0x40049409
+    with open(src, 'rb') as s, open(dest, 'wb') as d:
+        try:
+            fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+        except OSError:
+            d.close()
+            with suppress(OSError):
+                os.remove(dest)
+            raise
+
+
+def copyfile_fast(src, dest, allow_hardlink=False):
+    """
+    Copy src to dest, cloning it with a reflink if the filesystem supports
+    it. If allow_hardlink is True, a hardlink is tried next. Note that a
+    hardlinked dest shares its contents with src, so only use allow_hardlink
+    when src is about to be deleted. Falls back to copying the file contents.
+    """
+    src, dest = make_long_path_useable(src), make_long_path_useable(dest)
+    try:
+        reflink_file(src, dest)
+        return
+    except OSError:
+        pass
+    if allow_hardlink:
+        try:
+            hardlink_file(src, dest)
+            return
+        except OSError:
+            pass
+    shutil.copyfile(src, dest)
+
+
 def nlinks_file(path):
     "Return number of hardlinks to the file"
     if iswindows:
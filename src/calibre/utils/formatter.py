@@ -2018,12 +2018,12 @@ def gpm_parser(self):
 
     # ######### a formatter that throws exceptions ############
 
-    def unsafe_format(self, format_spec, kwargs, book, strip_results=True, global_vars=None, python_context_object=None):
+    def unsafe_format(self, format_spec, kwargs, book, strip_results=True, global_vars=None, python_context_object=None, column_name=None, template_cache=None):
         state = self.save_state()
         try:
             self._caller = FormatterFuncsCaller(self)
             self.strip_results = strip_results
-            self.column_name = self.template_cache = None
+            self.column_name, self.template_cache = column_name, template_cache
             self.kwargs = kwargs
             self.book = book
             self.composite_values = {}
@@ -0,0 +1,496 @@
+#!/usr/bin/env python
+# License: GPLv3 Copyright: 2026, Kovid Goyal <kovid at kovidgoyal.net>
+
+"""
+A pool of keep-alive HTTP connections shared by browser clones and an on-disk
+cache of HTTP responses. The cache honors the Cache-Control, Expires and Vary
+headers, responses without freshness information are only reused if a default
+time to live is specified. Stale responses that have an ETag or Last-Modified
+header are revalidated with a conditional request. Responses that set cookies
+or are private and requests that send cookies or credentials are not cached.
+"""
+
+import hashlib
+import http.client
+import json
+import os
+import socket
+import time
+from collections import OrderedDict, defaultdict
+from email.utils import parsedate_to_datetime
+from io import BytesIO
+from threading import Lock
+
+from calibre.utils.filenames import atomic_rename
+
+# Headers that are not stored in the cache
+UNCACHED_HEADERS = frozenset(('set-cookie', 'connection', 'keep-alive', 'transfer-encoding'))
+# Headers in a 304 response that do not describe the stored response
+UNREVALIDATED_HEADERS = UNCACHED_HEADERS | {'content-length', 'content-type', 'content-encoding'}
+# Requests with these headers are specific to a user and are never cached
+UNCACHEABLE_REQUEST_HEADERS = frozenset(('cookie', 'authorization'))
+
+
+def parse_cache_control(val):
+    ans = {}
+    for part in (val or '').split(','):
+        k, _, v = part.partition('=')
+        k = k.strip().lower()
+        if k:
+            ans[k] = v.strip().strip('"')
+    return ans
+
+
+def http_timestamp(val):
+    try:
+        return parsedate_to_datetime(val).timestamp()
+    except Exception:
+        return None
+
+
+def headers_message(headers):
+    raw = ''.join(f'{k}: {v}\r\n' for k, v in headers) + '\r\n'
+    return http.client.parse_headers(BytesIO(raw.encode('iso-8859-1', 'replace')))
+
+
+def freshness_lifetime(headers, default_ttl):
+    """
+    Return the number of seconds for which a response with the specified
+    headers is fresh or None if it must not be stored.
+    """
+    cc = parse_cache_control(headers.get('Cache-Control'))
+    if 'no-store' in cc or 'private' in cc or headers.get('Set-Cookie') is not None or '*' in vary_names(headers):
+        return None
+    if 'no-cache' in cc:
+        return 0
+    for key in ('s-maxage', 'max-age'):
+        if key in cc:
+            try:
+                return max(0, int(cc[key]))
+            except ValueError:
+                return 0
+    expires = headers.get('Expires')
+    if expires is not None:
+        expires, date = http_timestamp(expires), http_timestamp(headers.get('Date')) or time.time()
+        return 0 if expires is None else max(0, expires - date)
+    return default_ttl
+
+
+def vary_names(headers):
+    return tuple(sorted({x.strip().lower() for v in headers.get_all('Vary') or () for x in v.split(',') if x.strip()}))
+
+
+def request_values(names, request_headers):
+    request_headers = {k.lower(): v for k, v in (request_headers or {}).items()}
+    return {k: request_headers.get(k) for k in names}
+
+
+class CachedResponse:
+    def __init__(self, url, status, reason, headers, body, expires, vary=None):
+        self.url, self.status, self.reason = url, status, reason
+        self.headers, self.body, self.expires = headers, body, expires
+        # The values of the request headers named by the Vary header
+        self.vary = vary or {}
+
+    @property
+    def is_fresh(self):
+        return time.time() < self.expires
+
+    @property
+    def validators(self):
+        ans = {}
+        for k, v in self.headers:
+            k = k.lower()
+            if k == 'etag':
+                ans['If-None-Match'] = v
+            elif k == 'last-modified':
+                ans['If-Modified-Since'] = v
+        return ans
+
+    def message(self):
+        return headers_message(self.headers)
+
+
+class HTTPCache:
+    """
+    :param location: The folder in which responses are stored
+    :param default_ttl: The number of seconds for which responses without
+        explicit freshness information are fresh, can be overridden per
+        request. Only use this for sites that are known not to return
+        different content for the same URL, such as error or bot check pages.
+    :param max_size: The maximum total size of stored responses, in bytes
+    """
+
+    def __init__(self, location, default_ttl=0, max_size=256 * 1024 * 1024):
+        self.location = location
+        self.default_ttl = default_ttl
+        self.max_size = max_size
+        self.lock = Lock()
+        self.entries = OrderedDict()
+        self.total_size = 0
+        os.makedirs(self.location, exist_ok=True)
+        existing = []
+        with os.scandir(self.location) as it:
+            for entry in it:
+                if entry.is_file() and not entry.name.startswith('.'):
+                    st = entry.stat()
+                    existing.append((st.st_mtime, entry.name, st.st_size))
+        for mtime, key, size in sorted(existing):
+            self.entries[key] = size
+            self.total_size += size
+        with self.lock:
+            self.expire()
+
+    def path_for_url(self, url):
+        return os.path.join(self.location, hashlib.sha1(url.encode('utf-8')).hexdigest())
+
+    def get(self, url, request_headers=None):
+        """
+        Return the stored response for url or None if there is no stored
+        response for url and the request headers named by its Vary header.
+        """
+        path = self.path_for_url(url)
+        try:
+            with open(path, 'rb') as f:
+                meta = json.loads(f.readline())
+                body = f.read()
+        except Exception:
+            return None
+        if meta.get('url') != url:
+            return None
+        vary = meta.get('vary') or {}
+        if vary and request_values(vary, request_headers) != vary:
+            return None
+        with self.lock:
+            key = os.path.basename(path)
+            if key in self.entries:
+                self.entries.move_to_end(key)
+        return CachedResponse(url, meta['status'], meta['reason'], [tuple(x) for x in meta['headers']], body, meta['expires'], vary)
+
+    def put(self, url, status, reason, headers, body, request_headers=None, default_ttl=None):
+        """
+        Store a response, headers is an :class:`http.client.HTTPMessage`.
+        Returns the stored response or None if the response is not cacheable.
+        """
+        lifetime = freshness_lifetime(headers, self.default_ttl if default_ttl is None else default_ttl)
+        if lifetime is None or status != 200:
+            return None
+        vary = request_values(vary_names(headers), request_headers)
+        headers = [(k, v) for k, v in headers.items() if k.lower() not in UNCACHED_HEADERS]
+        ans = CachedResponse(url, status, reason, headers, body, time.time() + lifetime, vary)
+        if lifetime <= 0 and not ans.validators:
+            # Would never be used
+            return None
+        self.write(ans)
+        return ans
+
+    def revalidated(self, cached, headers, request_headers=None, default_ttl=None):
+        """Update a stored response with the headers from a 304 response."""
+        updated = {k.lower(): (k, v) for k, v in headers.items() if k.lower() not in UNREVALIDATED_HEADERS}
+        merged = [updated.pop(k.lower(), (k, v)) for k, v in cached.headers] + list(updated.values())
+        merged_message = headers_message(merged)
+        lifetime = freshness_lifetime(merged_message, self.default_ttl if default_ttl is None else default_ttl)
+        if lifetime is None:
+            self.remove(cached.url)
+            return cached
+        cached.headers, cached.expires = merged, time.time() + lifetime
+        cached.vary = request_values(vary_names(merged_message), request_headers)
+        self.write(cached)
+        return cached
+
+    def write(self, cached):
+        meta = {'url': cached.url, 'status': cached.status, 'reason': cached.reason, 'headers': cached.headers, 'expires': cached.expires, 'vary': cached.vary}
+        raw = json.dumps(meta).encode('utf-8') + b'\n' + cached.body
+        if len(raw) > self.max_size:
+            return
+        path = self.path_for_url(cached.url)
+        key = os.path.basename(path)
+        tpath = os.path.join(self.location, f'.{key}-{os.getpid()}-{id(raw)}')
+        try:
+            with open(tpath, 'wb') as f:
+                f.write(raw)
+            atomic_rename(tpath, path)
+        except OSError:
+            return
+        with self.lock:
+            self.total_size += len(raw) - self.entries.pop(key, 0)
+            self.entries[key] = len(raw)
+            self.expire()
+
+    def remove(self, url):
+        key = os.path.basename(self.path_for_url(url))
+        with self.lock:
+            self.total_size -= self.entries.pop(key, 0)
+        try:
+            os.remove(os.path.join(self.location, key))
+        except OSError:
+            pass
+
+    def expire(self):
+        while self.total_size > self.max_size and self.entries:
+            key, size = self.entries.popitem(last=False)
+            self.total_size -= size
+            try:
+                os.remove(os.path.join(self.location, key))
+            except OSError:
+                pass
+
+
+class ConnectionPool:
+    """
+    Keeps idle HTTP connections open so that later requests to the same host
+    do not need to connect and do a TLS handshake again. Only GET requests
+    without a body, not going through a proxy tunnel, use the pool, everything
+    else is left to the normal mechanize handlers.
+
+    :param max_idle_per_host: The maximum number of idle connections kept open per host
+    :param cache: An optional :class:`HTTPCache` used for GET requests
+    """
+
+    def __init__(self, max_idle_per_host=4, cache=None):
+        self.max_idle_per_host = max_idle_per_host
+        self.cache = cache
+        self.lock = Lock()
+        self.idle = defaultdict(list)
+        self.connections_created = 0
+
+    def acquire(self, key, factory, host_port, timeout):
+        with self.lock:
+            idle = self.idle[key]
+            conn = idle.pop() if idle else None
+        if conn is None:
+            with self.lock:
+                self.connections_created += 1
+            return factory(host_port, timeout=timeout), False
+        conn.timeout = timeout
+        if conn.sock is not None and timeout is not socket._GLOBAL_DEFAULT_TIMEOUT:
+            conn.sock.settimeout(timeout)
+        return conn, True
+
+    def release(self, key, conn):
+        with self.lock:
+            idle = self.idle[key]
+            if len(idle) < self.max_idle_per_host:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def close(self):
+        with self.lock:
+            conns = [c for idle in self.idle.values() for c in idle]
+            self.idle.clear()
+        for c in conns:
+            c.close()
+
+    def open(self, handler, http_class, req):
+        """
+        Perform the request, returning a response object, or return None if
+        the request cannot use the pool.
+        """
+        if req.data is not None or req._tunnel_host or req.get_method() != 'GET':
+            return None
+        from mechanize import URLError
+        from mechanize._response import closeable_response
+
+        host_port = req.get_host()
+        if not host_port:
+            raise URLError('no host given')
+        url = req.get_full_url()
+        headers = dict(req.headers)
+        headers.update(req.unredirected_hdrs)
+        headers = {k.title(): v for k, v in headers.items()}
+        cache = self.cache
+        if cache is not None and any(k.lower() in UNCACHEABLE_REQUEST_HEADERS for k in headers):
+            cache = None
+        default_ttl = getattr(handler, 'cache_default_ttl', None)
+        cached = None if cache is None else cache.get(url, headers)
+        if cached is not None and cached.is_fresh:
+            return closeable_response(BytesIO(cached.body), cached.message(), url, cached.status, cached.reason)
+
+        request_headers = dict(headers)
+        if cached is not None:
+            headers.update(cached.validators)
+        headers['Connection'] = 'keep-alive'
+        if handler.parent.finalize_request_headers is not None:
+            handler.parent.finalize_request_headers(req, headers)
+
+        key = (req.get_type(), host_port, id(getattr(handler, 'ssl_context', None)))
+        while True:
+            conn, reused = self.acquire(key, http_class, host_port, req.timeout)
+            conn.set_debuglevel(handler._debuglevel)
+            try:
+                conn.request('GET', req.get_selector(), None, headers)
+                r = conn.getresponse()
+                body = r.read()
+            except (OSError, http.client.HTTPException) as err:
+                conn.close()
+                if reused:
+                    # The server closed the idle connection, retry on a new one
+                    continue
+                raise URLError(err)
+            break
+        if r.will_close:
+            conn.close()
+        else:
+            self.release(key, conn)
+
+        if cache is not None:
+            if r.status == 304 and cached is not None:
+                cached = cache.revalidated(cached, r.msg, request_headers, default_ttl)
+                msg = cached.message()
+                # Cookies set by the 304 response are not stored in the cache,
+                # pass them on so that the cookie processor sees them
+                for val in r.msg.get_all('Set-Cookie') or ():
+                    msg['Set-Cookie'] = val
+                return closeable_response(BytesIO(cached.body), msg, url, cached.status, cached.reason)
+            cache.put(url, r.status, r.reason, r.msg, body, request_headers, default_ttl)
+        return closeable_response(BytesIO(body), r.msg, url, r.status, r.reason, getattr(r, 'version', None))
+
+
+def find_tests():
+    import tempfile
+    import unittest
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from threading import Thread
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *a):
+            pass
+
+        def setup(self):
+            super().setup()
+            self.server.connections += 1
+
+        def do_GET(self):
+            self.server.requests.append(self.path)
+            self.server.cookies.append(self.headers.get('Cookie'))
+            etag = '"v1"'
+            if self.headers.get('If-None-Match') == etag:
+                self.send_response(304)
+                self.send_header('Cache-Control', 'max-age=60')
+                if self.path == '/etag-cookie':
+                    self.send_header('Set-Cookie', 'c=d')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            body = f'response for {self.path}'.encode()
+            if self.path == '/vary':
+                body += self.headers.get('Accept-Language', '').encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain')
+            self.send_header('Content-Length', str(len(body)))
+            if self.path in ('/fresh', '/cookie', '/vary'):
+                self.send_header('Cache-Control', 'max-age=60')
+            if self.path == '/cookie':
+                self.send_header('Set-Cookie', 'a=b')
+            elif self.path == '/private':
+                self.send_header('Cache-Control', 'private, max-age=60')
+            elif self.path == '/vary':
+                self.send_header('Vary', 'Accept-Language')
+            elif self.path in ('/etag', '/etag-cookie'):
+                self.send_header('Cache-Control', 'no-cache')
+                self.send_header('ETag', etag)
+            elif self.path == '/nostore':
+                self.send_header('Cache-Control', 'no-store')
+            self.end_headers()
+            self.wfile.write(body)
+
+    class HTTPCacheTest(unittest.TestCase):
+        def setUp(self):
+            self.tdir = tempfile.TemporaryDirectory()
+            self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+            self.server.connections, self.server.requests, self.server.cookies = 0, [], []
+            self.thread = Thread(target=self.server.serve_forever, daemon=True)
+            self.thread.start()
+            self.base = f'http://127.0.0.1:{self.server.server_address[1]}'
+
+        def tearDown(self):
+            self.server.shutdown()
+            self.server.server_close()
+            self.tdir.cleanup()
+
+        def browser(self, pool, **kw):
+            from calibre import browser
+
+            br = browser()
+            br.set_connection_pool(pool, **kw)
+            return br.clone_browser()
+
+        def test_connection_pool(self):
+            pool = ConnectionPool()
+            br = self.browser(pool)
+            for i in range(5):
+                self.assertEqual(br.open_novisit(f'{self.base}/{i}').read(), f'response for /{i}'.encode())
+            self.assertEqual(pool.connections_created, 1)
+            self.assertEqual(self.server.connections, 1)
+            pool.close()
+            self.assertEqual(br.open_novisit(f'{self.base}/x').read(), b'response for /x')
+            pool.close()
+
+        def test_http_cache(self):
+            cache = HTTPCache(self.tdir.name, default_ttl=60)
+            pool = ConnectionPool(cache=cache)
+            br = self.browser(pool)
+
+            def get(path, br=br, **headers):
+                from mechanize import Request
+
+                return br.open_novisit(Request(self.base + path, headers=headers)).read()
+
+            for path in ('/fresh', '/default', '/etag', '/nostore', '/private'):
+                self.assertEqual(get(path), f'response for {path}'.encode())
+                self.assertEqual(get(path), f'response for {path}'.encode())
+            self.assertEqual(self.server.requests, ['/fresh', '/default', '/etag', '/etag', '/nostore', '/nostore', '/private', '/private'])
+            # Requests with cookies or credentials do not use the cache
+            del self.server.requests[:]
+            get('/fresh', Cookie='x=y'), get('/fresh', Authorization='Basic eDp5')
+            self.assertEqual(self.server.requests, ['/fresh', '/fresh'])
+            # The default time to live can be overridden per browser
+            del self.server.requests[:]
+            br0 = self.browser(pool, cache_default_ttl=0)
+            get('/default0', br0), get('/default0', br0), get('/default0')
+            self.assertEqual(self.server.requests, ['/default0', '/default0', '/default0'])
+            # Responses are only reused for requests with the same values
+            # for the headers named by Vary
+            del self.server.requests[:]
+            self.assertEqual(get('/vary', **{'Accept-Language': 'en'}), b'response for /varyen')
+            self.assertEqual(get('/vary', **{'Accept-Language': 'en'}), b'response for /varyen')
+            self.assertEqual(get('/vary', **{'Accept-Language': 'fr'}), b'response for /varyfr')
+            self.assertEqual(get('/vary'), b'response for /vary')
+            self.assertEqual(self.server.requests, ['/vary', '/vary', '/vary'])
+            # The 304 response made the /etag response fresh
+            del self.server.requests[:]
+            get('/etag')
+            self.assertEqual(self.server.requests, [])
+            # Responses that set cookies are not stored and the cookie is sent
+            # with later requests, so they do not use the cache either
+            get('/cookie'), get('/fresh')
+            self.assertEqual(self.server.requests, ['/cookie', '/fresh'])
+            self.assertIsNone(cache.get(self.base + '/cookie'))
+            # Responses that are never fresh are only stored if they can be revalidated
+            cache0 = HTTPCache(os.path.join(self.tdir.name, 'zero'))
+            self.assertIsNone(cache0.put('/x', 200, 'OK', headers_message([]), b'x'))
+            self.assertIsNotNone(cache0.put('/x', 200, 'OK', headers_message([('ETag', '"1"')]), b'x'))
+            # The cache persists across instances and is bounded in size
+            cache = HTTPCache(self.tdir.name, default_ttl=0, max_size=cache.total_size)
+            self.assertIsNotNone(cache.get(self.base + '/fresh'))
+            cache.max_size = 0
+            cache.expire()
+            self.assertIsNone(cache.get(self.base + '/fresh'))
+            pool.close()
+
+        def test_revalidation_cookies(self):
+            pool = ConnectionPool(cache=HTTPCache(self.tdir.name))
+            br = self.browser(pool)
+            url = self.base + '/etag-cookie'
+            self.assertEqual(br.open_novisit(url).read(), b'response for /etag-cookie')
+            # Revalidated with a 304 response that sets a cookie
+            self.assertEqual(br.open_novisit(url).read(), b'response for /etag-cookie')
+            br.open_novisit(self.base + '/x').read()
+            self.assertEqual(self.server.requests, ['/etag-cookie', '/etag-cookie', '/x'])
+            self.assertEqual(self.server.cookies, [None, None, 'c=d'])
+            pool.close()
+
+    return unittest.defaultTestLoader.loadTestsFromTestCase(HTTPCacheTest)
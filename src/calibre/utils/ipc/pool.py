@@ -20,6 +20,7 @@
 WorkerResult = namedtuple('WorkerResult', 'id result is_terminal_failure worker')
 TerminalFailure = namedtuple('TerminalFailure', 'message tb job_id')
 File = namedtuple('File', 'name')
+WorkerInit = namedtuple('WorkerInit', 'module func')
 
 MAX_SIZE = 30 * 1024 * 1024  # max size of data to send over the connection (old versions of windows cannot handle arbitrary data lengths)
 
@@ -91,6 +92,7 @@ def __init__(self, p, conn, events, name):
         self.process, self.conn = p, conn
         self.events = events
         self.name = name or ''
+        self.jobs_done = 0
 
     def __call__(self, job):
         eintr_retry_call(self.conn.send_bytes, pickle_dumps(job))
@@ -118,9 +120,24 @@ def set_common_data(self, data):
 class Pool(Thread):
     daemon = True
 
-    def __init__(self, max_workers=None, name=None):
+    def __init__(self, max_workers=None, name=None, max_jobs_per_worker=None, max_worker_memory=None, worker_init=None):
+        """
+        :param max_jobs_per_worker: If not None, worker processes are replaced
+            by fresh ones after running this many jobs.
+        :param max_worker_memory: If not None, worker processes are replaced by
+            fresh ones once their resident memory exceeds this many bytes.
+        :param worker_init: If not None, a ``(module, func)`` pair, as for jobs.
+            The function is called with no arguments in every worker process
+            when it starts, before it runs any jobs. All max_workers workers
+            are then started immediately and replaced as soon as they are
+            recycled, so that jobs always find initialized workers.
+        """
         Thread.__init__(self, name=name)
         self.max_workers = max_workers or detect_ncpus()
+        self.max_jobs_per_worker = max_jobs_per_worker
+        self.max_worker_memory = max_worker_memory
+        self.worker_init = None if worker_init is None else pickle_dumps(WorkerInit(*worker_init))
+        self.workers_recycled = 0
         self.available_workers = []
         self.busy_workers = {}
         self.pending_jobs = []
@@ -190,6 +207,8 @@ def create_worker(self):
         sys.stdout.flush()
         p.stdin.close()
         w = Worker(p, b, self.events, self.name)
+        if self.worker_init is not None:
+            w.set_common_data(self.worker_init)
         if self.common_data != pickle_dumps(None):
             w.set_common_data(self.common_data)
         return w
@@ -207,8 +226,9 @@ def start_worker(self):
             return False
 
     def run(self):
-        if self.start_worker() is False:
-            return
+        for i in range(1 if self.worker_init is None else self.max_workers):
+            if self.start_worker() is False:
+                return
 
         while True:
             event = self.events.get()
@@ -229,14 +249,24 @@ def handle_event(self, event):
             return self.run_job(job)
         elif isinstance(event, WorkerResult):
             worker_result = event
-            self.busy_workers.pop(worker_result.worker, None)
-            self.available_workers.append(worker_result.worker)
+            worker = worker_result.worker
+            self.busy_workers.pop(worker, None)
+            worker.jobs_done += 1
+            recycled = not worker_result.is_terminal_failure and self.needs_recycling(worker)
+            if recycled:
+                self.recycle_worker(worker)
+            else:
+                self.available_workers.append(worker)
             self.tracker.task_done()
             if worker_result.is_terminal_failure:
                 self.terminal_failure = TerminalFailure('Worker process crashed while executing job', worker_result.result.traceback, worker_result.id)
                 self.terminal_error()
                 return False
             self.results.put(worker_result)
+            if recycled and self.worker_init is not None and not self.shutting_down:
+                # Start the replacement now, so that it is initialized before the next job arrives
+                if self.start_worker() is False:
+                    return False
         else:
             self.common_data = pickle_dumps(event)
             if len(self.common_data) > MAX_SIZE:
@@ -254,10 +284,54 @@ def handle_event(self, event):
                     self.terminal_error()
                     return False
 
-        while self.pending_jobs and self.available_workers:
+        while self.pending_jobs and not self.shutting_down:
+            if not self.available_workers:
+                # Workers may have been recycled, start replacements
+                if len(self.busy_workers) >= self.max_workers:
+                    break
+                if self.start_worker() is False:
+                    return False
+                if not self.available_workers:
+                    break
             if self.run_job(self.pending_jobs.pop()) is False:
                 return False
 
+    def needs_recycling(self, worker):
+        if self.max_jobs_per_worker is not None and worker.jobs_done >= self.max_jobs_per_worker:
+            return True
+        if self.max_worker_memory is not None:
+            import psutil
+
+            try:
+                rss = psutil.Process(worker.process.pid).memory_info().rss
+            except psutil.Error:
+                return True
+            return rss > self.max_worker_memory
+        return False
+
+    def recycle_worker(self, worker):
+        self.workers_recycled += 1
+        try:
+            worker(None)
+        except Exception:
+            pass
+        try:
+            worker.conn.close()
+        except Exception:
+            pass
+
+        def reap():
+            try:
+                worker.process.wait(10)
+            except Exception:
+                if worker.process.poll() is None:
+                    try:
+                        worker.process.kill()
+                    except OSError:
+                        pass
+
+        Thread(target=reap, name='ReapRecycledPoolWorker', daemon=True).start()
+
     def run_job(self, job):
         worker = self.available_workers.pop()
         try:
@@ -333,9 +407,19 @@ def join():
                 pass
 
 
-def worker_main(conn):
+def load_function(module, func):
     from importlib import import_module
 
+    if '\n' in module:
+        import_module('calibre.customize.ui')  # Load plugins
+        from calibre.utils.ipc.simple_worker import compile_code
+
+        mod = compile_code(module)
+        return mod[func]
+    return getattr(import_module(module), func)
+
+
+def worker_main(conn):
     common_data = None
     while True:
         try:
@@ -357,18 +441,19 @@ def worker_main(conn):
                 with open(job.name, 'rb') as f:
                     common_data = f.read()
                 common_data = pickle_loads(common_data)
+            elif isinstance(job, WorkerInit):
+                try:
+                    load_function(job.module, job.func)()
+                except Exception:
+                    prints('Failed to initialize worker', file=sys.stderr)
+                    import traceback
+
+                    traceback.print_exc()
             else:
                 common_data = job
             continue
         try:
-            if '\n' in job.module:
-                import_module('calibre.customize.ui')  # Load plugins
-                from calibre.utils.ipc.simple_worker import compile_code
-
-                mod = compile_code(job.module)
-                func = mod[job.func]
-            else:
-                func = getattr(import_module(job.module), job.func)
+            func = load_function(job.module, job.func)
             if common_data is not None:
                 job.kwargs['common_data'] = common_data
             result = func(*job.args, **job.kwargs)
@@ -403,6 +488,10 @@ def test_write():
     print('Printing to stdout in worker')
 
 
+def test_init():
+    os.environ['CALIBRE_TEST_POOL_WORKER_INIT'] = str(os.getpid())
+
+
 def test():
     def get_results(pool, ignore_fail=False):
         ans = {}
@@ -482,6 +571,18 @@ def get_results(pool, ignore_fail=False):
         raise SystemExit('No expected terminal failure')
     p.shutdown(), p.join()
 
+    # Test that recycled workers are replaced by initialized workers
+    p = Pool(name='Test', max_workers=2, max_jobs_per_worker=3, worker_init=(__name__, 'test_init'))
+    for i in range(20):
+        p(i, 'import os\ndef x(i):\n return os.getpid(), os.environ.get("CALIBRE_TEST_POOL_WORKER_INIT")', 'x', i)
+    p.wait_for_tasks(30)
+    results = [r.value for r in get_results(p).values()]
+    if len(results) != 20 or any(str(pid) != init_pid for pid, init_pid in results):
+        raise SystemExit(f'Workers were not initialized: {results!r}')
+    if p.workers_recycled < 5 or len({pid for pid, init_pid in results}) < 6:
+        raise SystemExit(f'Workers were not recycled: {results!r}')
+    p.shutdown(), p.join()
+
     # Test shutting down with busy workers
     p = Pool(name='Test')
     for i in range(1000):
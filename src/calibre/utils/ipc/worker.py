@@ -26,7 +26,6 @@
     'store-dialog': ('calibre.gui_launch', 'store_dialog', None),
     'toc-dialog': ('calibre.gui_launch', 'toc_dialog', None),
     'webengine-dialog': ('calibre.gui_launch', 'webengine_dialog', None),
-    'render_pages': ('calibre.ebooks.comic.input', 'render_pages', 'notification'),
     'gui_convert': ('calibre.gui2.convert.gui_conversion', 'gui_convert', 'notification'),
     'gui_convert_recipe': ('calibre.gui2.convert.gui_conversion', 'gui_convert_recipe', 'notification'),
     'gui_polish': ('calibre.ebooks.oeb.polish.main', 'gui_polish', None),
@@ -691,6 +691,9 @@ def ok(x):
         a(find_tests())
         from calibre.gui2.library.test_annotations import find_tests
 
+        a(find_tests())
+        from calibre.gui2.test_device import find_tests
+
         a(find_tests())
         from calibre.ebooks.html_entities import find_tests
 
@@ -753,6 +756,36 @@ def ok(x):
         a(find_tests())
         from calibre.gui2.listener import find_tests
 
+        a(find_tests())
+        from calibre.devices.smart_device_app.client import find_tests
+
+        a(find_tests())
+        from calibre.devices.smart_device_app.metadata_cache import find_tests
+
+        a(find_tests())
+        from calibre.devices.mtp.filesystem_cache import find_tests
+
+        a(find_tests())
+        from calibre.utils.http_cache import find_tests
+
+        a(find_tests())
+        from calibre.ebooks.metadata.sources.scheduler import find_tests
+
+        a(find_tests())
+        from calibre.web.fetch.simple import find_tests
+
+        a(find_tests())
+        from calibre.ebooks.comic.input import find_tests
+
+        a(find_tests())
+        from calibre.ebooks.conversion.service import find_tests
+
+        a(find_tests())
+        from calibre.ebooks.conversion.result_cache import find_tests
+
+        a(find_tests())
+        from calibre.devices.usbms.driver import find_tests
+
         a(find_tests())
         if iswindows:
             from calibre.utils.windows.wintest import find_tests
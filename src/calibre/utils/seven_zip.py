@@ -52,6 +52,38 @@ def read_file(archive, name):
     raise KeyError(f'No file named {name} in archive')
 
 
+class StreamingWriter(io.BytesIO):
+    # py7zr closes the writer for a file as soon as it has been decompressed
+
+    def __init__(self, name, callback):
+        super().__init__()
+        self.name, self.callback = name, callback
+
+    def close(self):
+        if not self.closed:
+            data = self.getvalue()
+            super().close()
+            self.callback(self.name, data)
+
+
+def stream_files(path, names, callback):
+    """
+    Decompress the specified files from the archive at path in a single pass,
+    calling ``callback(name, data)`` for each file as soon as it has been
+    decompressed, so that only one file is held in memory at a time.
+    """
+    lookup = {n.lstrip('/'): n for n in names}
+
+    class Factory:
+        def create(self, filename):
+            return StreamingWriter(lookup.get(filename, filename), callback)
+
+    # Passing a file object rather than a path makes py7zr decompress in this
+    # thread, so callback is never called concurrently
+    with open(path, 'rb') as f, open_archive(f) as ar:
+        ar.extract(targets=names, factory=Factory())
+
+
 def extract_member(path_or_stream, match=None, name=None):
     if iswindows and name is not None:
         name = name.replace(os.sep, '/')
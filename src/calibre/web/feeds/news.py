@@ -8,6 +8,7 @@
 import os
 import re
 import sys
+import threading
 import time
 import traceback
 from collections import defaultdict
@@ -15,7 +16,7 @@
 from typing import cast
 from urllib.parse import urlparse, urlsplit
 
-from calibre import __appname__, as_unicode, browser, force_unicode, iswindows, preferred_encoding, random_user_agent, strftime
+from calibre import __appname__, as_unicode, browser, force_unicode, human_readable, iswindows, preferred_encoding, random_user_agent, strftime
 from calibre.ebooks.BeautifulSoup import BeautifulSoup, CData, NavigableString, Tag
 from calibre.ebooks.metadata import MetaInformation
 from calibre.ebooks.metadata.opf2 import OPFCreator
@@ -29,7 +30,7 @@
 from calibre.utils.threadpool import NoResultsPending, ThreadPool, WorkRequest
 from calibre.web import Recipe
 from calibre.web.feeds import Feed, feed_from_xml, feeds_from_index, templates
-from calibre.web.fetch.simple import AbortArticle, RecursiveFetcher
+from calibre.web.fetch.simple import AbortArticle, RecursiveFetcher, prune_processed_images
 from calibre.web.fetch.simple import option_parser as web2disk_option_parser
 from calibre.web.fetch.utils import prepare_masthead_image
 
@@ -111,6 +112,19 @@ class BasicNewsRecipe(Recipe):
     #: Automatically reduced to 1 if :attr:`BasicNewsRecipe.delay` > 0
     simultaneous_downloads: int = 5
 
+    #: Number of images and stylesheets of an article that are downloaded
+    #: simultaneously. Set to 1 if the server is picky. When
+    #: :attr:`BasicNewsRecipe.delay` > 0, downloads from the same host are
+    #: still done one at a time, with the delay between them.
+    simultaneous_resource_downloads: int = 4
+
+    #: Keep the files downloaded by this recipe in a cache between downloads.
+    #: The server is then only asked to send files that have changed since the
+    #: last download, using the ETag and Last-Modified headers it sent. Images
+    #: that have not changed are also not converted and compressed again. Set
+    #: to False if the server sends wrong caching information.
+    cache_downloads: bool = True
+
     #: Timeout for fetching files from server in seconds
     timeout = 120.0
 
@@ -583,6 +597,8 @@ def get_browser(self, *a, **kw):
         br.addheaders += [('Accept', '*/*')]
         if self.handle_gzip:
             br.set_handle_gzip(True)
+        if getattr(self, 'connection_pool', None) is not None:
+            br.set_connection_pool(self.connection_pool)
         return br
 
     def clone_browser(self, br):
@@ -975,6 +991,24 @@ def __init__(self, options, log, progress_reporter):
             if self.needs_subscription != 'optional':
                 raise ValueError(_('The "%s" recipe needs a username and password.') % self.title)
 
+        from calibre.utils.http_cache import ConnectionPool, HTTPCache
+
+        self.download_cache_dir = http_cache = None
+        if self.cache_downloads:
+            from calibre.constants import cache_dir
+            from calibre.utils.filenames import ascii_filename
+
+            self.download_cache_dir = os.path.join(cache_dir(), 'news-downloads', ascii_filename(self.title))
+            try:
+                # Every response is revalidated unless the server says how long it is fresh for
+                http_cache = HTTPCache(os.path.join(self.download_cache_dir, 'http'), default_ttl=0, max_size=128 * 1024 * 1024)
+            except OSError:
+                self.log.exception('Failed to open the download cache, not using it')
+                self.download_cache_dir = None
+        # Keep-alive connections shared by all the browsers of this recipe
+        self.connection_pool = ConnectionPool(max_idle_per_host=max(self.simultaneous_downloads, self.simultaneous_resource_downloads), cache=http_cache)
+        self.fetch_stats = {}
+        self.fetch_stats_lock = threading.Lock()
         self.browser = self.get_browser()
         self.image_map, self.image_counter = {}, 1
         self.css_map = {}
@@ -1020,9 +1054,13 @@ def __init__(self, options, log, progress_reporter):
             'compress_news_images_max_size',
             'compress_news_images_auto_size',
             'scale_news_images',
+            'simultaneous_resource_downloads',
         ):
             setattr(self.web2disk_options, extra, getattr(self, extra))
 
+        if self.download_cache_dir is not None:
+            self.web2disk_options.processed_images_dir = os.path.join(self.download_cache_dir, 'images')
+            prune_processed_images(self.web2disk_options.processed_images_dir)
         self.web2disk_options.postprocess_html = self._postprocess_html
         self.web2disk_options.preprocess_image = self.preprocess_image
         self.web2disk_options.encoding = self.encoding
@@ -1151,6 +1189,14 @@ def download(self):
         try:
             res = self.build_index()
             self.report_progress(1, _('Download finished'))
+            if self.fetch_stats:
+                fs = self.fetch_stats
+                self.log(
+                    f'Fetched {fs["requests"]} files ({human_readable(fs["bytes"])}) for articles in {fs["fetch_time"]:.1f} seconds of download time,'
+                    f' waited {fs["delay_time"]:.1f} seconds because of the delay'
+                )
+                if fs.get('reused_images'):
+                    self.log(f'Reused {fs["reused_images"]} unchanged images from the previous download')
             if self.failed_downloads:
                 self.log.warning(_('Failed to download the following articles:'))
                 for feed, article, debug in self.failed_downloads:
@@ -1169,6 +1215,7 @@ def download(self):
             return res
         finally:
             self.cleanup()
+            self.connection_pool.close()
 
     @property
     def lang_for_html(self):
@@ -1257,7 +1304,12 @@ def _fetch_article(self, url, dir_, f, a, num_of_feeds, preloaded=None):
         fetcher.image_url_processor = self.image_url_processor
         if preloaded is not None:
             fetcher.preloaded_urls[url] = preloaded
-        res, path, failures = fetcher.start_fetch(url), fetcher.downloaded_paths, fetcher.failed_links
+        try:
+            res, path, failures = fetcher.start_fetch(url), fetcher.downloaded_paths, fetcher.failed_links
+        finally:
+            with self.fetch_stats_lock:
+                for k, v in fetcher.fetch_stats.items():
+                    self.fetch_stats[k] = self.fetch_stats.get(k, 0) + v
         if not res or not os.path.exists(res):
             msg = _('Could not fetch article.') + ' '
             if self.debug:
@@ -6,6 +6,7 @@
 UTF-8 encoding with any charset declarations removed.
 """
 
+import hashlib
 import os
 import re
 import socket
@@ -14,6 +15,9 @@
 import time
 import traceback
 from base64 import standard_b64decode
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from http.client import responses
 from urllib.error import URLError
 from urllib.parse import quote, urljoin, urlparse, urlsplit, urlunparse, urlunsplit
@@ -24,7 +28,7 @@
 from calibre.ebooks.BeautifulSoup import BeautifulSoup
 from calibre.ebooks.chardet import xml_to_unicode
 from calibre.utils.config import OptionParser
-from calibre.utils.filenames import ascii_filename
+from calibre.utils.filenames import ascii_filename, atomic_rename
 from calibre.utils.imghdr import what
 from calibre.utils.localization import _
 from calibre.utils.logging import Log
@@ -82,6 +86,28 @@ def basename(url):
     return res
 
 
+def prune_processed_images(path, max_age_days=30):
+    """
+    Delete the processed images stored in path that have not been used in the
+    specified number of days. Returns the number of images deleted.
+    """
+    cutoff = time.time() - max_age_days * 24 * 60 * 60
+    ans = 0
+    try:
+        it = os.scandir(path)
+    except OSError:
+        return ans
+    with it:
+        for entry in it:
+            try:
+                if entry.is_file() and entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+                    ans += 1
+            except OSError:
+                pass
+    return ans
+
+
 def save_soup(soup, target):
     for meta in soup.findAll('meta', content=True):
         if 'charset' in meta['content'].lower():
@@ -147,7 +173,17 @@ def __init__(self, options, log, image_map={}, css_map={}, job_info=None):
         self.filter_regexps = [re.compile(i, re.IGNORECASE) for i in options.filter_regexps]
         self.max_files = options.max_files
         self.delay = options.delay
-        self.last_fetch_at = 0.0
+        # Time of the last fetch from each host, used to enforce the delay
+        self.last_fetch_at = defaultdict(float)
+        self.host_locks = defaultdict(threading.Lock)
+        self.host_locks_lock = threading.Lock()
+        self.simultaneous_downloads = max(1, getattr(options, 'simultaneous_resource_downloads', 1))
+        self.prefetched = {}
+        self.stats_lock = threading.Lock()
+        self.fetch_stats = {'requests': 0, 'bytes': 0, 'fetch_time': 0.0, 'delay_time': 0.0, 'reused_images': 0}
+        # Images already converted and compressed in a previous download are
+        # reused from this folder, if set
+        self.processed_images_dir = getattr(options, 'processed_images_dir', None)
         self.filemap = {}
         self.imagemap = image_map
         self.imagemap_lock = threading.RLock()
@@ -236,13 +272,63 @@ def remove_beyond(tag, next):
                 tag.extract()
         return self.preprocess_html_ext(soup)
 
-    def fetch_url(self, url):
+    @contextmanager
+    def wait_for_host(self, url):
+        delay = self.get_delay(url)
+        if not delay:
+            yield
+            return
+        # Downloads from a host are serialized when there is a delay
+        host = urlsplit(url).netloc
+        with self.host_locks_lock:
+            lock = self.host_locks[host]
+        with lock:
+            delta = time.monotonic() - self.last_fetch_at[host]
+            if delta < delay:
+                time.sleep(delay - delta)
+                with self.stats_lock:
+                    self.fetch_stats['delay_time'] += delay - delta
+            try:
+                yield
+            finally:
+                self.last_fetch_at[host] = time.monotonic()
+
+    def prefetch(self, urls):
+        """
+        Download urls concurrently, so that later calls to :meth:`fetch_url`
+        for them return without waiting. The delay is respected for each
+        host.
+        """
+        urls = [u for u in dict.fromkeys(urls) if u not in self.prefetched and u not in self.preloaded_urls and not u.startswith(('data:', 'file:'))]
+        if self.simultaneous_downloads < 2 or len(urls) < 2 or not callable(getattr(self.browser, 'clone_browser', None)):
+            return
+        tls = threading.local()
+
+        def fetch(url):
+            br = getattr(tls, 'browser', None)
+            if br is None:
+                br = tls.browser = self.browser.clone_browser()
+            try:
+                return url, self.fetch_url(url, br)
+            except Exception as err:
+                return url, err
+
+        with ThreadPoolExecutor(min(self.simultaneous_downloads, len(urls)), thread_name_prefix='RecursiveFetcher') as pool:
+            for url, result in pool.map(fetch, urls):
+                self.prefetched[url] = result
+
+    def fetch_url(self, url, br=None):
         data = None
         q = self.preloaded_urls.pop(url, None)
         if q is not None:
             ans = response(q)
             ans.newurl = url
             return ans
+        q = self.prefetched.pop(url, None)
+        if q is not None:
+            if isinstance(q, Exception):
+                raise q
+            return q
         st = time.monotonic()
 
         is_data_url = url.startswith('data:')
@@ -271,12 +357,18 @@ def fetch_url(self, url):
             self.log.debug(f'Fetched {url} in {time.monotonic() - st:.1f} seconds')
             return data
 
-        delta = time.monotonic() - self.last_fetch_at
-        delay = self.get_delay(url)
-        if delta < delay:
-            time.sleep(delay - delta)
-        url = canonicalize_url(url)
-        open_func = getattr(self.browser, 'open_novisit', self.browser.open)
+        with self.wait_for_host(url):
+            st = time.monotonic()
+            data = self.open_url(canonicalize_url(url), br or self.browser)
+        with self.stats_lock:
+            self.fetch_stats['requests'] += 1
+            self.fetch_stats['bytes'] += len(data)
+            self.fetch_stats['fetch_time'] += time.monotonic() - st
+        self.log.debug(f'Fetched {url} in {time.monotonic() - st:f} seconds')
+        return data
+
+    def open_url(self, url, br):
+        open_func = getattr(br, 'open_novisit', br.open)
         try:
             with closing(open_func(url, timeout=self.timeout)) as f:
                 data = response(f.read() + f.read())
@@ -299,9 +391,6 @@ def fetch_url(self, url):
                     data.newurl = f.geturl()
             else:
                 raise err
-        finally:
-            self.last_fetch_at = time.monotonic()
-        self.log.debug(f'Fetched {url} in {time.monotonic() - st:f} seconds')
         return data
 
     def start_fetch(self, url):
@@ -338,6 +427,14 @@ def process_stylesheets(self, soup, baseurl):
         diskpath = unicode_path(os.path.join(self.current_dir, 'stylesheets'))
         if not os.path.exists(diskpath):
             os.mkdir(diskpath)
+        needed = []
+        for tag in soup.findAll(name='link', href=True):
+            if tag.get('type', '').lower() == 'text/css':
+                iurl = tag['href']
+                needed.append(iurl if urlsplit(iurl).scheme else urljoin(baseurl, iurl, False))
+        with self.stylemap_lock:
+            needed = [iurl for iurl in needed if iurl not in self.stylemap]
+        self.prefetch(needed)
         for c, tag in enumerate(soup.findAll(name=['link', 'style'])):
             try:
                 mtype = tag['type']
@@ -398,26 +495,85 @@ def process_stylesheets(self, soup, baseurl):
     def rescale_image(self, data):
         return rescale_image(data, self.scale_news_images, self.compress_news_images_max_size, self.compress_news_images_auto_size)
 
+    def process_image(self, data, itype, iurl):
+        from calibre.utils.img import image_from_data, image_to_data
+
+        # Ensure image is valid
+        img = image_from_data(data)
+        if itype not in {'png', 'jpg', 'jpeg'}:
+            itype = 'png' if itype == 'gif' else 'jpeg'
+            data = image_to_data(img, fmt=itype)
+        if self.compress_news_images:
+            try:
+                data = self.rescale_image(data)
+            except Exception:
+                self.log.exception('failed to compress image ' + iurl)
+        # Moon+ apparently cannot handle .jpeg files
+        if itype == 'jpeg':
+            itype = 'jpg'
+        return itype, data
+
+    def cached_process_image(self, data, itype, iurl):
+        if not self.processed_images_dir:
+            return self.process_image(data, itype, iurl)
+        settings = (self.compress_news_images, self.scale_news_images, self.compress_news_images_max_size, self.compress_news_images_auto_size)
+        key = hashlib.sha1(repr(settings).encode() + data).hexdigest()
+        for ext in ('jpg', 'png'):
+            path = os.path.join(self.processed_images_dir, key + '.' + ext)
+            try:
+                with open(path, 'rb') as f:
+                    ans = f.read()
+            except OSError:
+                continue
+            try:
+                # Used to prune unused images
+                os.utime(path)
+            except OSError:
+                pass
+            with self.stats_lock:
+                self.fetch_stats['reused_images'] += 1
+            return ext, ans
+        itype, data = self.process_image(data, itype, iurl)
+        path = os.path.join(self.processed_images_dir, key + '.' + itype)
+        tpath = f'{path}.{os.getpid()}-{threading.get_ident()}.tmp'
+        try:
+            os.makedirs(self.processed_images_dir, exist_ok=True)
+            with open(tpath, 'wb') as f:
+                f.write(data)
+            atomic_rename(tpath, path)
+        except OSError:
+            self.log.exception('Failed to store processed image ' + iurl)
+        return itype, data
+
     def process_images(self, soup, baseurl):
         diskpath = unicode_path(os.path.join(self.current_dir, 'images'))
         if not os.path.exists(diskpath):
             os.mkdir(diskpath)
         c = 0
+        images = []
         for tag in soup.findAll('img', src=True):
             iurl = tag['src']
-            if iurl.startswith('data:'):
-                try:
-                    data = urlopen(iurl).read()
-                except Exception:
-                    self.log.exception('Failed to decode embedded image')
-                    continue
-            else:
+            is_data_url = iurl.startswith('data:')
+            if not is_data_url:
                 if callable(self.image_url_processor):
                     iurl = self.image_url_processor(baseurl, iurl)
                     if not iurl:
                         continue
                 if not urlsplit(iurl).scheme:
                     iurl = urljoin(baseurl, iurl, False)
+            images.append((tag, iurl, is_data_url))
+        with self.imagemap_lock:
+            needed = [iurl for tag, iurl, is_data_url in images if not is_data_url and iurl not in self.imagemap]
+        self.prefetch(needed)
+
+        for tag, iurl, is_data_url in images:
+            if is_data_url:
+                try:
+                    data = urlopen(iurl).read()
+                except Exception:
+                    self.log.exception('Failed to decode embedded image')
+                    continue
+            else:
                 found_in_cache = False
                 with self.imagemap_lock:
                     if iurl in self.imagemap:
@@ -448,22 +604,8 @@ def process_images(self, soup, baseurl):
                     x.write(data)
                 tag['src'] = imgpath
             else:
-                from calibre.utils.img import image_from_data, image_to_data
-
                 try:
-                    # Ensure image is valid
-                    img = image_from_data(data)
-                    if itype not in {'png', 'jpg', 'jpeg'}:
-                        itype = 'png' if itype == 'gif' else 'jpeg'
-                        data = image_to_data(img, fmt=itype)
-                    if self.compress_news_images:
-                        try:
-                            data = self.rescale_image(data)
-                        except Exception:
-                            self.log.exception('failed to compress image ' + iurl)
-                    # Moon+ apparently cannot handle .jpeg files
-                    if itype == 'jpeg':
-                        itype = 'jpg'
+                    itype, data = self.cached_process_image(data, itype, iurl)
                     imgpath = os.path.join(diskpath, fname + '.' + itype)
                     with self.imagemap_lock:
                         self.imagemap[iurl] = imgpath
@@ -712,5 +854,143 @@ def main(args=sys.argv):
     fetcher.start_fetch(args[1])
 
 
+def find_tests():
+    import tempfile
+    import unittest
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    num_images = 8
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *a):
+            pass
+
+        def setup(self):
+            super().setup()
+            with self.server.lock:
+                self.server.connections += 1
+
+        def do_GET(self):
+            srv = self.server
+            with srv.lock:
+                srv.active += 1
+                srv.peak = max(srv.peak, srv.active)
+                srv.requests.append(self.path)
+            try:
+                if self.path == '/article.html':
+                    imgs = ''.join(f'<img src="/img{i}.svg">' for i in range(num_images))
+                    head = '<link rel="stylesheet" type="text/css" href="/style.css">'
+                    body = f'<html><head>{head}</head><body><p>Text</p>{imgs}<img src="img0.svg"></body></html>'
+                    ctype = 'text/html'
+                elif self.path == '/style.css':
+                    body, ctype = 'p { color: red }', 'text/css'
+                else:
+                    time.sleep(0.05)
+                    body, ctype = '<svg xmlns="http://www.w3.org/2000/svg" width="10" height="10"/>', 'image/svg+xml'
+                body = body.encode()
+                self.send_response(200)
+                self.send_header('Content-Type', ctype)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            finally:
+                with srv.lock:
+                    srv.active -= 1
+
+    class FetcherTest(unittest.TestCase):
+        def setUp(self):
+            from calibre.utils.http_cache import ConnectionPool
+
+            self.tdir = tempfile.TemporaryDirectory()
+            self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+            self.server.lock = threading.Lock()
+            self.server.connections = self.server.active = self.server.peak = 0
+            self.server.requests = []
+            threading.Thread(target=self.server.serve_forever, daemon=True).start()
+            self.url = f'http://127.0.0.1:{self.server.server_address[1]}/article.html'
+            self.pool = ConnectionPool()
+
+        def tearDown(self):
+            self.pool.close()
+            self.server.shutdown()
+            self.server.server_close()
+            self.tdir.cleanup()
+
+        def fetcher(self, *args, simultaneous=4):
+            options = option_parser().parse_args(['--base-dir', self.tdir.name] + list(args))[0]
+            options.browser = browser()
+            options.browser.set_connection_pool(self.pool)
+            options.simultaneous_resource_downloads = simultaneous
+            return RecursiveFetcher(options, Log(), image_map={}, css_map={})
+
+        def fetch(self, *args, simultaneous=4):
+            fetcher = self.fetcher(*args, simultaneous=simultaneous)
+            fetcher.show_progress = False
+            res = fetcher.start_fetch(self.url)
+            self.assertTrue(os.path.exists(res))
+            self.assertEqual(len(fetcher.imagemap), num_images)
+            self.assertEqual(len(fetcher.stylemap), 1)
+            # Images are only downloaded once
+            self.assertEqual(sorted(self.server.requests), sorted(['/article.html', '/style.css'] + [f'/img{i}.svg' for i in range(num_images)]))
+            self.assertEqual(fetcher.fetch_stats['requests'], num_images + 2)
+            return fetcher
+
+        def test_concurrent_fetch(self):
+            self.fetch()
+            self.assertGreater(self.server.peak, 1)
+            self.assertLessEqual(self.server.connections, 4)
+
+        def test_delay(self):
+            fetcher = self.fetch('--delay', '0.01')
+            self.assertEqual(self.server.peak, 1)
+            self.assertGreater(fetcher.fetch_stats['delay_time'], 0)
+
+        def test_processed_images(self):
+            processed_images_dir = os.path.join(self.tdir.name, 'processed')
+            processed = []
+
+            def fetcher():
+                ans = self.fetcher()
+                ans.processed_images_dir = processed_images_dir
+
+                def process_image(data, itype, iurl):
+                    processed.append(iurl)
+                    return 'jpg', b'processed ' + data
+
+                ans.process_image = process_image
+                return ans
+
+            f = fetcher()
+            self.assertEqual(f.cached_process_image(b'image', 'gif', 'u1'), ('jpg', b'processed image'))
+            # Images processed by an earlier download are reused
+            f = fetcher()
+            self.assertEqual(f.cached_process_image(b'image', 'gif', 'u2'), ('jpg', b'processed image'))
+            self.assertEqual(processed, ['u1'])
+            self.assertEqual(f.fetch_stats['reused_images'], 1)
+            # Different image data or processing settings are not reused
+            f.cached_process_image(b'other image', 'gif', 'u3')
+            f.compress_news_images = not f.compress_news_images
+            f.cached_process_image(b'image', 'gif', 'u4')
+            self.assertEqual(processed, ['u1', 'u3', 'u4'])
+            self.assertEqual(f.fetch_stats['reused_images'], 1)
+
+            # Only images that have not been used recently are pruned
+            names = sorted(os.listdir(processed_images_dir))
+            self.assertEqual(len(names), 3)
+            old = time.time() - 31 * 24 * 60 * 60
+            os.utime(os.path.join(processed_images_dir, names[0]), (old, old))
+            self.assertEqual(prune_processed_images(processed_images_dir), 1)
+            self.assertEqual(sorted(os.listdir(processed_images_dir)), names[1:])
+            self.assertEqual(prune_processed_images(processed_images_dir, max_age_days=60), 0)
+            for name in names[1:]:
+                os.utime(os.path.join(processed_images_dir, name), (old, old))
+            self.assertEqual(prune_processed_images(processed_images_dir), 2)
+            self.assertEqual(prune_processed_images(os.path.join(self.tdir.name, 'missing')), 0)
+
+    return unittest.defaultTestLoader.loadTestsFromTestCase(FetcherTest)
+
+
 if __name__ == '__main__':
     sys.exit(main())